@@ -13,24 +13,44 @@ import os
 import logging
 import json
 import time
+_import_started = time.monotonic()
+import random
 import socket
+import struct
+import select
+import bisect
+import ipaddress
+import signal
+import sys
+import functools
 import threading
-from datetime import datetime, timedelta
+import heapq
+import itertools
+from collections import OrderedDict, deque
+from contextlib import contextmanager, nullcontext
+from concurrent.futures import Future, ThreadPoolExecutor, TimeoutError as FutureTimeout, wait
+from datetime import datetime, timedelta, timezone
 from enum import Enum
-from typing import Optional, Dict, Any, Tuple
-from flask import Flask, request, jsonify
+from typing import Optional, Dict, Any, Tuple, Callable, List, Set
+from urllib.parse import urlparse
+from flask import Flask, Response, request, jsonify
 import requests
-from dataclasses import dataclass, asdict
-from kubernetes import client, config
+import yaml
+from requests.adapters import HTTPAdapter
+from dataclasses import dataclass, asdict, replace
+# kubernetes is imported where it is used: it is the slowest import by far and
+# only needed once the startup thread builds the API client
 
 # Configure logging
 logging.basicConfig(
-    level=logging.INFO,
+    level=os.getenv("LOG_LEVEL", "INFO").upper(),
     format='%(asctime)s - %(name)s - %(levelname)s - %(message)s'
 )
 logger = logging.getLogger(__name__)
 
 app = Flask(__name__)
+# Flask answers 413 past this; the production server enforces it too
+app.config["MAX_CONTENT_LENGTH"] = int(os.getenv("MAX_REQUEST_BODY_BYTES", str(1024 * 1024)))
 
 
 class DNSTarget(Enum):
@@ -56,89 +76,1762 @@ class FailoverState:
     current_target: DNSTarget
     system_state: SystemState
     last_change_time: str
+    # Failovers inside the circuit-breaker window, derived from TransitionHistory
     failover_count_24h: int = 0
     stabilization_start: Optional[str] = None
     last_alert_time: Optional[str] = None
+    # Pool member the record points at while on failover
+    vps_ip: Optional[str] = None
+
+    def to_dict(self) -> Dict[str, Any]:
+        """JSON-ready dict with enum values as strings"""
+        state_dict = asdict(self)
+        state_dict["current_target"] = self.current_target.value
+        state_dict["system_state"] = self.system_state.value
+        return state_dict
+
+
+@dataclass(frozen=True)
+class StateSnapshot:
+    """
+    Immutable, versioned view of a controller's state. Published by swapping
+    a single attribute, so readers never take a lock; `body` is the /state
+    response serialized once per version.
+    """
+    version: int
+    state: FailoverState
+    body: bytes
+
+
+class TransitionHistory:
+    """
+    Fixed-size ring buffer of DNS transitions (failover, failback, drift).
+    Failover timestamps inside the circuit-breaker window are kept in a
+    second deque; expired ones fall off its left end, so the window count is
+    amortized O(1) and ages out on its own. Only the newest entries are
+    persisted (as arrays), together with the window timestamps.
+    """
+
+    EPOCH = datetime(1970, 1, 1)
+    FIELDS = ("seq", "time", "kind", "from", "to", "reason")
+
+    def __init__(self, capacity: int = 100, window_seconds: float = 86400, counted_kind: str = "failover"):
+        self.entries: deque = deque(maxlen=capacity)
+        self.window: deque = deque(maxlen=capacity)
+        self.window_seconds = window_seconds
+        self.counted_kind = counted_kind
+        self.next_seq = 1
+        self.lock = threading.Lock()
+
+    @classmethod
+    def _epoch(cls, when: datetime) -> float:
+        return (when.replace(tzinfo=None) - cls.EPOCH).total_seconds()
+
+    def load(self, persisted: Any):
+        """Replace the buffer with a dump() (or a pre-compaction list of entry dicts)"""
+        if isinstance(persisted, dict):
+            entries = [dict(zip(self.FIELDS, row)) for row in persisted.get("entries", [])]
+            window = persisted.get("window")
+        else:
+            entries, window = persisted or [], None
+        with self.lock:
+            self.entries.clear()
+            self.window.clear()
+            self.entries.extend(entries)
+            if window is None:
+                window = [self._epoch(datetime.fromisoformat(entry["time"]))
+                          for entry in self.entries if entry["kind"] == self.counted_kind]
+            self.window.extend(window)
+            self.next_seq = self.entries[-1]["seq"] + 1 if self.entries else 1
+
+    def dump(self, limit: int) -> Dict[str, Any]:
+        """Compact persisted form: the newest `limit` entries as arrays plus the window timestamps"""
+        with self.lock:
+            start = max(len(self.entries) - limit, 0)
+            return {
+                "entries": [[self.entries[i][f] for f in self.FIELDS] for i in range(start, len(self.entries))],
+                "window": [round(t, 3) for t in self.window],
+            }
+
+    def record(self, kind: str, when: datetime, source: DNSTarget, target: DNSTarget, reason: str):
+        with self.lock:
+            self.entries.append({
+                "seq": self.next_seq,
+                "time": when.isoformat(),
+                "kind": kind,
+                "from": source.value,
+                "to": target.value,
+                "reason": reason,
+            })
+            self.next_seq += 1
+            if kind == self.counted_kind:
+                self.window.append(self._epoch(when))
+
+    def count(self, now: datetime) -> int:
+        """Transitions of the counted kind within the last window_seconds"""
+        cutoff = self._epoch(now) - self.window_seconds
+        with self.lock:
+            while self.window and self.window[0] <= cutoff:
+                self.window.popleft()
+            return len(self.window)
+
+    def oldest_in_window(self) -> Optional[float]:
+        with self.lock:
+            return self.window[0] if self.window else None
+
+    def page(self, limit: int, before: Optional[int] = None) -> Tuple[List[Dict[str, Any]], Optional[int]]:
+        """
+        Newest-first page of up to `limit` entries with seq < before.
+        Returns the entries and the cursor for the next page (None at the end).
+        Sequence numbers are contiguous, so the start index is computed directly.
+        """
+        with self.lock:
+            if not self.entries or limit <= 0:
+                return [], None
+            first = self.entries[0]["seq"]
+            end = len(self.entries) if before is None else max(0, min(before - first, len(self.entries)))
+            start = max(0, end - limit)
+            page = [self.entries[i] for i in range(end - 1, start - 1, -1)]
+            return page, (self.entries[start]["seq"] if start > 0 else None)
+
+
+@dataclass
+class ProbeResult:
+    """Outcome of a single reconcile probe"""
+    name: str
+    value: DNSTarget
+    duration_seconds: float
+    timed_out: bool = False
+    error: Optional[str] = None
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            "value": self.value.value,
+            "duration_seconds": round(self.duration_seconds, 4),
+            "timed_out": self.timed_out,
+            "error": self.error,
+        }
+
+
+@dataclass
+class ManagedHostname:
+    """One DNS record managed by the controller"""
+    hostname: str
+    tunnel_id: str
+    vps_ip: str
+    zone_id: str
+    stabilization_failover_minutes: float
+    stabilization_failback_minutes: float
+    state_key: str = "state.json"
+    # Synthetic probe specs ({group, url, interval_seconds, timeout_seconds}); None = defaults
+    probes: Optional[List[Dict[str, Any]]] = None
+    # Failover candidates; None = just vps_ip
+    vps_pool: Optional[List[str]] = None
+
+    @property
+    def vps_ips(self) -> List[str]:
+        return list(self.vps_pool) if self.vps_pool else [self.vps_ip]
+
+
+def load_managed_hostnames() -> List[ManagedHostname]:
+    """
+    Load managed hostnames from MANAGED_HOSTNAMES_FILE (YAML/JSON, usually a
+    mounted ConfigMap). Falls back to the single HOSTNAME/TUNNEL_ID/VPS_IP env vars.
+
+    File format:
+        defaults: {tunnel_id: ..., vps_ip: ..., zone_id: ...}
+        hostnames:
+          - hostname: mirai.sogos.io
+          - {hostname: api.sogos.io, vps_ip: 203.0.113.7}
+          - {hostname: www.sogos.io, vps_pool: [203.0.113.7, 198.51.100.4]}
+          - hostname: app.sogos.io
+            probes:
+              - {group: public, url: "https://app.sogos.io/healthz", interval_seconds: 2}
+              - {group: vps, url: "tcp://203.0.113.7:443"}
+    """
+    env_defaults = {
+        "tunnel_id": os.getenv("TUNNEL_ID", "cb2a7768-4162-4da9-ac04-138fdecf3e3d"),
+        "vps_ip": os.getenv("VPS_IP", "165.227.110.199"),
+        "zone_id": os.getenv("CLOUDFLARE_ZONE_ID"),
+        "stabilization_failover_minutes": float(os.getenv("STABILIZATION_FAILOVER_MINUTES", "1.5")),
+        "stabilization_failback_minutes": float(os.getenv("STABILIZATION_FAILBACK_MINUTES", "10")),
+    }
+
+    if os.getenv("VPS_POOL"):
+        env_defaults["vps_pool"] = [ip.strip() for ip in os.getenv("VPS_POOL").split(",") if ip.strip()]
+
+    path = os.getenv("MANAGED_HOSTNAMES_FILE")
+    if not path:
+        return [ManagedHostname(hostname=os.getenv("HOSTNAME", "mirai.sogos.io"), **env_defaults)]
+
+    with open(path) as f:
+        spec = yaml.safe_load(f) or {}
+    defaults = {**env_defaults, **(spec.get("defaults") or {})}
+
+    targets = []
+    for entry in spec.get("hostnames", []):
+        if isinstance(entry, str):
+            entry = {"hostname": entry}
+        merged = {**defaults, **entry}
+        merged.setdefault("state_key", f"{merged['hostname']}.json")
+        targets.append(ManagedHostname(**merged))
+
+    if not targets:
+        raise ValueError(f"No hostnames configured in {path}")
+    logger.info(f"Loaded {len(targets)} managed hostnames from {path}")
+    return targets
+
+
+class IPRangeIndex:
+    """
+    Sorted, merged integer intervals per address family for CIDR membership.
+    Lookups are a bisect (O(log n)) for IPv4 and IPv6 alike. The ranges file
+    is re-read when its mtime changes, so edits apply without a restart.
+    """
+
+    def __init__(self, path: Optional[str] = None, check_interval: float = 5.0):
+        self.path = path
+        self.check_interval = check_interval
+        self.starts: Dict[int, List[int]] = {4: [], 6: []}
+        self.ends: Dict[int, List[int]] = {4: [], 6: []}
+        self.mtime: Optional[float] = None
+        self.last_check = 0.0
+        self.lock = threading.Lock()
+        if path:
+            self.reload()
+
+    @classmethod
+    def from_cidrs(cls, cidrs: List[str]) -> "IPRangeIndex":
+        index = cls()
+        index._build(cidrs)
+        return index
+
+    def _build(self, cidrs: List[str]):
+        intervals: Dict[int, List[Tuple[int, int]]] = {4: [], 6: []}
+        for cidr in cidrs:
+            net = ipaddress.ip_network(cidr, strict=False)
+            intervals[net.version].append((int(net.network_address), int(net.broadcast_address)))
+
+        starts: Dict[int, List[int]] = {}
+        ends: Dict[int, List[int]] = {}
+        for version, ranges in intervals.items():
+            merged: List[List[int]] = []
+            for start, end in sorted(ranges):
+                if merged and start <= merged[-1][1] + 1:
+                    merged[-1][1] = max(merged[-1][1], end)
+                else:
+                    merged.append([start, end])
+            starts[version] = [r[0] for r in merged]
+            ends[version] = [r[1] for r in merged]
+
+        # Swap both tables at once so readers never see a half-built index
+        self.starts, self.ends = starts, ends
+
+    def reload(self):
+        """(Re)load CIDRs from the ranges file - one per line, '#' comments"""
+        with open(self.path) as f:
+            cidrs = [line.split("#", 1)[0].strip() for line in f]
+        self._build([c for c in cidrs if c])
+        self.mtime = os.path.getmtime(self.path)
+        logger.info(f"Loaded {sum(len(v) for v in self.starts.values())} IP intervals from {self.path}")
+
+    def reload_if_changed(self):
+        """Cheap mtime check, rate-limited to once per check_interval"""
+        if not self.path:
+            return
+        now = time.monotonic()
+        if now - self.last_check < self.check_interval:
+            return
+        with self.lock:
+            self.last_check = now
+            try:
+                if os.path.getmtime(self.path) != self.mtime:
+                    self.reload()
+            except Exception as e:
+                logger.error(f"Failed to reload IP ranges from {self.path}: {e}")
+
+    @staticmethod
+    def _parse(ip: str) -> Optional[Tuple[int, int]]:
+        """(version, integer) for an address string; inet_pton is much cheaper than ipaddress"""
+        try:
+            return 4, int.from_bytes(socket.inet_pton(socket.AF_INET, ip), "big")
+        except OSError:
+            pass
+        try:
+            # Drop any zone id (fe80::1%eth0)
+            return 6, int.from_bytes(socket.inet_pton(socket.AF_INET6, ip.split("%", 1)[0]), "big")
+        except OSError:
+            return None
+
+    def contains(self, ip: str) -> bool:
+        parsed = self._parse(ip)
+        if parsed is None:
+            return False
+        version, value = parsed
+        i = bisect.bisect_right(self.starts[version], value) - 1
+        return i >= 0 and value <= self.ends[version][i]
+
+    def classify_many(self, ips: List[str]) -> List[bool]:
+        """Membership for a batch of addresses"""
+        return [self.contains(ip) for ip in ips]
+
+
+CLOUDFLARE_RANGES_FILE = os.getenv(
+    "CLOUDFLARE_RANGES_FILE",
+    os.path.join(os.path.dirname(os.path.abspath(__file__)), "cloudflare-ranges.txt")
+)
+_cloudflare_ranges: Optional[IPRangeIndex] = None
+
+
+def get_cloudflare_ranges() -> IPRangeIndex:
+    """Process-wide Cloudflare range index, shared by every DNSChecker"""
+    global _cloudflare_ranges
+    if _cloudflare_ranges is None:
+        _cloudflare_ranges = IPRangeIndex(CLOUDFLARE_RANGES_FILE)
+    return _cloudflare_ranges
+
+
+@dataclass
+class ResolverAnswer:
+    """One resolver's answer for a hostname"""
+    resolver: str
+    addresses: List[str]
+    ttl: Optional[int]
+    latency_seconds: float
+    transport: str = "udp"
+    error: Optional[str] = None
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            "resolver": self.resolver,
+            "addresses": self.addresses,
+            "ttl": self.ttl,
+            "latency_ms": round(self.latency_seconds * 1000, 2),
+            "transport": self.transport,
+            "error": self.error,
+        }
+
+
+class DNSClient:
+    """
+    Minimal stub DNS client (RFC 1035) - A/AAAA over UDP with TCP fallback
+    on truncation. Talks to resolvers directly so answers bypass the pod's
+    resolver, NodeLocal DNSCache and CoreDNS.
+    """
+
+    QTYPES = {"A": 1, "AAAA": 28}
+
+    @staticmethod
+    def build_query(query_id: int, name: str, qtype: int) -> bytes:
+        header = struct.pack("!HHHHHH", query_id, 0x0100, 1, 0, 0, 0)  # RD=1
+        qname = b"".join(bytes([len(label)]) + label.encode("idna")
+                         for label in name.rstrip(".").split(".")) + b"\x00"
+        return header + qname + struct.pack("!HH", qtype, 1)
+
+    @staticmethod
+    def _skip_name(msg: bytes, offset: int) -> int:
+        while True:
+            length = msg[offset]
+            if length & 0xC0 == 0xC0:  # compression pointer
+                return offset + 2
+            offset += 1
+            if length == 0:
+                return offset
+            offset += length
+
+    @classmethod
+    def parse_response(cls, msg: bytes) -> Tuple[int, bool, int, List[str], Optional[int]]:
+        """Returns (id, truncated, rcode, addresses, min TTL of address records)"""
+        query_id, flags, qdcount, ancount, _, _ = struct.unpack("!HHHHHH", msg[:12])
+        truncated = bool(flags & 0x0200)
+        rcode = flags & 0x000F
+        offset = 12
+        for _ in range(qdcount):
+            offset = cls._skip_name(msg, offset) + 4
+
+        addresses: List[str] = []
+        ttl: Optional[int] = None
+        for _ in range(ancount):
+            offset = cls._skip_name(msg, offset)
+            rtype, _, rttl, rdlength = struct.unpack("!HHIH", msg[offset:offset + 10])
+            offset += 10
+            rdata = msg[offset:offset + rdlength]
+            offset += rdlength
+            if rtype == 1 and rdlength == 4:
+                addresses.append(socket.inet_ntop(socket.AF_INET, rdata))
+            elif rtype == 28 and rdlength == 16:
+                addresses.append(socket.inet_ntop(socket.AF_INET6, rdata))
+            else:
+                continue  # CNAME chain etc.
+            ttl = rttl if ttl is None else min(ttl, rttl)
+        return query_id, truncated, rcode, addresses, ttl
+
+    def _query_tcp(self, address: Tuple, family: int, query: bytes, timeout: float) -> bytes:
+        with socket.socket(family, socket.SOCK_STREAM) as sock:
+            sock.settimeout(timeout)
+            sock.connect(address)
+            sock.sendall(struct.pack("!H", len(query)) + query)
+            length = struct.unpack("!H", self._recv_exact(sock, 2))[0]
+            return self._recv_exact(sock, length)
+
+    @staticmethod
+    def _recv_exact(sock: socket.socket, n: int) -> bytes:
+        data = b""
+        while len(data) < n:
+            chunk = sock.recv(n - len(data))
+            if not chunk:
+                raise ConnectionError("DNS TCP connection closed")
+            data += chunk
+        return data
+
+    def resolve(self, server: Tuple[str, int], name: str, qtypes: List[str],
+                timeout: float = 2.0) -> Tuple[List[str], Optional[int], str]:
+        """
+        Send every qtype at once on one UDP socket; retry truncated answers
+        over TCP. Returns (addresses, min TTL, transport used).
+        """
+        info = socket.getaddrinfo(server[0], server[1], type=socket.SOCK_DGRAM)[0]
+        family, address = info[0], info[4]
+        deadline = time.monotonic() + timeout
+
+        pending: Dict[int, bytes] = {}
+        for qtype in qtypes:
+            query_id = random.getrandbits(16)
+            while query_id in pending:
+                query_id = random.getrandbits(16)
+            pending[query_id] = self.build_query(query_id, name, self.QTYPES[qtype])
+
+        addresses: List[str] = []
+        ttl: Optional[int] = None
+        transport = "udp"
+        truncated: List[bytes] = []
+
+        with socket.socket(family, socket.SOCK_DGRAM) as sock:
+            sock.connect(address)
+            for query in pending.values():
+                sock.send(query)
+            while pending:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0 or not select.select([sock], [], [], remaining)[0]:
+                    raise TimeoutError(f"no answer from {server[0]}:{server[1]}")
+                msg = sock.recv(65535)
+                query_id, is_truncated, rcode, found, found_ttl = self.parse_response(msg)
+                query = pending.pop(query_id, None)
+                if query is None:
+                    continue  # stray or spoofed response
+                if is_truncated:
+                    truncated.append(query)
+                    continue
+                if rcode not in (0, 3):  # NOERROR / NXDOMAIN
+                    raise RuntimeError(f"rcode {rcode} from {server[0]}")
+                addresses.extend(found)
+                if found_ttl is not None:
+                    ttl = found_ttl if ttl is None else min(ttl, found_ttl)
+
+        for query in truncated:
+            transport = "tcp"
+            msg = self._query_tcp(address, family, query, max(deadline - time.monotonic(), 0.1))
+            _, _, rcode, found, found_ttl = self.parse_response(msg)
+            if rcode not in (0, 3):
+                raise RuntimeError(f"rcode {rcode} from {server[0]} (tcp)")
+            addresses.extend(found)
+            if found_ttl is not None:
+                ttl = found_ttl if ttl is None else min(ttl, found_ttl)
+
+        return addresses, ttl, transport
+
+
+def parse_resolver(spec: str) -> Tuple[str, int]:
+    """'1.1.1.1', 'ns.example.com:53', '[2606:4700::1111]:53' -> (host, port)"""
+    spec = spec.strip()
+    if spec.startswith("["):
+        host, _, port = spec[1:].partition("]")
+        return host, int(port.lstrip(":") or 53)
+    if spec.count(":") == 1:
+        host, port = spec.split(":")
+        return host, int(port)
+    return spec, 53
+
+
+class MultiResolver:
+    """Queries a set of resolvers/authoritative servers in parallel"""
+
+    def __init__(self, resolvers: List[str], quorum: Optional[int] = None,
+                 timeout: float = 2.0, qtypes: Optional[List[str]] = None):
+        self.resolvers = [parse_resolver(r) for r in resolvers]
+        self.quorum = quorum or len(self.resolvers) // 2 + 1
+        self.timeout = timeout
+        self.qtypes = qtypes or ["A", "AAAA"]
+        self.client = DNSClient()
+        self.executor = ThreadPoolExecutor(max_workers=max(4, len(self.resolvers) * 4),
+                                           thread_name_prefix="dns")
+
+    def _ask(self, server: Tuple[str, int], hostname: str) -> ResolverAnswer:
+        label = f"{server[0]}:{server[1]}"
+        start = time.monotonic()
+        with tracer.span("dns.query", resolver=label, hostname=hostname) as span:
+            try:
+                addresses, ttl, transport = self.client.resolve(server, hostname, self.qtypes, self.timeout)
+                span["transport"] = transport
+                return ResolverAnswer(label, addresses, ttl, time.monotonic() - start, transport)
+            except Exception as e:
+                span["error"] = str(e)
+                return ResolverAnswer(label, [], None, time.monotonic() - start, error=str(e))
+
+    def resolve(self, hostname: str) -> List[ResolverAnswer]:
+        ask = tracer.wrap(self._ask)
+        futures = [self.executor.submit(ask, server, hostname) for server in self.resolvers]
+        return [f.result() for f in futures]
+
+
+_dns_resolvers: Optional[MultiResolver] = None
+
+
+def get_dns_resolvers() -> Optional[MultiResolver]:
+    """
+    Process-wide resolver set from DNS_RESOLVERS (comma separated, host[:port]).
+    Empty means fall back to the system resolver.
+    """
+    global _dns_resolvers
+    if _dns_resolvers is None:
+        resolvers = [r for r in os.getenv("DNS_RESOLVERS", "1.1.1.1,8.8.8.8,9.9.9.9").split(",") if r.strip()]
+        if not resolvers:
+            return None
+        quorum = os.getenv("DNS_QUORUM")
+        _dns_resolvers = MultiResolver(
+            resolvers,
+            quorum=int(quorum) if quorum else None,
+            timeout=float(os.getenv("DNS_QUERY_TIMEOUT_SECONDS", "2")),
+        )
+    return _dns_resolvers
 
 
 class DNSChecker:
     """Checks actual DNS state via resolution"""
 
-    def __init__(self, hostname: str, vps_ip: str):
+    def __init__(self, hostname: str, vps_ips: List[str], cloudflare_ranges: Optional[IPRangeIndex] = None,
+                 resolvers: Optional[MultiResolver] = None):
         self.hostname = hostname
-        self.vps_ip = vps_ip
-        # Cloudflare's IP ranges (common ones)
-        self.cloudflare_ip_prefixes = [
-            "104.16.", "104.17.", "104.18.", "104.19.", "104.20.", "104.21.",
-            "104.22.", "104.23.", "104.24.", "104.25.", "104.26.", "104.27.",
-            "172.64.", "172.65.", "172.66.", "172.67.", "172.68.", "172.69.",
-            "173.245.", "188.114.", "190.93.", "197.234.", "198.41."
-        ]
+        self.vps_ips = set(vps_ips)
+        # Cloudflare's published IPv4/IPv6 ranges
+        self.cloudflare_ranges = cloudflare_ranges or get_cloudflare_ranges()
+        # Direct resolvers (None = system resolver via getaddrinfo)
+        self.resolvers = resolvers if resolvers is not None else get_dns_resolvers()
+        self.last_answers: List[ResolverAnswer] = []
+
+    def classify(self, resolved_ips: List[str]) -> DNSTarget:
+        """Map a set of resolved addresses to a DNS target"""
+        # Check if any IP is one of the VPS pool
+        if not self.vps_ips.isdisjoint(resolved_ips):
+            return DNSTarget.VPS_FAILOVER
+
+        # Check if any IP (v4 or v6) is in a Cloudflare range
+        self.cloudflare_ranges.reload_if_changed()
+        if any(self.cloudflare_ranges.classify_many(resolved_ips)):
+            return DNSTarget.CLOUDFLARE_TUNNEL
+
+        return DNSTarget.UNKNOWN
+
+    def _quorum_target(self) -> DNSTarget:
+        """Ask every resolver in parallel; a target needs a quorum of votes"""
+        self.last_answers = self.resolvers.resolve(self.hostname)
+        votes: Dict[DNSTarget, int] = {}
+        for answer in self.last_answers:
+            if answer.error:
+                logger.debug(f"Resolver {answer.resolver} failed for {self.hostname}: {answer.error}")
+                continue
+            target = self.classify(answer.addresses)
+            votes[target] = votes.get(target, 0) + 1
+
+        if logger.isEnabledFor(logging.DEBUG):
+            logger.debug(f"DNS votes for {self.hostname}: { {t.value: n for t, n in votes.items()} }")
+        for target, count in votes.items():
+            if target != DNSTarget.UNKNOWN and count >= self.resolvers.quorum:
+                return target
+
+        logger.warning(f"No DNS quorum for {self.hostname} "
+                       f"({self.resolvers.quorum} needed): { {t.value: n for t, n in votes.items()} }")
+        return DNSTarget.UNKNOWN
 
     def get_actual_dns_target(self) -> DNSTarget:
         """
         Determine actual DNS target by resolving the hostname.
         Returns:
-            DNSTarget.VPS_FAILOVER if resolves to VPS IP
+            DNSTarget.VPS_FAILOVER if resolves to a VPS pool IP
             DNSTarget.CLOUDFLARE_TUNNEL if resolves to Cloudflare IPs
             DNSTarget.UNKNOWN if cannot determine
         """
         try:
+            if self.resolvers is not None:
+                return self._quorum_target()
+
             # Resolve hostname using system DNS
             ips = socket.getaddrinfo(self.hostname, None)
             resolved_ips = [ip[4][0] for ip in ips]
 
-            logger.debug(f"DNS resolution for {self.hostname}: {resolved_ips}")
+            if logger.isEnabledFor(logging.DEBUG):
+                logger.debug(f"DNS resolution for {self.hostname}: {resolved_ips}")
 
-            # Check if any IP is the VPS IP
-            if self.vps_ip in resolved_ips:
-                return DNSTarget.VPS_FAILOVER
-
-            # Check if any IP is in Cloudflare range
-            for ip in resolved_ips:
-                for prefix in self.cloudflare_ip_prefixes:
-                    if ip.startswith(prefix):
-                        return DNSTarget.CLOUDFLARE_TUNNEL
-
-            logger.warning(f"DNS resolved to unknown IPs: {resolved_ips}")
-            return DNSTarget.UNKNOWN
+            target = self.classify(resolved_ips)
+            if target == DNSTarget.UNKNOWN:
+                logger.warning(f"DNS resolved to unknown IPs: {resolved_ips}")
+            return target
 
         except Exception as e:
             logger.error(f"Error resolving DNS for {self.hostname}: {e}")
             return DNSTarget.UNKNOWN
 
 
+class Clock:
+    """Time source for timers and state timestamps; swap for ManualClock in tests"""
+
+    # Background consumers (reconcile queue) only start on a real clock
+    realtime = True
+
+    def monotonic(self) -> float:
+        return time.monotonic()
+
+    def utcnow(self) -> datetime:
+        return datetime.utcnow()
+
+
+class ManualClock(Clock):
+    """Deterministic clock that only moves when advance() is called"""
+
+    realtime = False
+
+    def __init__(self, start: Optional[datetime] = None):
+        self.now = 0.0
+        self.epoch = start or datetime(2025, 1, 1)
+
+    def monotonic(self) -> float:
+        return self.now
+
+    def utcnow(self) -> datetime:
+        return self.epoch + timedelta(seconds=self.now)
+
+    def advance(self, seconds: float):
+        self.now += seconds
+
+
+class TimerScheduler:
+    """
+    Keyed one-shot timers on a min-heap. A background thread sleeps until the
+    earliest deadline; re-scheduling a key replaces its previous timer.
+    With a ManualClock, call run_due() after advancing the clock instead.
+    """
+
+    def __init__(self, clock: Optional[Clock] = None):
+        self.clock = clock or Clock()
+        self.heap: List[Tuple[float, int, str]] = []
+        self.timers: Dict[str, Tuple[float, int, Callable[[], None]]] = {}
+        self.counter = itertools.count()
+        self.cond = threading.Condition()
+        self._thread: Optional[threading.Thread] = None
+
+    def schedule(self, key: str, delay: float, callback: Callable[[], None]):
+        """Arm (or re-arm) timer `key` to fire after `delay` seconds"""
+        with self.cond:
+            deadline = self.clock.monotonic() + max(delay, 0)
+            seq = next(self.counter)
+            self.timers[key] = (deadline, seq, callback)
+            heapq.heappush(self.heap, (deadline, seq, key))
+            self.cond.notify()
+
+    def cancel(self, key: str):
+        with self.cond:
+            self.timers.pop(key, None)  # heap entry is skipped lazily
+
+    def deadline(self, key: str) -> Optional[float]:
+        """Seconds until `key` fires, or None if not armed"""
+        with self.cond:
+            timer = self.timers.get(key)
+            return None if timer is None else max(timer[0] - self.clock.monotonic(), 0)
+
+    def _pop_due(self) -> List[Callable[[], None]]:
+        due = []
+        now = self.clock.monotonic()
+        while self.heap and self.heap[0][0] <= now:
+            deadline, seq, key = heapq.heappop(self.heap)
+            timer = self.timers.get(key)
+            if timer and timer[1] == seq:
+                del self.timers[key]
+                due.append(timer[2])
+        return due
+
+    def run_due(self) -> int:
+        """Fire every timer whose deadline has passed; returns how many fired"""
+        with self.cond:
+            due = self._pop_due()
+        for callback in due:
+            try:
+                callback()
+            except Exception as e:
+                logger.error(f"Timer callback failed: {e}", exc_info=True)
+        return len(due)
+
+    def run(self):
+        while True:
+            with self.cond:
+                # Drop cancelled/replaced entries sitting at the top
+                while self.heap and self.timers.get(self.heap[0][2], (None, None))[1] != self.heap[0][1]:
+                    heapq.heappop(self.heap)
+                timeout = self.heap[0][0] - self.clock.monotonic() if self.heap else None
+                if timeout is None or timeout > 0:
+                    self.cond.wait(timeout)
+                    continue
+            self.run_due()
+
+    def start(self):
+        """Start the timer thread (idempotent)"""
+        if self._thread is None:
+            self._thread = threading.Thread(target=self.run, daemon=True)
+            self._thread.start()
+
+
+class TTLCache:
+    """Bounded set of recently seen keys that expire after `ttl` seconds"""
+
+    def __init__(self, ttl: float, max_size: int = 10000, clock: Optional[Clock] = None):
+        self.ttl = ttl
+        self.max_size = max_size
+        self.clock = clock or Clock()
+        self.entries: "OrderedDict[str, float]" = OrderedDict()
+        self.lock = threading.Lock()
+        self.hits = 0
+
+    def seen(self, key: str) -> bool:
+        """True if `key` was recorded within the TTL; records it either way"""
+        now = self.clock.monotonic()
+        with self.lock:
+            # Entries are in insertion order, so expired ones are at the front
+            while self.entries and next(iter(self.entries.values())) <= now:
+                self.entries.popitem(last=False)
+            if key in self.entries:
+                self.hits += 1
+                return True
+            self.entries[key] = now + self.ttl
+            if len(self.entries) > self.max_size:
+                self.entries.popitem(last=False)
+            return False
+
+    def __len__(self) -> int:
+        return len(self.entries)
+
+
+class LogSampler:
+    """
+    At most one log line per key per `interval` seconds. The line that gets
+    through reports how many were suppressed since the previous one.
+    """
+
+    def __init__(self, interval: float, clock: Optional[Clock] = None):
+        self.interval = interval
+        self.clock = clock or Clock()
+        self.last: Dict[str, float] = {}
+        self.suppressed: Dict[str, int] = {}
+        self.lock = threading.Lock()
+
+    def allow(self, key: str) -> Optional[int]:
+        """Suppressed count since the last line if `key` may log now, else None"""
+        now = self.clock.monotonic()
+        with self.lock:
+            last = self.last.get(key)
+            if last is not None and now - last < self.interval:
+                self.suppressed[key] = self.suppressed.get(key, 0) + 1
+                return None
+            self.last[key] = now
+            return self.suppressed.pop(key, 0)
+
+
+def parse_alerts(body: bytes) -> List[Dict[str, Any]]:
+    """
+    Alertmanager webhook body -> just the alert fields routing uses
+    (status, fingerprint, alertname/hostname labels). Raises ValueError if malformed.
+    """
+    payload = json.loads(body)
+    if not isinstance(payload, dict) or not isinstance(payload.get("alerts", []), list):
+        raise ValueError("expected an Alertmanager webhook payload")
+    alerts = []
+    for alert in payload.get("alerts", []):
+        labels = (alert.get("labels") or {}) if isinstance(alert, dict) else None
+        if not isinstance(labels, dict):
+            raise ValueError("alerts must be objects with a labels object")
+        alerts.append({
+            "status": alert.get("status", ""),
+            "fingerprint": alert.get("fingerprint"),
+            "labels": {k: labels[k] for k in ("alertname", "hostname") if k in labels},
+        })
+    return alerts
+
+
+def log_alerts(alerts: List[Dict[str, Any]], sampler: LogSampler):
+    """One line per (alertname, status) per sampling interval, however many alerts arrive"""
+    for alert in alerts:
+        name, status = alert.get("labels", {}).get("alertname", ""), alert.get("status", "")
+        suppressed = sampler.allow(f"{name}:{status}")
+        if suppressed is not None:
+            logger.info(f"Received alert: {name} ({status}) - triggering reconciliation"
+                        + (f" (+{suppressed} more since last logged)" if suppressed else ""))
+
+
+def filter_new_alerts(alerts: List[Dict[str, Any]], dedup: TTLCache) -> List[Dict[str, Any]]:
+    """Drop alerts whose Alertmanager (fingerprint, status) was already seen within the TTL"""
+    fresh = []
+    for alert in alerts:
+        fingerprint = alert.get("fingerprint")
+        if fingerprint and dedup.seen(f"{fingerprint}:{alert.get('status', '')}"):
+            continue
+        fresh.append(alert)
+    return fresh
+
+
+class ReconcileQueue:
+    """
+    Single-consumer, coalescing work queue for reconcile triggers.
+    At most one reconcile per key is ever queued; a pending "all" request
+    absorbs per-hostname ones. Runs of the same key are spaced by at least
+    `min_interval` seconds. With a ManualClock nothing runs until
+    run_pending() is called.
+    """
+
+    ALL = "*"
+
+    def __init__(self, min_interval: float = 1.0, clock: Optional[Clock] = None):
+        self.min_interval = min_interval
+        self.clock = clock or Clock()
+        self.pending: "OrderedDict[str, Callable[[], None]]" = OrderedDict()
+        self.last_run: Dict[str, float] = {}
+        self.cond = threading.Condition()
+        self.counters = {"submitted": 0, "coalesced": 0, "executed": 0, "failed": 0}
+        self._thread: Optional[threading.Thread] = None
+
+    def submit(self, key: str, fn: Callable[[], None], reason: str = "") -> bool:
+        """Queue `fn` under `key`; returns False if it merged into a pending request"""
+        with self.cond:
+            self.counters["submitted"] += 1
+            if key in self.pending or self.ALL in self.pending:
+                self.counters["coalesced"] += 1
+                return False
+            if key == self.ALL:
+                # Everything already queued is covered by reconciling all
+                self.counters["coalesced"] += len(self.pending)
+                self.pending.clear()
+            self.pending[key] = fn
+            self.cond.notify()
+        if logger.isEnabledFor(logging.DEBUG):
+            logger.debug(f"Queued reconcile for {key}" + (f" ({reason})" if reason else ""))
+        if self.clock.realtime:
+            self.start()
+        return True
+
+    def _next_ready(self) -> Tuple[Optional[str], float]:
+        """(key ready to run, or None; seconds until the earliest becomes ready)"""
+        now = self.clock.monotonic()
+        wait_for = float("inf")
+        for key in self.pending:
+            ready_at = self.last_run.get(key, float("-inf")) + self.min_interval
+            if ready_at <= now:
+                return key, 0
+            wait_for = min(wait_for, ready_at - now)
+        return None, wait_for
+
+    def run_pending(self) -> int:
+        """Run every queued item that is allowed to run now; returns how many ran"""
+        ran = 0
+        while True:
+            with self.cond:
+                key, _ = self._next_ready()
+                if key is None:
+                    return ran
+                fn = self.pending.pop(key)
+                self.last_run[key] = self.clock.monotonic()
+            try:
+                fn()
+                self.counters["executed"] += 1
+            except Exception as e:
+                self.counters["failed"] += 1
+                logger.error(f"Queued reconcile for {key} failed: {e}", exc_info=True)
+            ran += 1
+
+    def run(self):
+        while True:
+            with self.cond:
+                key, wait_for = self._next_ready()
+                if key is None:
+                    self.cond.wait(None if wait_for == float("inf") else wait_for)
+                    continue
+            self.run_pending()
+
+    def start(self):
+        """Start the consumer thread (idempotent)"""
+        if self._thread is None:
+            with self.cond:
+                if self._thread is None:
+                    self._thread = threading.Thread(target=self.run, daemon=True)
+                    self._thread.start()
+
+    def stats(self) -> Dict[str, Any]:
+        with self.cond:
+            return {"depth": len(self.pending), **self.counters}
+
+
+class LatencyHistogram:
+    """Fixed-bucket cumulative histogram (seconds)"""
+
+    DEFAULT_BUCKETS = (1, 2, 5, 10, 30, 60, 120, 300, 600, 900)
+
+    def __init__(self, buckets: Tuple[float, ...] = DEFAULT_BUCKETS):
+        self.buckets = tuple(buckets)
+        self.counts = [0] * (len(self.buckets) + 1)  # last slot is +Inf
+        self.count = 0
+        self.sum = 0.0
+
+    def observe(self, value: float):
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.count += 1
+        self.sum += value
+
+    def to_dict(self) -> Dict[str, Any]:
+        cumulative, running = {}, 0
+        for bound, n in zip(self.buckets + (float("inf"),), self.counts):
+            running += n
+            cumulative["+Inf" if bound == float("inf") else str(bound)] = running
+        return {"count": self.count, "sum": round(self.sum, 3), "buckets": cumulative}
+
+
+class Metrics:
+    """
+    Minimal Prometheus registry (text exposition format 0.0.4).
+    Counters and histograms are plain dict updates under one lock; gauges are
+    computed by collectors at scrape time, so they cost nothing between scrapes.
+    """
+
+    LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30)
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.meta: Dict[str, Tuple[str, str]] = {}
+        self.counters: Dict[Tuple[str, Tuple], float] = {}
+        self.histograms: Dict[Tuple[str, Tuple], LatencyHistogram] = {}
+        self.collectors: List[Callable[[], List[Tuple[str, Dict[str, str], float]]]] = []
+
+    def describe(self, name: str, kind: str, help_text: str):
+        self.meta[name] = (kind, help_text)
+
+    def inc(self, name: str, value: float = 1, **labels):
+        key = (name, tuple(sorted(labels.items())))
+        with self.lock:
+            self.counters[key] = self.counters.get(key, 0) + value
+
+    def observe(self, name: str, value: float, **labels):
+        key = (name, tuple(sorted(labels.items())))
+        with self.lock:
+            histogram = self.histograms.get(key)
+            if histogram is None:
+                histogram = self.histograms[key] = LatencyHistogram(self.LATENCY_BUCKETS)
+            histogram.observe(value)
+
+    @contextmanager
+    def timer(self, name: str, **labels):
+        start = time.monotonic()
+        try:
+            yield
+        finally:
+            self.observe(name, time.monotonic() - start, **labels)
+
+    def add_collector(self, collector: Callable[[], List[Tuple[str, Dict[str, str], float]]]):
+        """Register a callable returning (name, labels, value) gauge samples"""
+        self.collectors.append(collector)
+
+    @staticmethod
+    def _labels(pairs) -> str:
+        if not pairs:
+            return ""
+        escaped = []
+        for k, v in pairs:
+            v = str(v).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+            escaped.append(f'{k}="{v}"')
+        return "{" + ",".join(escaped) + "}"
+
+    def render(self) -> str:
+        with self.lock:
+            counters = dict(self.counters)
+            histograms = {key: (h.buckets, list(h.counts), h.count, h.sum)
+                          for key, h in self.histograms.items()}
+
+        samples: Dict[str, List[str]] = {}
+        for (name, labels), value in counters.items():
+            samples.setdefault(name, []).append(f"{name}{self._labels(labels)} {value}")
+        for (name, labels), (buckets, counts, count, total) in histograms.items():
+            lines = samples.setdefault(name, [])
+            running = 0
+            for bound, n in zip(buckets + (float("inf"),), counts):
+                running += n
+                le = "+Inf" if bound == float("inf") else repr(float(bound))
+                lines.append(f"{name}_bucket{self._labels(labels + (('le', le),))} {running}")
+            lines.append(f"{name}_sum{self._labels(labels)} {total}")
+            lines.append(f"{name}_count{self._labels(labels)} {count}")
+        for collector in self.collectors:
+            try:
+                for name, labels, value in collector():
+                    samples.setdefault(name, []).append(
+                        f"{name}{self._labels(sorted(labels.items()))} {value}")
+            except Exception as e:
+                logger.error(f"Metrics collector failed: {e}")
+
+        out = []
+        for name in sorted(samples):
+            kind, help_text = self.meta.get(name, ("untyped", ""))
+            out.append(f"# HELP {name} {help_text}")
+            out.append(f"# TYPE {name} {kind}")
+            out.extend(samples[name])
+        return "\n".join(out) + "\n"
+
+
+metrics = Metrics()
+metrics.describe("dns_failover_reconcile_duration_seconds", "histogram", "Duration of one hostname reconcile")
+metrics.describe("dns_failover_probe_duration_seconds", "histogram",
+                 "Duration of outbound probes (dns, cloudflare_get, cloudflare_put, cloudflare_batch, pod_list, cloudflared_scrape, synthetic_<group>)")
+metrics.describe("dns_failover_cloudflare_requests_total", "counter", "Cloudflare DNS write requests by kind (put, batch)")
+metrics.describe("dns_failover_cloudflare_throttle_seconds", "histogram", "Time spent waiting for the client-side Cloudflare rate limiter")
+metrics.describe("dns_failover_drift_detections_total", "counter", "Cloudflare API target differed from controller state")
+metrics.describe("dns_failover_failovers_total", "counter", "DNS switches to the VPS")
+metrics.describe("dns_failover_failbacks_total", "counter", "DNS switches back to the tunnel")
+metrics.describe("dns_failover_vps_switches_total", "counter", "Failover record moved to another VPS pool member")
+metrics.describe("dns_failover_dual_failures_total", "counter", "Tunnel and every VPS pool member unhealthy at once")
+metrics.describe("dns_failover_circuit_breaker_trips_total", "counter", "Failovers blocked by the circuit breaker")
+metrics.describe("dns_failover_webhook_triggers_total", "counter", "Alertmanager webhook requests by outcome")
+metrics.describe("dns_failover_system_state", "gauge", "1 for the current SystemState of each hostname")
+metrics.describe("dns_failover_dns_target", "gauge", "1 for the current DNSTarget of each hostname")
+metrics.describe("dns_failover_health_score", "gauge", "EWMA synthetic probe quality (1 = fast success, 0 = failing)")
+metrics.describe("dns_failover_tunnel_ha_connections", "gauge", "Edge HA connections summed over cloudflared pods")
+metrics.describe("dns_failover_tunnel_connected_pods", "gauge", "cloudflared pods holding at least one edge connection")
+metrics.describe("dns_failover_leader", "gauge", "1 while this replica holds the leader Lease")
+metrics.describe("dns_failover_stabilization_remaining_seconds", "gauge",
+                 "Seconds left in the current stabilization period (0 if not stabilizing)")
+metrics.describe("dns_failover_startup_phase_seconds", "gauge", "Time spent in each startup phase")
+metrics.describe("dns_failover_ready", "gauge", "1 once startup has completed and /ready returns 200")
+
+
+class Tracer:
+    """
+    Timed spans in an in-memory ring buffer. Spans nest per thread; work
+    handed to a pool keeps its parent through wrap(), so one reconcile's
+    probes and outbound calls share its trace id.
+    """
+
+    def __init__(self, capacity: int = 4096, enabled: bool = True):
+        self.spans: deque = deque(maxlen=capacity)
+        self.enabled = enabled
+        self.local = threading.local()
+        self.ids = itertools.count(1)
+
+    def current(self) -> Optional[Dict[str, Any]]:
+        stack = getattr(self.local, "stack", None)
+        return stack[-1] if stack else getattr(self.local, "parent", None)
+
+    @contextmanager
+    def span(self, name: str, **attributes):
+        """Time the block; yields the span dict so the block can add attributes"""
+        if not self.enabled:
+            yield {}
+            return
+        parent = self.current()
+        span_id = next(self.ids)
+        span = {
+            "trace": parent["trace"] if parent else span_id,
+            "span": span_id,
+            "parent": parent["span"] if parent else None,
+            "name": name,
+            "thread": threading.current_thread().name,
+            "start": time.time(),
+            **attributes,
+        }
+        stack = getattr(self.local, "stack", None)
+        if stack is None:
+            stack = self.local.stack = []
+        stack.append(span)
+        start = time.monotonic()
+        try:
+            yield span
+        except BaseException as e:
+            span["error"] = f"{type(e).__name__}: {e}"
+            raise
+        finally:
+            span["duration_ms"] = round((time.monotonic() - start) * 1000, 3)
+            stack.pop()
+            self.spans.append(span)
+
+    def annotate(self, **attributes):
+        """Add attributes to the innermost open span on this thread"""
+        span = self.current()
+        if span is not None:
+            span.update(attributes)
+
+    def wrap(self, fn: Callable) -> Callable:
+        """`fn` for another thread, parented to the span open here"""
+        parent = self.current()
+        if parent is None:
+            return fn
+
+        def run(*args, **kwargs):
+            previous = getattr(self.local, "parent", None)
+            self.local.parent = parent
+            try:
+                return fn(*args, **kwargs)
+            finally:
+                self.local.parent = previous
+        return run
+
+    def recent(self, limit: int = 100, name: Optional[str] = None, trace: Optional[int] = None,
+               min_ms: float = 0) -> List[Dict[str, Any]]:
+        """Finished spans, newest first"""
+        matches = []
+        for span in reversed(self.spans.copy()):
+            if ((name is None or span["name"] == name) and (trace is None or span["trace"] == trace)
+                    and span["duration_ms"] >= min_ms):
+                matches.append(span)
+                if len(matches) >= limit:
+                    break
+        return matches
+
+
+tracer = Tracer(capacity=int(os.getenv("TRACE_BUFFER_SPANS", "4096")),
+                enabled=os.getenv("TRACING", "true").lower() == "true")
+
+
+class StackProfiler:
+    """
+    On-demand sampling profiler. Samples every thread's Python stack (wall
+    clock, so blocked threads show where they wait) and returns collapsed
+    stacks - "thread;outer;...;inner count" per line - for flamegraph.pl or
+    speedscope. One profile at a time.
+    """
+
+    def __init__(self, max_seconds: float = 10):
+        self.max_seconds = max_seconds
+        self.lock = threading.Lock()
+
+    @staticmethod
+    def _frame(frame) -> str:
+        code = frame.f_code
+        return f"{getattr(code, 'co_qualname', code.co_name)} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})"
+
+    def profile(self, seconds: float, hz: float = 100) -> Optional[str]:
+        """Collapsed stacks sampled for `seconds`, or None if another profile is running"""
+        if not self.lock.acquire(blocking=False):
+            return None
+        try:
+            me = threading.get_ident()
+            counts: Dict[str, int] = {}
+            deadline = time.monotonic() + seconds
+            while time.monotonic() < deadline:
+                # Pool threads (reconcile_3, waitress-2) fold into one root per pool
+                names = {t.ident: t.name.rstrip("0123456789").rstrip("-_") or t.name
+                         for t in threading.enumerate()}
+                for ident, frame in sys._current_frames().items():
+                    if ident == me:
+                        continue
+                    stack = []
+                    while frame is not None:
+                        stack.append(self._frame(frame))
+                        frame = frame.f_back
+                    stack.append(names.get(ident, str(ident)))
+                    key = ";".join(reversed(stack))
+                    counts[key] = counts.get(key, 0) + 1
+                time.sleep(1 / hz)
+        finally:
+            self.lock.release()
+        return "".join(f"{stack} {n}\n" for stack, n in sorted(counts.items(), key=lambda kv: -kv[1]))
+
+
+profiler = StackProfiler(max_seconds=float(os.getenv("PROFILE_MAX_SECONDS", "10")))
+
+
+class PropagationTracker:
+    """
+    After a DNS switch, polls every resolver on a fast-then-decaying schedule
+    until they all return the new target, and records per-resolver
+    time-to-propagate in histograms. Polls are timers on the shared scheduler
+    that run on a bounded executor, so a mass failover queues them instead of
+    starting a thread per hostname.
+    """
+
+    def __init__(self, dns_checker: "DNSChecker", scheduler: "TimerScheduler", executor: ThreadPoolExecutor,
+                 initial_delay: float = 0.5, backoff: float = 1.5, max_delay: float = 30.0,
+                 timeout: float = 900.0):
+        self.dns_checker = dns_checker
+        self.scheduler = scheduler
+        self.clock = scheduler.clock
+        self.executor = executor
+        self.key = f"propagation:{dns_checker.hostname}"
+        self.initial_delay = initial_delay
+        self.backoff = backoff
+        self.max_delay = max_delay
+        self.timeout = timeout
+        self.histograms: Dict[str, LatencyHistogram] = {}
+        self.current: Optional[Dict[str, Any]] = None
+        self.lock = threading.Lock()
+        # Bumped by every watch(); polls from an older watch stop on their own
+        self.generation = 0
+        self.on_change: Optional[Callable[[], None]] = None
+
+    def _changed(self):
+        if self.on_change:
+            self.on_change()
+
+    def _poll(self) -> Dict[str, DNSTarget]:
+        """Current target as seen by each resolver"""
+        checker = self.dns_checker
+        if checker.resolvers is None:
+            ips = [ip[4][0] for ip in socket.getaddrinfo(checker.hostname, None)]
+            return {"system": checker.classify(ips)}
+        return {
+            answer.resolver: DNSTarget.UNKNOWN if answer.error else checker.classify(answer.addresses)
+            for answer in checker.resolvers.resolve(checker.hostname)
+        }
+
+    def watch(self, expected: DNSTarget):
+        """Start tracking propagation of a switch to `expected` (cancels any previous watch)"""
+        with self.lock:
+            self.generation += 1
+            generation = self.generation
+            self.current = {
+                "target": expected.value,
+                "started": self.clock.utcnow().isoformat(),
+                "converged": {},
+                "pending": [],
+                "done": False,
+                "timed_out": False,
+            }
+        self._schedule(expected, generation, self.clock.monotonic(), 0)
+        self._changed()
+
+    def _schedule(self, expected: DNSTarget, generation: int, start: float, delay: float):
+        # Re-arming the same key replaces a pending poll of a superseded watch
+        self.scheduler.schedule(self.key, delay, lambda: self.executor.submit(
+            self._poll_once, expected, generation, start, delay))
+
+    def _poll_once(self, expected: DNSTarget, generation: int, start: float, delay: float):
+        with self.lock:
+            if generation != self.generation:
+                return
+        elapsed = self.clock.monotonic() - start
+        try:
+            seen = self._poll()
+        except Exception as e:
+            logger.debug(f"Propagation poll failed for {self.dns_checker.hostname}: {e}")
+            seen = {}
+
+        with self.lock:
+            if generation != self.generation:
+                return
+            status = self.current
+            for resolver, target in seen.items():
+                if target == expected and resolver not in status["converged"]:
+                    status["converged"][resolver] = round(elapsed, 3)
+                    self.histograms.setdefault(resolver, LatencyHistogram()).observe(elapsed)
+            before = (len(status["converged"]), len(status["pending"]))
+            status["pending"] = [r for r in seen if r not in status["converged"]]
+            changed = before != (len(status["converged"]), len(status["pending"]))
+
+            if seen and not status["pending"]:
+                status["done"] = True
+                logger.info(f"📡 {self.dns_checker.hostname} → {expected.value} propagated "
+                            f"to all resolvers in {elapsed:.1f}s")
+            elif elapsed >= self.timeout:
+                status["done"] = status["timed_out"] = True
+                logger.warning(f"📡 {self.dns_checker.hostname} → {expected.value} not propagated "
+                               f"after {elapsed:.0f}s; pending: {status['pending']}")
+
+        if changed or status["done"]:
+            self._changed()
+        if not status["done"]:
+            next_delay = self.initial_delay if delay == 0 else min(delay * self.backoff, self.max_delay)
+            self._schedule(expected, generation, start, next_delay)
+
+    def to_dict(self) -> Dict[str, Any]:
+        with self.lock:
+            current = None
+            if self.current:
+                current = {**self.current, "converged": dict(self.current["converged"]),
+                           "pending": list(self.current["pending"])}
+            return {
+                "current": current,
+                "histograms": {r: h.to_dict() for r, h in self.histograms.items()},
+            }
+
+
+class HTTPClient:
+    """
+    Shared keep-alive HTTP session with a bounded connection pool.
+    Retries connection errors and 5xx with jittered exponential backoff,
+    and honours Retry-After on 429.
+    """
+
+    RETRY_STATUSES = {429, 500, 502, 503, 504}
+
+    def __init__(self, pool_connections: int = 4, pool_maxsize: int = 10,
+                 max_retries: int = 3, backoff_base: float = 0.2,
+                 backoff_max: float = 5.0, max_retry_after: float = 30.0):
+        self.pool_connections = pool_connections
+        self.pool_maxsize = pool_maxsize
+        self.max_retries = max_retries
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+        self.max_retry_after = max_retry_after
+
+        self.session = requests.Session()
+        # Retries are handled here (not by urllib3) so they can be counted
+        self.adapter = HTTPAdapter(pool_connections=pool_connections,
+                                   pool_maxsize=pool_maxsize, max_retries=0)
+        self.session.mount("https://", self.adapter)
+        self.session.mount("http://", self.adapter)
+
+        self.stats_lock = threading.Lock()
+        self.counters = {
+            "requests": 0,
+            "attempts": 0,
+            "retries": 0,
+            "rate_limited": 0,
+            "connection_errors": 0,
+            "server_errors": 0,
+            "failures": 0,
+        }
+        # Pool usage from our own bookkeeping, not urllib3 internals
+        self.hosts: Set[str] = set()
+        self.in_flight = 0
+        self.peak_in_flight = 0
+
+    def _count(self, key: str, n: int = 1):
+        with self.stats_lock:
+            self.counters[key] += n
+
+    def _backoff(self, attempt: int) -> float:
+        """Full-jitter exponential backoff"""
+        return random.uniform(0, min(self.backoff_max, self.backoff_base * (2 ** attempt)))
+
+    def _retry_after(self, response: requests.Response, attempt: int) -> float:
+        header = response.headers.get("Retry-After")
+        try:
+            return min(float(header), self.max_retry_after)
+        except (TypeError, ValueError):
+            return self._backoff(attempt)
+
+    def request(self, method: str, url: str, **kwargs) -> requests.Response:
+        """Send a request, retrying transient failures"""
+        with tracer.span("http", method=method, host=urlparse(url).hostname) as span:
+            response = self._send(method, url, span, **kwargs)
+            span["status"] = response.status_code
+            return response
+
+    def _send(self, method: str, url: str, span: Dict[str, Any], **kwargs) -> requests.Response:
+        with self.stats_lock:
+            self.counters["requests"] += 1
+            self.hosts.add(urlparse(url).netloc)
+        attempt = 0
+        while True:
+            span["attempts"] = attempt + 1
+            self._count("attempts")
+            try:
+                response = self._attempt(method, url, **kwargs)
+            except (requests.ConnectionError, requests.Timeout) as e:
+                self._count("connection_errors")
+                if attempt >= self.max_retries:
+                    self._count("failures")
+                    raise
+                delay = self._backoff(attempt)
+                logger.debug(f"{method} {url} failed ({e}); retrying in {delay:.2f}s")
+            else:
+                if response.status_code not in self.RETRY_STATUSES:
+                    return response
+                if response.status_code == 429:
+                    self._count("rate_limited")
+                    delay = self._retry_after(response, attempt)
+                else:
+                    self._count("server_errors")
+                    delay = self._backoff(attempt)
+                if attempt >= self.max_retries:
+                    self._count("failures")
+                    return response
+                logger.debug(f"{method} {url} returned {response.status_code}; "
+                             f"retrying in {delay:.2f}s")
+                response.close()
+
+            attempt += 1
+            self._count("retries")
+            time.sleep(delay)
+
+    def _attempt(self, method: str, url: str, **kwargs) -> requests.Response:
+        """One request on the session, counted as in flight until it returns"""
+        with self.stats_lock:
+            self.in_flight += 1
+            self.peak_in_flight = max(self.peak_in_flight, self.in_flight)
+        try:
+            return self.session.request(method, url, **kwargs)
+        finally:
+            with self.stats_lock:
+                self.in_flight -= 1
+
+    def get(self, url: str, **kwargs) -> requests.Response:
+        return self.request("GET", url, **kwargs)
+
+    def put(self, url: str, **kwargs) -> requests.Response:
+        return self.request("PUT", url, **kwargs)
+
+    def post(self, url: str, **kwargs) -> requests.Response:
+        return self.request("POST", url, **kwargs)
+
+    def stats(self) -> Dict[str, Any]:
+        """Retry counters and connection pool usage"""
+        with self.stats_lock:
+            counters = dict(self.counters)
+            counters["pool"] = {
+                "pool_connections": self.pool_connections,
+                "pool_maxsize": self.pool_maxsize,
+                # Each host gets its own pool; only pool_connections of them are kept
+                "hosts": len(self.hosts),
+                "in_flight": self.in_flight,
+                "peak_in_flight": self.peak_in_flight,
+            }
+        return counters
+
+
+class DNSRecordCache:
+    """
+    Zone-wide DNS record cache indexed by name and record id.
+    Filled by one paginated list; stays fresh via TTL, write-through
+    after our own updates and invalidation when a write fails.
+    """
+
+    def __init__(self, fetch_all: Callable[[], List[Dict[str, Any]]], ttl_seconds: float = 15,
+                 clock: Optional[Clock] = None):
+        self.fetch_all = fetch_all
+        self.ttl_seconds = ttl_seconds
+        self.clock = clock or Clock()
+        self.by_name: Dict[str, List[Dict[str, Any]]] = {}
+        self.by_id: Dict[str, Dict[str, Any]] = {}
+        self.loaded_at: Optional[float] = None
+        self.lock = threading.Lock()
+        self.refresh_count = 0
+
+    def _is_fresh(self) -> bool:
+        return self.loaded_at is not None and self.clock.monotonic() - self.loaded_at < self.ttl_seconds
+
+    def _index(self, records: List[Dict[str, Any]]):
+        self.by_id = {record["id"]: record for record in records}
+        self.by_name = {}
+        for record in records:
+            self.by_name.setdefault(record["name"], []).append(record)
+
+    def refresh(self):
+        """Reload the whole zone (single-flight: concurrent callers share one fetch)"""
+        with self.lock:
+            if self._is_fresh():
+                return
+            records = self.fetch_all()
+            self._index(records)
+            self.loaded_at = self.clock.monotonic()
+            self.refresh_count += 1
+            logger.debug(f"DNS record cache loaded {len(records)} records")
+
+    def get_by_name(self, name: str) -> Optional[Dict[str, Any]]:
+        if not self._is_fresh():
+            self.refresh()
+        records = self.by_name.get(name)
+        return records[0] if records else None
+
+    def get_by_id(self, record_id: str) -> Optional[Dict[str, Any]]:
+        if not self._is_fresh():
+            self.refresh()
+        return self.by_id.get(record_id)
+
+    def upsert(self, record: Dict[str, Any]):
+        """Write-through of a record returned by a successful write"""
+        with self.lock:
+            old = self.by_id.get(record["id"])
+            if old is not None:
+                siblings = self.by_name.get(old["name"], [])
+                self.by_name[old["name"]] = [r for r in siblings if r["id"] != record["id"]]
+            self.by_id[record["id"]] = record
+            self.by_name.setdefault(record["name"], []).insert(0, record)
+
+    def invalidate(self):
+        with self.lock:
+            self.loaded_at = None
+
+
+class TokenBucket:
+    """
+    Client-side rate limiter. One bucket is shared by every Cloudflare
+    client, since the API budget belongs to the token, not to the zone.
+    Waiters are served strictly in (priority, arrival) order: a queued
+    failover write never waits behind a record-cache refresh.
+    """
+
+    def __init__(self, rate: float, burst: float):
+        self.rate = rate
+        self.burst = burst
+        self.tokens = float(burst)
+        self.updated = time.monotonic()
+        self.waiters: List[Tuple[int, int]] = []  # heap of (priority, seq)
+        self.seq = itertools.count()
+        self.cond = threading.Condition()
+        self.counters = {"acquired": 0, "throttled": 0, "waited_seconds": 0.0}
+
+    def _refill(self):
+        now = time.monotonic()
+        self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def acquire(self, priority: int = 0) -> float:
+        """Take one token, blocking behind higher-priority waiters; returns seconds waited"""
+        start = time.monotonic()
+        with self.cond:
+            me = (priority, next(self.seq))
+            heapq.heappush(self.waiters, me)
+            while True:
+                self._refill()
+                if self.waiters[0] == me and self.tokens >= 1:
+                    break
+                # Only the head waiter can compute a deadline; the rest wait to be woken
+                timeout = (1 - self.tokens) / self.rate if self.waiters[0] == me else None
+                self.cond.wait(timeout)
+            heapq.heappop(self.waiters)
+            self.tokens -= 1
+            waited = time.monotonic() - start
+            self.counters["acquired"] += 1
+            if waited > 0.001:
+                self.counters["throttled"] += 1
+                self.counters["waited_seconds"] += waited
+            self.cond.notify_all()
+        return waited
+
+    def stats(self) -> Dict[str, Any]:
+        with self.cond:
+            self._refill()
+            return {
+                "rate": self.rate,
+                "burst": self.burst,
+                "tokens": round(self.tokens, 2),
+                "waiters": len(self.waiters),
+                **self.counters,
+                "waited_seconds": round(self.counters["waited_seconds"], 3),
+            }
+
+
+@dataclass
+class RecordChange:
+    """One queued PUT of a whole record, plus the callers waiting on it"""
+    record_id: str
+    data: Dict[str, Any]
+    priority: int
+    seq: int
+    futures: List[Future]
+    superseded: bool = False
+
+    def __lt__(self, other: "RecordChange") -> bool:
+        return (self.priority, self.seq) < (other.priority, other.seq)
+
+
+class DNSBatchWriter:
+    """
+    Per-zone priority queue of record changes, drained by a single thread.
+    Changes that queue up while the previous request or the rate limiter is
+    busy go out together, highest priority first, in batches of up to
+    `max_batch`. A newer change to a queued record replaces the older one.
+    A caller that gives up waiting withdraws its change while it is still
+    queued; once the change is in flight, its result is the answer.
+    """
+
+    def __init__(self, apply: Callable[[List[RecordChange]], List[bool]], max_batch: int = 200,
+                 linger: float = 0.02, throttle: Optional[Callable[[int], float]] = None):
+        self.apply = apply
+        self.max_batch = max_batch
+        self.linger = linger
+        self.throttle = throttle
+        self.heap: List[RecordChange] = []
+        self.queued: Dict[str, RecordChange] = {}
+        self.seq = itertools.count()
+        self.cond = threading.Condition()
+        self.counters = {"submitted": 0, "superseded": 0, "withdrawn": 0, "requests": 0, "changes": 0,
+                         "failed": 0}
+        self._thread: Optional[threading.Thread] = None
+
+    def submit(self, record_id: str, data: Dict[str, Any], priority: int) -> Future:
+        future: Future = Future()
+        with self.cond:
+            self.counters["submitted"] += 1
+            change = RecordChange(record_id, data, priority, next(self.seq), [future])
+            previous = self.queued.get(record_id)
+            if previous is not None:
+                # Last write wins; it inherits the waiters and the more urgent priority
+                self.counters["superseded"] += 1
+                previous.superseded = True
+                change.futures = previous.futures + change.futures
+                change.priority = min(change.priority, previous.priority)
+            self.queued[record_id] = change
+            heapq.heappush(self.heap, change)
+            self.cond.notify()
+        self.start()
+        return future
+
+    def write(self, record_id: str, data: Dict[str, Any], priority: int, timeout: float = 60) -> bool:
+        """Queue a change and wait for its outcome (withdrawn if still queued after `timeout`)"""
+        # The request itself is traced on the writer thread, under cloudflare.apply
+        with tracer.span("cloudflare.write", record=record_id, priority=priority) as span:
+            future = self.submit(record_id, data, priority)
+            try:
+                span["ok"] = future.result(timeout)
+            except FutureTimeout:
+                if self.withdraw(record_id, future):
+                    logger.error(f"Timed out after {timeout}s waiting for DNS record {record_id} "
+                                 f"to be written - change withdrawn")
+                    span["ok"] = False
+                else:
+                    # Already sent: reporting failure now would be wrong if the PUT lands
+                    logger.warning(f"DNS record {record_id} still in flight after {timeout}s - "
+                                   f"waiting for the result")
+                    span["ok"] = future.result()
+            return span["ok"]
+
+    def withdraw(self, record_id: str, future: Future) -> bool:
+        """Drop a waiter's change if it has not been sent yet; False once it is in flight or done"""
+        with self.cond:
+            change = self.queued.get(record_id)
+            if change is None or future not in change.futures:
+                return False
+            if change.futures[-1] is future:
+                # The queued data is this caller's: cancel it (earlier waiters were superseded by it)
+                change.superseded = True
+                del self.queued[record_id]
+                self.counters["withdrawn"] += 1
+                abandoned = change.futures[:-1]
+            else:
+                # A newer change replaced ours and still goes out for its own caller
+                change.futures.remove(future)
+                abandoned = []
+        for waiter in abandoned:
+            waiter.set_result(False)
+        return True
+
+    def _next_batch(self) -> List[RecordChange]:
+        with self.cond:
+            while not self.heap:
+                self.cond.wait()
+            head = self.heap[0].priority
+        # Let a burst of concurrent reconciles pile up, then wait for the API budget
+        if self.linger and self.max_batch > 1:
+            time.sleep(self.linger)
+        if self.throttle:
+            self.throttle(head)
+        batch: List[RecordChange] = []
+        with self.cond:
+            while self.heap and len(batch) < self.max_batch:
+                change = heapq.heappop(self.heap)
+                if change.superseded:
+                    continue
+                del self.queued[change.record_id]
+                batch.append(change)
+        return batch
+
+    def run(self):
+        while True:
+            batch = self._next_batch()
+            if not batch:
+                continue
+            try:
+                with tracer.span("cloudflare.apply", changes=len(batch)):
+                    results = self.apply(batch)
+            except Exception as e:
+                logger.error(f"DNS batch of {len(batch)} changes failed: {e}", exc_info=True)
+                results = [False] * len(batch)
+            with self.cond:
+                self.counters["requests"] += 1
+                self.counters["changes"] += len(batch)
+                self.counters["failed"] += results.count(False)
+            for change, ok in zip(batch, results):
+                for future in change.futures:
+                    future.set_result(ok)
+
+    def start(self):
+        """Start the writer thread (idempotent)"""
+        if self._thread is None:
+            with self.cond:
+                if self._thread is None:
+                    self._thread = threading.Thread(target=self.run, daemon=True, name="dns-writer")
+                    self._thread.start()
+
+    def stats(self) -> Dict[str, Any]:
+        with self.cond:
+            return {"depth": len(self.queued), **self.counters}
+
+
 class CloudflareAPI:
     """Cloudflare API client for DNS management"""
 
-    def __init__(self, api_token: str, zone_id: str):
+    # Lower runs first: moving traffic off a dead tunnel beats moving it off
+    # a working VPS, and both beat background reads
+    PRIORITY_FAILOVER = 0
+    PRIORITY_FAILBACK = 1
+    PRIORITY_READ = 2
+
+    def __init__(self, api_token: str, zone_id: str, http: Optional[HTTPClient] = None,
+                 record_cache_ttl: float = 15, rate_limiter: Optional[TokenBucket] = None,
+                 batch_writes: bool = True, max_batch: int = 200, clock: Optional[Clock] = None):
         self.api_token = api_token
         self.zone_id = zone_id
+        self.http = http or HTTPClient()
         self.base_url = "https://api.cloudflare.com/client/v4"
         self.headers = {
             "Authorization": f"Bearer {api_token}",
             "Content-Type": "application/json"
         }
+        self.rate_limiter = rate_limiter
+        self.batch_writes = batch_writes
+        self.record_cache = DNSRecordCache(self.list_dns_records, ttl_seconds=record_cache_ttl, clock=clock)
+        self.writer = DNSBatchWriter(self._apply, max_batch=max_batch if batch_writes else 1,
+                                     throttle=self._throttle)
 
-    def get_dns_record(self, name: str) -> Optional[Dict[str, Any]]:
-        """Get DNS record for a hostname"""
-        url = f"{self.base_url}/zones/{self.zone_id}/dns_records"
-        params = {"name": name}
+    def _throttle(self, priority: int) -> float:
+        """Spend one request from the shared API budget"""
+        if self.rate_limiter is None:
+            return 0.0
+        waited = self.rate_limiter.acquire(priority)
+        metrics.observe("dns_failover_cloudflare_throttle_seconds", waited)
+        return waited
 
-        try:
-            response = requests.get(url, headers=self.headers, params=params, timeout=10)
+    def list_dns_records(self, per_page: int = 500) -> List[Dict[str, Any]]:
+        """List every DNS record in the zone (paginated)"""
+        url = f"{self.base_url}/zones/{self.zone_id}/dns_records"
+        records: List[Dict[str, Any]] = []
+        page = 1
+        while True:
+            self._throttle(self.PRIORITY_READ)
+            with metrics.timer("dns_failover_probe_duration_seconds", probe="cloudflare_get"):
+                response = self.http.get(url, headers=self.headers,
+                                         params={"page": page, "per_page": per_page}, timeout=10)
             response.raise_for_status()
             result = response.json()
+            if not result.get("success"):
+                raise RuntimeError(f"Cloudflare API error: {result.get('errors')}")
+            records.extend(result.get("result") or [])
+            total_pages = (result.get("result_info") or {}).get("total_pages", 1)
+            if page >= total_pages:
+                return records
+            page += 1
 
-            if result.get("success") and result.get("result"):
-                return result["result"][0]
-            return None
+    def get_dns_record(self, name: str) -> Optional[Dict[str, Any]]:
+        """Get DNS record for a hostname (served from the zone record cache)"""
+        try:
+            return self.record_cache.get_by_name(name)
         except Exception as e:
             logger.error(f"Error getting DNS record: {e}")
             return None
 
-    def get_dns_target_from_api(self, hostname: str, vps_ip: str, tunnel_id: str) -> DNSTarget:
-        """Determine DNS target by checking Cloudflare API"""
+    def get_dns_target_from_api(self, hostname: str, vps_ips: List[str], tunnel_id: str) -> DNSTarget:
+        """Determine DNS target by checking Cloudflare API (any VPS pool member counts as failover)"""
         record = self.get_dns_record(hostname)
         if not record:
             return DNSTarget.UNKNOWN
@@ -146,7 +1839,7 @@ class CloudflareAPI:
         record_type = record.get("type")
         content = record.get("content", "")
 
-        if record_type == "A" and content == vps_ip:
+        if record_type == "A" and content in vps_ips:
             return DNSTarget.VPS_FAILOVER
         elif record_type == "CNAME" and tunnel_id in content:
             return DNSTarget.CLOUDFLARE_TUNNEL
@@ -154,335 +1847,1789 @@ class CloudflareAPI:
             logger.warning(f"Unknown DNS config: type={record_type}, content={content}")
             return DNSTarget.UNKNOWN
 
-    def update_to_tunnel(self, hostname: str, tunnel_id: str) -> bool:
+    def update_to_tunnel(self, hostname: str, tunnel_id: str, priority: int = PRIORITY_FAILBACK) -> bool:
         """Update DNS to point to Cloudflare Tunnel (CNAME)"""
+        tunnel_cname = f"{tunnel_id}.cfargotunnel.com"
+        return self._update(hostname, {
+            "type": "CNAME",
+            "name": hostname.split('.')[0],  # subdomain only
+            "content": tunnel_cname,
+            "proxied": True
+        }, priority)
+
+    def update_to_vps(self, hostname: str, vps_ip: str, priority: int = PRIORITY_FAILOVER) -> bool:
+        """Update DNS to point to VPS (A record)"""
+        return self._update(hostname, {
+            "type": "A",
+            "name": hostname.split('.')[0],  # subdomain only
+            "content": vps_ip,
+            "proxied": False  # Must be False to return actual VPS IP for failover
+        }, priority)
+
+    def _update(self, hostname: str, data: Dict[str, Any], priority: int) -> bool:
+        """Queue a record rewrite on the zone writer and wait for it"""
         record = self.get_dns_record(hostname)
         if not record:
             logger.error(f"DNS record not found for {hostname}")
             return False
 
-        record_id = record["id"]
-        tunnel_cname = f"{tunnel_id}.cfargotunnel.com"
+        # If the record already has the wanted type, content and proxying, no change needed
+        if all(record.get(k) == data[k] for k in ("type", "content", "proxied")):
+            logger.info(f"{hostname} already points to {data['type']} {data['content']}")
+            return True
+
+        ok = self.writer.write(record["id"], data, priority)
+        if ok:
+            logger.info(f"✅ Updated {hostname} → {data['type']} {data['content']}")
+        return ok
+
+    def _apply(self, changes: List[RecordChange]) -> List[bool]:
+        """Writer callback: one batch request, or per-record PUTs for a single change"""
+        if len(changes) == 1:
+            return [self._put(changes[0])]
+        try:
+            return self._batch(changes)
+        except Exception as e:
+            # A batch is all-or-nothing; retry one by one so a bad record can't block the rest
+            logger.error(f"Batch update of {len(changes)} records failed ({e}) - falling back to single PUTs")
+            self.record_cache.invalidate()
+            return [self._put(change, throttle=True) for change in changes]
+
+    def _put(self, change: RecordChange, throttle: bool = False) -> bool:
+        if throttle:
+            self._throttle(change.priority)
+        url = f"{self.base_url}/zones/{self.zone_id}/dns_records/{change.record_id}"
+        try:
+            with metrics.timer("dns_failover_probe_duration_seconds", probe="cloudflare_put"):
+                response = self.http.put(url, headers=self.headers, json=change.data, timeout=10)
+            metrics.inc("dns_failover_cloudflare_requests_total", kind="put")
+            response.raise_for_status()
+            result = response.json()
+
+            if result.get("success"):
+                self.record_cache.upsert(result["result"])
+                return True
+            else:
+                logger.error(f"Cloudflare API error: {result}")
+                self.record_cache.invalidate()
+                return False
+        except Exception as e:
+            logger.error(f"Error updating DNS record {change.record_id}: {e}")
+            self.record_cache.invalidate()
+            return False
+
+    def _batch(self, changes: List[RecordChange]) -> List[bool]:
+        """Apply many record rewrites atomically via POST dns_records/batch"""
+        url = f"{self.base_url}/zones/{self.zone_id}/dns_records/batch"
+        body = {"puts": [{"id": change.record_id, **change.data} for change in changes]}
+        with metrics.timer("dns_failover_probe_duration_seconds", probe="cloudflare_batch"):
+            response = self.http.post(url, headers=self.headers, json=body, timeout=30)
+        metrics.inc("dns_failover_cloudflare_requests_total", kind="batch")
+        response.raise_for_status()
+        result = response.json()
+        if not result.get("success"):
+            raise RuntimeError(f"Cloudflare API error: {result.get('errors')}")
+        for record in (result.get("result") or {}).get("puts") or []:
+            self.record_cache.upsert(record)
+        logger.info(f"✅ Applied {len(changes)} DNS record changes in one batch")
+        return [True] * len(changes)
+
+    def stats(self) -> Dict[str, Any]:
+        return {"batch_writes": self.batch_writes, "writer": self.writer.stats()}
+
+
+def build_cloudflare_rate_limiter() -> TokenBucket:
+    """Shared Cloudflare API budget (default: burst + 5 min of refill stays under 1200 requests / 5 min)"""
+    return TokenBucket(
+        rate=float(os.getenv("CLOUDFLARE_RATE_LIMIT_PER_SECOND", "3.9")),
+        burst=float(os.getenv("CLOUDFLARE_RATE_LIMIT_BURST", "20")),
+    )
+
+
+def build_cloudflare_api(zone_id: str, http: HTTPClient, rate_limiter: Optional[TokenBucket] = None,
+                         clock: Optional[Clock] = None) -> "CloudflareAPI":
+    """Cloudflare client for one zone configured from environment"""
+    api_token = os.getenv("CLOUDFLARE_API_TOKEN")
+    if not api_token or not zone_id:
+        raise ValueError("CLOUDFLARE_API_TOKEN and CLOUDFLARE_ZONE_ID must be set")
+    return CloudflareAPI(
+        api_token, zone_id, http=http,
+        record_cache_ttl=float(os.getenv("DNS_RECORD_CACHE_TTL_SECONDS", "15")),
+        rate_limiter=rate_limiter or build_cloudflare_rate_limiter(),
+        batch_writes=os.getenv("CLOUDFLARE_BATCH_WRITES", "true").lower() == "true",
+        max_batch=int(os.getenv("CLOUDFLARE_BATCH_MAX_CHANGES", "200")),
+        clock=clock,
+    )
+
+
+class PodCache:
+    """
+    Watch-backed local cache of pod phase/readiness (informer pattern).
+    Lists once, then follows a watch from the last resourceVersion.
+    Relists when the API server answers 410 Gone (resourceVersion too old).
+    """
+
+    def __init__(self, k8s_core, namespace: str, label_selector: str,
+                 watch_timeout_seconds: int = 300):
+        self.k8s_core = k8s_core
+        self.namespace = namespace
+        self.label_selector = label_selector
+        self.watch_timeout_seconds = watch_timeout_seconds
+        self.resource_version: Optional[str] = None
+        self.pods: Dict[str, Tuple[str, bool, Optional[str]]] = {}
+        self.synced = threading.Event()
+        self.lock = threading.Lock()
+        self.listeners: List[Callable[[], None]] = []
+        self.relist_count = 0
+        self._thread: Optional[threading.Thread] = None
+
+    @staticmethod
+    def _pod_status(pod) -> Tuple[str, bool, Optional[str]]:
+        """Extract (phase, ready, pod IP) from a V1Pod"""
+        phase = pod.status.phase if pod.status else None
+        ready = False
+        if pod.status and pod.status.conditions:
+            ready = any(c.type == "Ready" and c.status == "True" for c in pod.status.conditions)
+        return phase or "Unknown", ready, pod.status.pod_ip if pod.status else None
+
+    def add_listener(self, callback: Callable[[], None]):
+        """Register a callback fired when any pod's phase or readiness changes"""
+        self.listeners.append(callback)
+
+    def _notify(self):
+        for callback in self.listeners:
+            try:
+                callback()
+            except Exception as e:
+                logger.error(f"Pod cache listener failed: {e}")
+
+    def relist(self):
+        """Full list to (re)build the cache and obtain a fresh resourceVersion"""
+        with metrics.timer("dns_failover_probe_duration_seconds", probe="pod_list"), tracer.span("k8s.list_pods"):
+            pods = self.k8s_core.list_namespaced_pod(
+                namespace=self.namespace,
+                label_selector=self.label_selector
+            )
+        snapshot = {pod.metadata.name: self._pod_status(pod) for pod in pods.items}
+        with self.lock:
+            changed = snapshot != self.pods
+            self.pods = snapshot
+            self.resource_version = pods.metadata.resource_version
+        self.relist_count += 1
+        self.synced.set()
+        logger.debug(f"Pod cache relisted: {len(snapshot)} pods at rv={self.resource_version}")
+        if changed:
+            self._notify()
+
+    def _apply_event(self, event: Dict[str, Any]) -> bool:
+        """Apply one watch event; returns True if phase/readiness changed"""
+        pod = event["object"]
+        name = pod.metadata.name
+        with self.lock:
+            self.resource_version = pod.metadata.resource_version
+            previous = self.pods.get(name)
+            if event["type"] == "DELETED":
+                self.pods.pop(name, None)
+                return previous is not None
+            current = self._pod_status(pod)
+            self.pods[name] = current
+            return previous != current
+
+    def _watch_once(self):
+        """Follow the watch stream until it ends or the resourceVersion expires"""
+        from kubernetes import watch
+        w = watch.Watch()
+        try:
+            for event in w.stream(
+                self.k8s_core.list_namespaced_pod,
+                namespace=self.namespace,
+                label_selector=self.label_selector,
+                resource_version=self.resource_version,
+                timeout_seconds=self.watch_timeout_seconds,
+            ):
+                if event["type"] == "ERROR":
+                    raw = event.get("raw_object", {})
+                    if raw.get("code") == 410:
+                        logger.info("Pod watch resourceVersion expired - relisting")
+                        self.relist()
+                        return
+                    logger.warning(f"Pod watch error event: {raw}")
+                    continue
+                if self._apply_event(event):
+                    self._notify()
+        finally:
+            w.stop()
+
+    def run(self):
+        """Background thread: list, then watch forever with resumption"""
+        from kubernetes.client.rest import ApiException
+        logger.info(f"Starting pod watch ({self.namespace}/{self.label_selector})")
+        backoff = 1
+        while True:
+            try:
+                if not self.synced.is_set():
+                    self.relist()
+                self._watch_once()
+                backoff = 1
+            except ApiException as e:
+                if e.status == 410:
+                    logger.info("Pod watch resourceVersion expired - relisting")
+                    self.synced.clear()
+                    continue
+                logger.error(f"Pod watch API error: {e}")
+                self.synced.clear()
+                time.sleep(backoff)
+                backoff = min(backoff * 2, 30)
+            except Exception as e:
+                logger.error(f"Pod watch error: {e}")
+                self.synced.clear()
+                time.sleep(backoff)
+                backoff = min(backoff * 2, 30)
+
+    def start(self):
+        """Start the watch thread (idempotent)"""
+        if self._thread is None:
+            self._thread = threading.Thread(target=self.run, daemon=True)
+            self._thread.start()
+
+    def count_ready(self) -> int:
+        """Number of cached pods that are Running and Ready (a crash-looping pod is Running but not Ready)"""
+        with self.lock:
+            return sum(1 for phase, ready, _ in self.pods.values() if phase == "Running" and ready)
+
+    def running_ips(self) -> Dict[str, str]:
+        """Pod name -> IP for Running pods that have one"""
+        with self.lock:
+            return {name: ip for name, (phase, _, ip) in self.pods.items() if phase == "Running" and ip}
+
+
+@dataclass
+class TunnelCapacity:
+    """cloudflared edge connectivity across all tunnel pods, from one scrape round"""
+    pods_scraped: int
+    pods_failed: int
+    connected_pods: int
+    ha_connections: int
+    error_ratio: Optional[float]
+    edge_rtt_ms: Optional[float]
+    healthy: Optional[bool]
+    scraped_at: float
+    per_pod: Dict[str, Dict[str, Any]]
+
+    def to_dict(self) -> Dict[str, Any]:
+        data = asdict(self)
+        data.pop("scraped_at")
+        return data
+
+
+class TunnelScraper:
+    """
+    Scrapes every running cloudflared pod's metrics endpoint in parallel and
+    reduces them to a tunnel-capacity signal. Only the series listed in
+    SERIES are parsed, line by line while the body streams in; everything
+    else is rejected by a single prefix check. One scrape round serves all
+    callers for `interval` seconds (single-flight under the lock).
+    """
+
+    SERIES = {
+        b"cloudflared_tunnel_ha_connections": "ha_connections",
+        b"cloudflared_tunnel_total_requests": "requests",
+        b"cloudflared_tunnel_request_errors": "errors",
+        b"quic_client_smoothed_rtt": "rtt_ms",
+    }
+    PREFIXES = tuple(SERIES)
+
+    def __init__(self, pod_cache: "PodCache", http: HTTPClient, port: int = 2000,
+                 interval: float = 5.0, timeout: float = 2.0, min_connected_pods: int = 2,
+                 max_error_ratio: float = 0.5, min_requests: int = 20, clock: Optional[Clock] = None):
+        self.pod_cache = pod_cache
+        self.http = http
+        self.port = port
+        self.interval = interval
+        self.timeout = timeout
+        self.min_connected_pods = min_connected_pods
+        self.max_error_ratio = max_error_ratio
+        # Below this many requests per interval the ratio is noise (1 error in 1 request is 100%)
+        self.min_requests = min_requests
+        self.clock = clock or Clock()
+        self.executor = ThreadPoolExecutor(max_workers=8, thread_name_prefix="scrape")
+        self.cached: Optional[TunnelCapacity] = None
+        # Last counter values per pod, for per-interval error ratios
+        self.previous: Dict[str, Dict[str, float]] = {}
+        self.lock = threading.Lock()
+
+    @classmethod
+    def parse(cls, lines) -> Dict[str, Optional[float]]:
+        """Sum the wanted series over their label sets (RTT is averaged); absent series stay None"""
+        values: Dict[str, Optional[float]] = {"ha_connections": None, "requests": None, "errors": None}
+        rtts = []
+        for line in lines:
+            if not line.startswith(cls.PREFIXES):
+                continue
+            space = line.find(b" ")
+            brace = line.find(b"{")
+            labelled = 0 <= brace < space
+            key = cls.SERIES.get(line[:brace if labelled else space])
+            if key is None:
+                continue  # e.g. a _bucket/_sum series sharing the prefix
+            rest = line[line.rfind(b"}") + 1:] if labelled else line[space:]
+            value = float(rest.split()[0])
+            if key == "rtt_ms":
+                rtts.append(value)
+            else:
+                values[key] = (values[key] or 0.0) + value
+        values["rtt_ms"] = sum(rtts) / len(rtts) if rtts else None
+        return values
+
+    def _scrape_pod(self, ip: str) -> Dict[str, Optional[float]]:
+        with self.http.session.get(f"http://{ip}:{self.port}/metrics", timeout=self.timeout,
+                                   stream=True) as response:
+            response.raise_for_status()
+            return self.parse(response.iter_lines(chunk_size=16384))
+
+    def capacity(self) -> Optional[TunnelCapacity]:
+        """Cached capacity, re-scraped at most once per interval; None before any pod is known"""
+        with self.lock:
+            if self.cached is not None and self.clock.monotonic() - self.cached.scraped_at < self.interval:
+                return self.cached
+            ips = self.pod_cache.running_ips()
+            if not ips:
+                return None
+            self.cached = self._scrape(ips)
+            return self.cached
+
+    def _scrape(self, ips: Dict[str, str]) -> TunnelCapacity:
+        start = time.monotonic()
+        futures = {name: self.executor.submit(self._scrape_pod, ip) for name, ip in ips.items()}
+        wait(futures.values(), timeout=self.timeout + 1)
+        metrics.observe("dns_failover_probe_duration_seconds", time.monotonic() - start, probe="cloudflared_scrape")
+
+        per_pod: Dict[str, Dict[str, Any]] = {}
+        requests_delta = errors_delta = 0.0
+        rtts = []
+        for name, future in futures.items():
+            if not future.done() or future.exception() is not None:
+                error = future.exception() if future.done() else "timed out"
+                per_pod[name] = {"error": str(error)}
+                continue
+            values = future.result()
+            per_pod[name] = values
+            previous = self.previous.get(name)
+            if previous and values["requests"] is not None and values["errors"] is not None:
+                # Counters restart with the pod; a drop means a reset
+                req = values["requests"] - previous["requests"]
+                err = values["errors"] - previous["errors"]
+                requests_delta += req if req >= 0 else values["requests"]
+                errors_delta += err if err >= 0 else values["errors"]
+            if values["requests"] is not None and values["errors"] is not None:
+                self.previous[name] = {"requests": values["requests"], "errors": values["errors"]}
+            if values["rtt_ms"] is not None:
+                rtts.append(values["rtt_ms"])
+        for name in set(self.previous) - set(ips):
+            del self.previous[name]
+
+        known = [v["ha_connections"] for v in per_pod.values() if v.get("ha_connections") is not None]
+        failed = sum(1 for v in per_pod.values() if "error" in v)
+        unknown = len(per_pod) - len(known)
+        connected = sum(1 for ha in known if ha > 0)
+        error_ratio = errors_delta / requests_delta if requests_delta > 0 else None
+
+        if not known:
+            healthy = None
+        elif error_ratio is not None and requests_delta >= self.min_requests and error_ratio > self.max_error_ratio:
+            healthy = False
+        elif connected >= self.min_connected_pods:
+            healthy = True
+        elif connected + unknown >= self.min_connected_pods:
+            healthy = None  # pods we could not read might still be connected
+        else:
+            healthy = False
+
+        return TunnelCapacity(
+            pods_scraped=len(per_pod) - failed,
+            pods_failed=failed,
+            connected_pods=connected,
+            ha_connections=int(sum(known)),
+            error_ratio=round(error_ratio, 4) if error_ratio is not None else None,
+            edge_rtt_ms=round(sum(rtts) / len(rtts), 1) if rtts else None,
+            healthy=healthy,
+            scraped_at=self.clock.monotonic(),
+            per_pod=per_pod,
+        )
+
+
+def build_kube_core():
+    """
+    CoreV1Api from in-cluster (or local kube) config. Its ApiClient is the
+    only one: the Lease API is built on top of it.
+    """
+    from kubernetes import client, config
+    try:
+        config.load_incluster_config()
+    except config.ConfigException:
+        config.load_kube_config()
+    return client.CoreV1Api()
+
+
+class HealthChecker:
+    """Checks health of cloudflared pods and connectivity"""
+
+    def __init__(self, http: Optional[HTTPClient] = None, k8s_core=None):
+        self.k8s_core = k8s_core or build_kube_core()
+        self.http = http or HTTPClient()
+        self.pod_cache = PodCache(self.k8s_core, namespace="ingress", label_selector="app=cloudflared")
+        # Edge-connection health from each cloudflared pod's own metrics
+        self.tunnel: Optional[TunnelScraper] = None
+        if os.getenv("CLOUDFLARED_METRICS_SCRAPE", "true").lower() == "true":
+            self.tunnel = TunnelScraper(
+                self.pod_cache, self.http,
+                port=int(os.getenv("CLOUDFLARED_METRICS_PORT", "2000")),
+                interval=float(os.getenv("CLOUDFLARED_SCRAPE_INTERVAL_SECONDS", "5")),
+                timeout=float(os.getenv("CLOUDFLARED_SCRAPE_TIMEOUT_SECONDS", "2")),
+                min_connected_pods=int(os.getenv("TUNNEL_MIN_CONNECTED_PODS", "2")),
+                max_error_ratio=float(os.getenv("TUNNEL_MAX_ERROR_RATIO", "0.5")),
+                min_requests=int(os.getenv("TUNNEL_MIN_REQUESTS", "20")),
+            )
+
+    def tunnel_capacity(self) -> Optional[TunnelCapacity]:
+        """Cached cloudflared edge-connection capacity (None if disabled or unknown)"""
+        if self.tunnel is None:
+            return None
+        try:
+            return self.tunnel.capacity()
+        except Exception as e:
+            logger.warning(f"cloudflared metrics scrape failed: {e}")
+            return None
+
+    def check_cloudflared_pods_healthy(self, min_pods: int = 2) -> bool:
+        """Check if minimum number of cloudflared pods are running and ready"""
+        # Served from the watch cache once it has synced - no API call
+        if self.pod_cache.synced.is_set():
+            ready_pods = self.pod_cache.count_ready()
+            if logger.isEnabledFor(logging.DEBUG):
+                logger.debug(f"Cloudflared pods ready (cached): {ready_pods}/{min_pods} required")
+            return ready_pods >= min_pods
+
+        try:
+            with metrics.timer("dns_failover_probe_duration_seconds", probe="pod_list"):
+                pods = self.k8s_core.list_namespaced_pod(
+                    namespace="ingress",
+                    label_selector="app=cloudflared"
+                )
+
+            ready_pods = 0
+            for pod in pods.items:
+                phase, ready, _ = PodCache._pod_status(pod)
+                ready_pods += phase == "Running" and ready
+            logger.debug(f"Cloudflared pods ready: {ready_pods}/{min_pods} required")
+
+            return ready_pods >= min_pods
+        except Exception as e:
+            logger.error(f"Error checking cloudflared pods: {e}")
+            return False
+
+    def check_tunnel_connectivity(self, url: str = "https://mirai.sogos.io") -> bool:
+        """Check if public URL is accessible"""
+        try:
+            response = self.http.get(url, timeout=5)
+            return response.status_code < 500  # Accept any non-server-error
+        except Exception as e:
+            logger.debug(f"Tunnel connectivity check failed: {e}")
+            return False
+
+
+@dataclass
+class SyntheticProbe:
+    """One HTTP (http/https URL) or TCP (tcp://host:port) check"""
+    name: str
+    hostname: str
+    group: str  # public | origin | vps
+    url: str
+    interval_seconds: float = 5.0
+    timeout_seconds: float = 3.0
+
+
+class HealthScore:
+    """
+    EWMA of probe quality (1 = success within `slow_seconds`, 0.5 = slow
+    success, 0 = error/timeout) with hysteresis: the verdict flips to
+    unhealthy when the score drops below `low` and back only once it rises
+    above `high`, so a score hovering around one threshold cannot flap.
+    A sliding window of recent samples backs the error-rate/latency stats.
+    """
+
+    def __init__(self, alpha: float = 0.3, low: float = 0.5, high: float = 0.8,
+                 min_samples: int = 3, slow_seconds: float = 1.0, window: int = 20):
+        self.alpha = alpha
+        self.low = low
+        self.high = high
+        self.min_samples = min_samples
+        self.slow_seconds = slow_seconds
+        self.score: Optional[float] = None
+        self.latency: Optional[float] = None  # EWMA over successful samples
+        self.healthy: Optional[bool] = None
+        self.samples = 0
+        self.flips = 0
+        self.last_sample_at: Optional[float] = None
+        self.last_error: Optional[str] = None
+        self.recent: deque = deque(maxlen=window)  # (ok, latency)
+        self.lock = threading.Lock()
+
+    def observe(self, ok: bool, latency: float, now: float, error: Optional[str] = None):
+        quality = 0.0 if not ok else (1.0 if latency <= self.slow_seconds else 0.5)
+        with self.lock:
+            self.score = quality if self.score is None else self.alpha * quality + (1 - self.alpha) * self.score
+            if ok:
+                self.latency = latency if self.latency is None else self.alpha * latency + (1 - self.alpha) * self.latency
+            self.samples += 1
+            self.last_sample_at = now
+            self.last_error = error
+            self.recent.append((ok, latency))
+            if self.samples < self.min_samples:
+                return
+            if self.healthy is None:
+                self.healthy = self.score >= self.low
+            elif self.healthy and self.score < self.low:
+                self.healthy = False
+                self.flips += 1
+            elif not self.healthy and self.score > self.high:
+                self.healthy = True
+                self.flips += 1
+
+    def verdict(self, now: float, stale_after: float) -> Optional[bool]:
+        """Healthy/unhealthy, or None while warming up or when samples have gone stale"""
+        with self.lock:
+            if self.last_sample_at is None or now - self.last_sample_at > stale_after:
+                return None
+            return self.healthy
+
+    def reset(self):
+        with self.lock:
+            self.score = None
+            self.latency = None
+            self.healthy = None
+            self.samples = 0
+            self.recent.clear()
+
+    def to_dict(self) -> Dict[str, Any]:
+        with self.lock:
+            latencies = sorted(latency for ok, latency in self.recent if ok)
+            errors = sum(1 for ok, _ in self.recent if not ok)
+            return {
+                "score": round(self.score, 3) if self.score is not None else None,
+                "healthy": self.healthy,
+                "samples": self.samples,
+                "flips": self.flips,
+                "error_rate": round(errors / len(self.recent), 3) if self.recent else None,
+                "p50_ms": round(latencies[len(latencies) // 2] * 1000, 1) if latencies else None,
+                "max_ms": round(latencies[-1] * 1000, 1) if latencies else None,
+                "ewma_ms": round(self.latency * 1000, 1) if self.latency is not None else None,
+                "last_error": self.last_error,
+            }
+
+
+class SyntheticProber:
+    """
+    Runs HTTP/TCP probes concurrently, each on its own interval and timeout.
+    Timers live on the shared TimerScheduler; the probes themselves run on a
+    dedicated pool and re-arm when they finish, so a slow probe never
+    overlaps itself or blocks other timers. HTTP probes use the pooled
+    session directly - retries would hide exactly the failures we look for.
+    """
+
+    def __init__(self, scheduler: TimerScheduler, http: HTTPClient, max_workers: int = 16,
+                 score_factory: Optional[Callable[[], HealthScore]] = None):
+        self.scheduler = scheduler
+        self.clock = scheduler.clock
+        self.http = http
+        self.executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="synthetic")
+        self.score_factory = score_factory or HealthScore
+        self.probes: Dict[str, SyntheticProbe] = {}
+        self.scores: Dict[str, HealthScore] = {}
+        self.started = False
+
+    def add(self, probe: SyntheticProbe):
+        self.probes[probe.name] = probe
+        self.scores[probe.name] = self.score_factory()
+        if self.started:
+            self._schedule(probe, 0)
+
+    def start(self):
+        """Arm every probe (staggered so they don't all fire on the same tick)"""
+        self.started = True
+        for i, probe in enumerate(self.probes.values()):
+            self._schedule(probe, (i % 10) * probe.interval_seconds / 10)
+
+    def _schedule(self, probe: SyntheticProbe, delay: float):
+        self.scheduler.schedule(f"synthetic:{probe.name}", delay,
+                                lambda: self.executor.submit(self._run, probe))
+
+    def check(self, probe: SyntheticProbe) -> Tuple[bool, Optional[str]]:
+        """One attempt; (ok, error)"""
+        url = urlparse(probe.url)
+        if url.scheme == "tcp":
+            with socket.create_connection((url.hostname, url.port), timeout=probe.timeout_seconds):
+                return True, None
+        response = self.http.session.get(probe.url, timeout=probe.timeout_seconds, allow_redirects=False)
+        response.close()
+        # Cloudflare answers 502/530 when the tunnel behind it is gone
+        if response.status_code >= 500:
+            return False, f"HTTP {response.status_code}"
+        return True, None
+
+    def _run(self, probe: SyntheticProbe):
+        start = time.monotonic()
+        try:
+            ok, error = self.check(probe)
+        except Exception as e:
+            ok, error = False, f"{type(e).__name__}: {e}"
+        latency = time.monotonic() - start
+        self.scores[probe.name].observe(ok, latency, self.clock.monotonic(), error)
+        metrics.observe("dns_failover_probe_duration_seconds", latency, probe=f"synthetic_{probe.group}")
+        if self.started and probe.name in self.probes:
+            self._schedule(probe, max(probe.interval_seconds - latency, 0))
+
+    def verdict(self, hostname: str, group: str) -> Optional[bool]:
+        """False if any probe of the group is unhealthy, True if all known ones are healthy, None if none known"""
+        now = self.clock.monotonic()
+        verdicts = [
+            self.scores[name].verdict(now, stale_after=3 * probe.interval_seconds + probe.timeout_seconds)
+            for name, probe in self.probes.items()
+            if probe.hostname == hostname and probe.group == group
+        ]
+        known = [v for v in verdicts if v is not None]
+        if not known:
+            return None
+        return all(known)
+
+    def candidates(self, hostname: str, group: str) -> Dict[str, Tuple[Optional[bool], Optional[float]]]:
+        """Probed host -> (verdict, EWMA latency); a host with several probes is as healthy as its worst"""
+        now = self.clock.monotonic()
+        hosts: Dict[str, Tuple[Optional[bool], Optional[float]]] = {}
+        for name, probe in self.probes.items():
+            if probe.hostname != hostname or probe.group != group:
+                continue
+            score = self.scores[name]
+            verdict = score.verdict(now, stale_after=3 * probe.interval_seconds + probe.timeout_seconds)
+            host = urlparse(probe.url).hostname
+            if host in hosts:
+                previous, previous_latency = hosts[host]
+                verdict = False if False in (previous, verdict) else (previous if verdict is None else verdict)
+                latency = max(filter(None, (previous_latency, score.latency)), default=None)
+            else:
+                latency = score.latency
+            hosts[host] = (verdict, latency)
+        return hosts
+
+    def reset(self, hostname: str, group: str):
+        """Forget samples of a group (e.g. public probes after DNS moved to the other target)"""
+        for name, probe in self.probes.items():
+            if probe.hostname == hostname and probe.group == group:
+                self.scores[name].reset()
+
+    def to_dict(self, hostname: str) -> Dict[str, Any]:
+        return {
+            name: {"group": probe.group, "url": probe.url, **self.scores[name].to_dict()}
+            for name, probe in self.probes.items() if probe.hostname == hostname
+        }
+
+
+def build_http_client() -> HTTPClient:
+    """Pooled HTTP client configured from environment"""
+    return HTTPClient(
+        pool_connections=int(os.getenv("HTTP_POOL_CONNECTIONS", "4")),
+        pool_maxsize=int(os.getenv("HTTP_POOL_MAXSIZE", "10")),
+        max_retries=int(os.getenv("HTTP_MAX_RETRIES", "3")),
+        backoff_base=float(os.getenv("HTTP_BACKOFF_SECONDS", "0.2")),
+    )
+
+
+class StateStore:
+    """
+    Write-behind persistence for the dns-failover-state ConfigMap.
+
+    Each hostname owns one key. Writes of an unchanged value are dropped, the
+    rest are buffered for `delay` seconds and flushed as a single patch. Every
+    patch carries the last seen resourceVersion, so a concurrent writer causes
+    a 409 instead of being silently overwritten; on conflict the ConfigMap is
+    re-read and each affected key's owner decides whose value wins. A value
+    that would take the ConfigMap past `max_bytes` is refused, since the API
+    server would reject the whole patch and block every other key with it.
+
+    Patches run on a dedicated writer thread once start() is called; the
+    scheduler timer only wakes it, so API latency and conflict resolution
+    never hold up other timers. Before start() a due flush runs inline.
+    put() itself never writes: its callers hold their state lock, which
+    conflict resolution takes. Without a scheduler, values wait for the
+    writer thread or an explicit flush().
+    """
+
+    def __init__(self, k8s_core, name: str = "dns-failover-state", namespace: str = "ingress",
+                 scheduler: Optional[TimerScheduler] = None, delay: float = 0.5,
+                 retry_delay: float = 5.0, max_conflict_retries: int = 3,
+                 writable: Optional[Callable[[], bool]] = None, max_bytes: int = 900 * 1024):
+        self.k8s_core = k8s_core
+        self.name = name
+        self.namespace = namespace
+        self.scheduler = scheduler
+        self.delay = delay
+        self.retry_delay = retry_delay
+        self.max_conflict_retries = max_conflict_retries
+        # Below the 1 MiB object limit, leaving room for metadata
+        self.max_bytes = max_bytes
+        # Leader election gate: a standby never writes
+        self.writable = writable or (lambda: True)
+        self.resource_version: Optional[str] = None
+        self.persisted: Dict[str, str] = {}
+        self.pending: Dict[str, str] = {}
+        # key -> callback(remote_value) returning True to keep the local value
+        self.conflict_handlers: Dict[str, Callable[[str], bool]] = {}
+        self.lock = threading.Lock()
+        self.flush_lock = threading.Lock()
+        self.flush_due = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+        self.counts = {"puts": 0, "skipped": 0, "patches": 0, "conflicts": 0, "adopted": 0, "errors": 0, "oversize": 0}
+
+    def load(self) -> Dict[str, str]:
+        """Read the ConfigMap, remembering its data and resourceVersion"""
+        cm = self.k8s_core.read_namespaced_config_map(self.name, self.namespace)
+        data = dict(cm.data or {})
+        with self.lock:
+            self.resource_version = cm.metadata.resource_version
+            self.persisted = dict(data)
+        return data
+
+    def put(self, key: str, value: str) -> bool:
+        """Queue a value for the next flush (no-op if already stored or queued); False if it would not fit"""
+        with self.lock:
+            self.counts["puts"] += 1
+            if self.pending.get(key, self.persisted.get(key)) == value:
+                self.counts["skipped"] += 1
+                return True
+            size = self._size_with(key, value)
+            if size > self.max_bytes:
+                self.counts["oversize"] += 1
+                logger.error(f"State ConfigMap would grow to {size} bytes (limit {self.max_bytes}) - "
+                             f"not writing {key}")
+                return False
+            first = not self.pending
+            self.pending[key] = value
+        if first:
+            self._schedule_flush(self.delay)
+        return True
+
+    def _size_with(self, key: str, value: str) -> int:
+        """ConfigMap data size if `key` were set to `value` (caller holds the lock)"""
+        size = len(key) + len(value)
+        for k, v in self.pending.items():
+            if k != key:
+                size += len(k) + len(v)
+        for k, v in self.persisted.items():
+            if k != key and k not in self.pending:
+                size += len(k) + len(v)
+        return size
+
+    def _schedule_flush(self, delay: float):
+        if self.scheduler is None:
+            if self._thread is not None:
+                self.flush_due.set()
+        else:
+            self.scheduler.schedule(f"state-flush:{self.name}", delay, self._request_flush)
+
+    def _request_flush(self):
+        """Timer callback: hand the flush to the writer thread"""
+        if self._thread is None:
+            self.flush()
+        else:
+            self.flush_due.set()
+
+    def run(self):
+        while True:
+            self.flush_due.wait()
+            self.flush_due.clear()
+            try:
+                self.flush()
+            except Exception as e:
+                logger.error(f"State flush failed: {e}", exc_info=True)
+
+    def start(self):
+        """Start the writer thread (idempotent)"""
+        if self._thread is None:
+            with self.lock:
+                if self._thread is None:
+                    self._thread = threading.Thread(target=self.run, name="state-writer", daemon=True)
+                    self._thread.start()
+
+    def discard(self) -> int:
+        """Drop unwritten values (leadership lost - the new leader owns the state)"""
+        with self.lock:
+            dropped = len(self.pending)
+            self.pending.clear()
+        return dropped
+
+    def flush(self) -> bool:
+        """Write every pending key in one patch; True when nothing is left pending"""
+        from kubernetes.client.rest import ApiException
+        with self.flush_lock:
+            if not self.writable():
+                dropped = self.discard()
+                if dropped:
+                    logger.warning(f"Not leader - dropped {dropped} unwritten state key(s)")
+                return True
+            for _ in range(self.max_conflict_retries + 1):
+                with self.lock:
+                    batch = dict(self.pending)
+                    resource_version = self.resource_version
+                if not batch:
+                    return True
+
+                body: Dict[str, Any] = {"data": batch}
+                if resource_version:
+                    # Precondition: the API server rejects the patch with 409 if anyone wrote since
+                    body["metadata"] = {"resourceVersion": resource_version}
+                try:
+                    with tracer.span("k8s.patch_configmap", keys=len(batch)):
+                        cm = self.k8s_core.patch_namespaced_config_map(self.name, self.namespace, body)
+                except ApiException as e:
+                    if e.status != 409:
+                        self.counts["errors"] += 1
+                        logger.error(f"Failed to save state to ConfigMap: {e.status} {e.reason}")
+                        break
+                    self.counts["conflicts"] += 1
+                    logger.warning(f"⚠️ State ConfigMap changed since resourceVersion {resource_version} - re-reading")
+                    try:
+                        self._resolve_conflict()
+                    except Exception as e:
+                        self.counts["errors"] += 1
+                        logger.error(f"Failed to re-read state ConfigMap: {e}")
+                        break
+                    continue
+                except Exception as e:
+                    self.counts["errors"] += 1
+                    logger.error(f"Failed to save state to ConfigMap: {e}")
+                    break
+
+                with self.lock:
+                    self.resource_version = cm.metadata.resource_version
+                    self.persisted.update(batch)
+                    for key, value in batch.items():
+                        if self.pending.get(key) == value:
+                            del self.pending[key]
+                    self.counts["patches"] += 1
+                    remaining = bool(self.pending)
+                logger.debug(f"Saved {len(batch)} state key(s) to ConfigMap")
+                # Values queued while the patch was in flight
+                if remaining:
+                    self._schedule_flush(self.delay)
+                return not remaining
+
+        # Keep the pending values and try again later
+        if self.scheduler is not None:
+            self.scheduler.schedule(f"state-flush:{self.name}", self.retry_delay, self._request_flush)
+        return False
+
+    def _resolve_conflict(self):
+        """Adopt the latest resourceVersion; let owners of keys changed remotely pick a winner"""
+        cm = self.k8s_core.read_namespaced_config_map(self.name, self.namespace)
+        remote = dict(cm.data or {})
+        with self.lock:
+            changed = {k: remote[k] for k in self.pending
+                       if k in remote and remote[k] != self.persisted.get(k)}
+            self.resource_version = cm.metadata.resource_version
+            self.persisted = remote
+
+        for key, value in changed.items():
+            handler = self.conflict_handlers.get(key)
+            if handler is None or handler(value):
+                continue
+            self.counts["adopted"] += 1
+            with self.lock:
+                self.pending.pop(key, None)
 
-        # If already a CNAME to tunnel, no change needed
-        if record["type"] == "CNAME" and record["content"] == tunnel_cname:
-            logger.info(f"{hostname} already points to tunnel")
-            return True
+    def stats(self) -> Dict[str, Any]:
+        with self.lock:
+            return {**self.counts, "pending": len(self.pending), "resource_version": self.resource_version}
 
-        # Update to CNAME
-        url = f"{self.base_url}/zones/{self.zone_id}/dns_records/{record_id}"
-        data = {
-            "type": "CNAME",
-            "name": hostname.split('.')[0],  # subdomain only
-            "content": tunnel_cname,
-            "proxied": True
-        }
 
-        try:
-            response = requests.put(url, headers=self.headers, json=data, timeout=10)
-            response.raise_for_status()
-            result = response.json()
+class LeaderElector:
+    """
+    Leader election on a coordination.k8s.io Lease.
 
-            if result.get("success"):
-                logger.info(f"✅ Updated {hostname} → CNAME {tunnel_cname}")
-                return True
-            else:
-                logger.error(f"Cloudflare API error: {result}")
-                return False
-        except Exception as e:
-            logger.error(f"Error updating DNS to tunnel: {e}")
-            return False
+    The holder renews every `retry_period` and stops acting as leader if it
+    cannot renew within `renew_deadline`. Candidates watch the Lease and try to
+    take it as soon as it is released, or once it has gone `lease_duration`
+    without a renewal as measured on the local clock (so node clock skew does
+    not matter). A leader that shuts down releases the Lease, which makes a
+    planned handoff take one watch event plus one update.
+    """
 
-    def update_to_vps(self, hostname: str, vps_ip: str) -> bool:
-        """Update DNS to point to VPS (A record)"""
-        record = self.get_dns_record(hostname)
-        if not record:
-            logger.error(f"DNS record not found for {hostname}")
-            return False
+    ADDRESS_ANNOTATION = "dns-failover-controller/leader-address"
 
-        record_id = record["id"]
+    def __init__(self, coordination, name: str, namespace: str, identity: str,
+                 address: Optional[str] = None, lease_duration: int = 10,
+                 renew_deadline: Optional[float] = None, retry_period: float = 2.0,
+                 clock: Optional[Clock] = None):
+        self.coordination = coordination
+        self.name = name
+        self.namespace = namespace
+        self.identity = identity
+        self.address = address
+        self.lease_duration = lease_duration
+        self.renew_deadline = renew_deadline or lease_duration * 2 / 3
+        self.retry_period = retry_period
+        self.clock = clock or Clock()
+        self.leading = False
+        self.valid_until = 0.0
+        self.leader_identity: Optional[str] = None
+        self.leader_address: Optional[str] = None
+        # (holder, renewTime) last seen and when it changed, for local expiry
+        self.observed: Optional[Tuple[str, Any]] = None
+        self.observed_at = 0.0
+        self.observed_duration = float(lease_duration)
+        self.listeners: List[Callable[[bool], None]] = []
+        self.counts = {"acquired": 0, "lost": 0, "released": 0, "errors": 0}
+        self.lock = threading.Lock()
+        self.wake = threading.Event()
+        self.stopped = threading.Event()
+        self._thread: Optional[threading.Thread] = None
 
-        # If already an A record to VPS with correct proxying, no change needed
-        if record["type"] == "A" and record["content"] == vps_ip and record.get("proxied") == False:
-            logger.info(f"{hostname} already points to VPS (proxied=False)")
-            return True
+    def is_leader(self) -> bool:
+        """True only while our last successful renewal is within the renew deadline"""
+        return self.leading and self.clock.monotonic() < self.valid_until
 
-        # Update to A record
-        url = f"{self.base_url}/zones/{self.zone_id}/dns_records/{record_id}"
-        data = {
-            "type": "A",
-            "name": hostname.split('.')[0],  # subdomain only
-            "content": vps_ip,
-            "proxied": False  # Must be False to return actual VPS IP for failover
-        }
+    def add_listener(self, callback: Callable[[bool], None]):
+        """Register a callback fired with True on acquiring and False on losing leadership"""
+        self.listeners.append(callback)
 
-        try:
-            response = requests.put(url, headers=self.headers, json=data, timeout=10)
-            response.raise_for_status()
-            result = response.json()
+    def _notify(self, leading: bool):
+        for callback in self.listeners:
+            try:
+                callback(leading)
+            except Exception as e:
+                logger.error(f"Leadership listener failed: {e}", exc_info=True)
 
-            if result.get("success"):
-                logger.info(f"✅ Updated {hostname} → A {vps_ip}")
-                return True
-            else:
-                logger.error(f"Cloudflare API error: {result}")
-                return False
-        except Exception as e:
-            logger.error(f"Error updating DNS to VPS: {e}")
-            return False
+    def _now(self) -> datetime:
+        return self.clock.utcnow().replace(tzinfo=timezone.utc)
 
+    def _observe(self, lease):
+        """Record the Lease holder; the expiry clock restarts whenever the record changes"""
+        spec = lease.spec
+        record = (spec.holder_identity or "", spec.renew_time)
+        annotations = lease.metadata.annotations or {}
+        with self.lock:
+            if record != self.observed:
+                self.observed = record
+                self.observed_at = self.clock.monotonic()
+                self.observed_duration = float(spec.lease_duration_seconds or self.lease_duration)
+            self.leader_identity = record[0] or None
+            self.leader_address = annotations.get(self.ADDRESS_ANNOTATION) if record[0] else None
 
-class HealthChecker:
-    """Checks health of cloudflared pods and connectivity"""
+    def _expires_in(self) -> float:
+        with self.lock:
+            return self.observed_at + self.observed_duration - self.clock.monotonic()
 
-    def __init__(self):
+    def try_acquire_or_renew(self) -> bool:
+        """One election round: create, take over or renew the Lease (resourceVersion-guarded)"""
+        from kubernetes import client
+        from kubernetes.client.rest import ApiException
+        started = self.clock.monotonic()
+        now = self._now()
         try:
-            config.load_incluster_config()
-        except:
-            config.load_kube_config()
-        self.k8s_core = client.CoreV1Api()
+            lease = self.coordination.read_namespaced_lease(self.name, self.namespace)
+        except ApiException as e:
+            if e.status != 404:
+                raise
+            lease = None
 
-    def check_cloudflared_pods_healthy(self, min_pods: int = 2) -> bool:
-        """Check if minimum number of cloudflared pods are running"""
-        try:
-            pods = self.k8s_core.list_namespaced_pod(
-                namespace="ingress",
-                label_selector="app=cloudflared"
+        if lease is None:
+            body = client.V1Lease(
+                metadata=client.V1ObjectMeta(name=self.name, namespace=self.namespace,
+                                             annotations={self.ADDRESS_ANNOTATION: self.address or ""}),
+                spec=client.V1LeaseSpec(holder_identity=self.identity, lease_duration_seconds=self.lease_duration,
+                                        acquire_time=now, renew_time=now, lease_transitions=0),
             )
+            try:
+                lease = self.coordination.create_namespaced_lease(self.namespace, body)
+            except ApiException as e:
+                if e.status == 409:
+                    return False
+                raise
+        else:
+            self._observe(lease)
+            spec = lease.spec
+            holder = spec.holder_identity or ""
+            if holder and holder != self.identity and self._expires_in() > 0:
+                # Someone else holds a live Lease - stop acting now, not when valid_until runs out
+                self._step_down(f"held by {holder}")
+                return False
+            if holder != self.identity:
+                spec.acquire_time = now
+                spec.lease_transitions = (spec.lease_transitions or 0) + 1
+            spec.holder_identity = self.identity
+            spec.lease_duration_seconds = self.lease_duration
+            spec.renew_time = now
+            lease.metadata.annotations = {**(lease.metadata.annotations or {}),
+                                          self.ADDRESS_ANNOTATION: self.address or ""}
+            try:
+                # metadata.resourceVersion makes this a compare-and-swap
+                lease = self.coordination.replace_namespaced_lease(self.name, self.namespace, lease)
+            except ApiException as e:
+                if e.status == 409:
+                    return False
+                raise
 
-            running_pods = sum(1 for pod in pods.items if pod.status.phase == "Running")
-            logger.debug(f"Cloudflared pods running: {running_pods}/{min_pods} required")
+        self._observe(lease)
+        self.valid_until = started + self.renew_deadline
+        if not self.leading:
+            self.leading = True
+            self.counts["acquired"] += 1
+            logger.info(f"👑 {self.identity} acquired lease {self.namespace}/{self.name}")
+            self._notify(True)
+        return True
 
-            return running_pods >= min_pods
-        except Exception as e:
-            logger.error(f"Error checking cloudflared pods: {e}")
-            return False
+    def _step_down(self, reason: str):
+        if not self.leading:
+            return
+        self.leading = False
+        self.counts["lost"] += 1
+        logger.warning(f"Lost lease {self.namespace}/{self.name}: {reason} - standing by")
+        self._notify(False)
 
-    def check_tunnel_connectivity(self, url: str = "https://mirai.sogos.io") -> bool:
-        """Check if public URL is accessible"""
+    def release(self):
+        """Give the Lease up so a standby can take over without waiting for expiry"""
+        if not self.leading:
+            return
+        self.leading = False
+        self._notify(False)
         try:
-            response = requests.get(url, timeout=5)
-            return response.status_code < 500  # Accept any non-server-error
+            lease = self.coordination.read_namespaced_lease(self.name, self.namespace)
+            if lease.spec.holder_identity == self.identity:
+                lease.spec.holder_identity = ""
+                lease.spec.lease_duration_seconds = 1
+                lease.spec.renew_time = self._now()
+                self.coordination.replace_namespaced_lease(self.name, self.namespace, lease)
+                self.counts["released"] += 1
+                logger.info(f"Released lease {self.namespace}/{self.name}")
         except Exception as e:
-            logger.debug(f"Tunnel connectivity check failed: {e}")
-            return False
+            logger.warning(f"Could not release lease: {e}")
+
+    def _watch(self):
+        """Follow the Lease so candidates react to a release immediately"""
+        from kubernetes import watch
+        backoff = 1
+        while not self.stopped.is_set():
+            w = watch.Watch()
+            try:
+                for event in w.stream(
+                    self.coordination.list_namespaced_lease,
+                    namespace=self.namespace,
+                    field_selector=f"metadata.name={self.name}",
+                    timeout_seconds=300,
+                ):
+                    if self.stopped.is_set():
+                        return
+                    if event["type"] == "ERROR":
+                        continue
+                    if event["type"] == "DELETED":
+                        self.wake.set()
+                        continue
+                    self._observe(event["object"])
+                    if not event["object"].spec.holder_identity:
+                        self.wake.set()
+                backoff = 1
+            except Exception as e:
+                logger.debug(f"Lease watch error: {e}")
+                self.stopped.wait(backoff)
+                backoff = min(backoff * 2, 30)
+            finally:
+                w.stop()
+
+    def run(self):
+        """Election loop: renew while leading, otherwise wait for a release or expiry"""
+        logger.info(f"Starting leader election as {self.identity} on lease {self.namespace}/{self.name}")
+        threading.Thread(target=self._watch, daemon=True).start()
+        while not self.stopped.is_set():
+            try:
+                with tracer.span("k8s.lease") as span:
+                    span["leading"] = self.try_acquire_or_renew()
+            except Exception as e:
+                self.counts["errors"] += 1
+                logger.warning(f"Leader election round failed: {e}")
+            if self.leading and not self.is_leader():
+                self._step_down("renew deadline exceeded")
+
+            if self.leading:
+                self.stopped.wait(self.retry_period)
+            else:
+                # Wake early on a release event, or exactly when the observed lease expires
+                self.wake.wait(min(self.retry_period, max(self._expires_in(), 0.05)))
+                self.wake.clear()
+
+    def start(self):
+        """Start the election thread (idempotent)"""
+        if self._thread is None:
+            self._thread = threading.Thread(target=self.run, daemon=True)
+            self._thread.start()
+
+    def stop(self, release: bool = True):
+        """Stop campaigning; releases the Lease unless simulating a crash"""
+        self.stopped.set()
+        self.wake.set()
+        # Let an in-flight renewal finish so it cannot land after the release
+        if self._thread is not None:
+            self._thread.join(timeout=self.retry_period)
+        if release:
+            self.release()
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            **self.counts,
+            "identity": self.identity,
+            "leader": self.is_leader(),
+            "holder": self.leader_identity,
+        }
+
+
+def build_leader_elector(k8s_core) -> Optional[LeaderElector]:
+    """Lease elector configured from environment (None unless LEADER_ELECTION=true)"""
+    if os.getenv("LEADER_ELECTION", "false").lower() != "true":
+        return None
+    from kubernetes import client
+    pod_ip = os.getenv("POD_IP")
+    return LeaderElector(
+        client.CoordinationV1Api(k8s_core.api_client),
+        name=os.getenv("LEASE_NAME", "dns-failover-controller"),
+        namespace="ingress",
+        identity=os.getenv("POD_NAME") or socket.gethostname(),
+        address=f"http://{pod_ip}:8080" if pod_ip else None,
+        lease_duration=int(os.getenv("LEASE_DURATION_SECONDS", "10")),
+        retry_period=float(os.getenv("LEASE_RETRY_SECONDS", "2")),
+    )
 
 
 class FailoverController:
-    """Main controller for DNS failover logic with reconciliation loop"""
+    """
+    Main controller for DNS failover logic with reconciliation loop.
+    Manages one hostname; FailoverManager runs many of these over shared clients.
+    Without arguments it builds its own clients from environment (single-host mode).
+    """
 
-    def __init__(self):
-        # Configuration from environment
-        self.hostname = os.getenv("HOSTNAME", "mirai.sogos.io")
-        self.tunnel_id = os.getenv("TUNNEL_ID", "cb2a7768-4162-4da9-ac04-138fdecf3e3d")
-        self.vps_ip = os.getenv("VPS_IP", "165.227.110.199")
-        self.stabilization_failover_minutes = float(os.getenv("STABILIZATION_FAILOVER_MINUTES", "1.5"))
-        self.stabilization_failback_minutes = float(os.getenv("STABILIZATION_FAILBACK_MINUTES", "10"))
+    def __init__(self, target: Optional[ManagedHostname] = None,
+                 cf_api: Optional[CloudflareAPI] = None,
+                 health_checker: Optional[HealthChecker] = None,
+                 probe_executor: Optional[ThreadPoolExecutor] = None,
+                 state_data: Optional[Dict[str, str]] = None,
+                 clock: Optional[Clock] = None,
+                 scheduler: Optional[TimerScheduler] = None,
+                 queue: Optional[ReconcileQueue] = None,
+                 state_store: Optional[StateStore] = None,
+                 is_leader: Optional[Callable[[], bool]] = None,
+                 prober: Optional[SyntheticProber] = None,
+                 propagation_executor: Optional[ThreadPoolExecutor] = None):
+        target = target or load_managed_hostnames()[0]
+        # Leader election gate; a standby probes but never writes
+        self.is_leader = is_leader or (lambda: True)
+        self.clock = clock or (scheduler.clock if scheduler else Clock())
+        # Stabilization deadlines fire from here instead of waiting for the next tick
+        self.scheduler = scheduler or TimerScheduler(self.clock)
+        # Every out-of-band reconcile (alerts, pod changes, deadlines) goes through one queue
+        self.queue = queue or ReconcileQueue(
+            min_interval=float(os.getenv("RECONCILE_MIN_INTERVAL_SECONDS", "1")), clock=self.clock
+        )
+
+        # Configuration
+        self.target = target
+        self.hostname = target.hostname
+        self.tunnel_id = target.tunnel_id
+        self.vps_ip = target.vps_ip
+        self.vps_ips = target.vps_ips
+        self.stabilization_failover_minutes = target.stabilization_failover_minutes
+        self.stabilization_failback_minutes = target.stabilization_failback_minutes
         self.max_failovers_24h = int(os.getenv("MAX_FAILOVERS_24H", "3"))
         self.reconcile_interval = int(os.getenv("RECONCILE_INTERVAL_SECONDS", "30"))
+        self.fast_reconcile_interval = int(os.getenv("RECONCILE_FAST_INTERVAL_SECONDS", "5"))
+        self.probe_deadline = float(os.getenv("PROBE_DEADLINE_SECONDS", "8"))
         self.dry_run = os.getenv("DRY_RUN", "false").lower() == "true"
 
-        # Cloudflare API
-        api_token = os.getenv("CLOUDFLARE_API_TOKEN")
-        zone_id = os.getenv("CLOUDFLARE_ZONE_ID")
-        if not api_token or not zone_id:
-            raise ValueError("CLOUDFLARE_API_TOKEN and CLOUDFLARE_ZONE_ID must be set")
+        if cf_api is None:
+            # One pooled keep-alive session shared by all outbound HTTP
+            http = health_checker.http if health_checker else build_http_client()
+            cf_api = build_cloudflare_api(target.zone_id, http, clock=self.clock)
+        self.cf_api = cf_api
+        self.http = cf_api.http
+        self.dns_checker = DNSChecker(self.hostname, self.vps_ips)
+        self.propagation = PropagationTracker(
+            self.dns_checker, self.scheduler,
+            propagation_executor or ThreadPoolExecutor(max_workers=1, thread_name_prefix="propagation"),
+            timeout=float(os.getenv("PROPAGATION_TIMEOUT_SECONDS", "900")),
+        )
 
-        self.cf_api = CloudflareAPI(api_token, zone_id)
-        self.dns_checker = DNSChecker(self.hostname, self.vps_ip)
-        self.health_checker = HealthChecker()
+        self.health_checker = health_checker or HealthChecker(http=self.http)
 
-        # Kubernetes client
-        try:
-            config.load_incluster_config()
-        except:
-            config.load_kube_config()
-        self.k8s_core = client.CoreV1Api()
+        # User-facing health: public URL, tunnel origin and VPS probes
+        self.prober = prober or SyntheticProber(self.scheduler, self.http)
+        if os.getenv("SYNTHETIC_PROBES", "true").lower() == "true":
+            for probe in self._synthetic_probes(target):
+                self.prober.add(probe)
+
+        # Kubernetes client (shared with the health checker)
+        self.k8s_core = self.health_checker.k8s_core
         self.namespace = "ingress"
         self.configmap_name = "dns-failover-state"
+        self.state_key = target.state_key
+        self.state_store = state_store or StateStore(
+            self.k8s_core, self.configmap_name, self.namespace, scheduler=self.scheduler,
+            delay=float(os.getenv("STATE_WRITE_DELAY_SECONDS", "0.5")),
+        )
+        self.state_store.conflict_handlers[self.state_key] = self._on_state_conflict
+
+        # Bounded transition log; its failover window drives the circuit breaker
+        self.history = TransitionHistory(
+            capacity=int(os.getenv("HISTORY_SIZE", "100")),
+            window_seconds=float(os.getenv("CIRCUIT_BREAKER_WINDOW_HOURS", "24")) * 3600,
+        )
+        # The ConfigMap is shared by every hostname; only the newest entries survive a restart
+        self.history_persist_size = int(os.getenv("HISTORY_PERSIST_SIZE", "20"))
 
         # State management
-        self.state = self._load_state()
+        self.state = self._load_state(state_data)
         self.state_lock = threading.Lock()
+        self.publish_lock = threading.Lock()
+        self.snapshot: Optional[StateSnapshot] = None
 
-    def _load_state(self) -> FailoverState:
-        """Load state from ConfigMap or initialize"""
-        try:
-            cm = self.k8s_core.read_namespaced_config_map(self.configmap_name, self.namespace)
-            state_json = cm.data.get("state.json", "{}")
-            state_dict = json.loads(state_json)
+        # Probes fan out in parallel; workers are sized so a hung probe
+        # from a previous cycle cannot starve the next one
+        self.probe_executor = probe_executor or ThreadPoolExecutor(max_workers=8, thread_name_prefix="probe")
+        self.last_probes: Dict[str, Dict[str, Any]] = {}
+        self.propagation.on_change = self._publish_propagation
+        self._publish()
 
-            # Convert string values back to enums
-            state_dict["current_target"] = DNSTarget(state_dict.get("current_target", "tunnel"))
-            state_dict["system_state"] = SystemState(state_dict.get("system_state", "primary_healthy"))
+        # Resume a stabilization period that was in progress before a restart
+        if self.state.stabilization_start:
+            self._arm_stabilization_timer()
 
-            logger.info(f"Loaded state from ConfigMap: {state_dict}")
-            return FailoverState(**state_dict)
+    def _load_state(self, state_data: Optional[Dict[str, str]] = None) -> FailoverState:
+        """Load state from ConfigMap (or pre-read ConfigMap data) or initialize"""
+        try:
+            if state_data is None:
+                state_data = self.state_store.load()
+            state, history = self._parse_state(state_data.get(self.state_key, "{}"))
+            self.history.load(history)
+            state.failover_count_24h = self.history.count(self.clock.utcnow())
+            logger.info(f"Loaded state from ConfigMap: {state} ({len(self.history.entries)} history entries)")
+            return state
         except Exception as e:
             logger.warning(f"Could not load state from ConfigMap: {e}. Initializing to default.")
             return FailoverState(
                 current_target=DNSTarget.CLOUDFLARE_TUNNEL,
                 system_state=SystemState.PRIMARY_HEALTHY,
-                last_change_time=datetime.utcnow().isoformat(),
+                last_change_time=self.clock.utcnow().isoformat(),
                 failover_count_24h=0
             )
 
-    def _save_state(self):
-        """Save state to ConfigMap"""
+    @staticmethod
+    def _parse_state(state_json: str) -> Tuple[FailoverState, Any]:
+        """Persisted JSON -> (state, persisted history)"""
+        state_dict = json.loads(state_json)
+        history = state_dict.pop("history", [])
+
+        # Convert string values back to enums
+        state_dict["current_target"] = DNSTarget(state_dict.get("current_target", "tunnel"))
+        state_dict["system_state"] = SystemState(state_dict.get("system_state", "primary_healthy"))
+        return FailoverState(**state_dict), history
+
+    def _on_state_conflict(self, remote_json: str) -> bool:
+        """
+        Another writer changed our key since we last read it. The state that
+        changed most recently wins; returns True to keep (and re-write) ours.
+        """
         try:
-            # Convert state to dict with enum values as strings
-            state_dict = asdict(self.state)
-            state_dict["current_target"] = self.state.current_target.value
-            state_dict["system_state"] = self.state.system_state.value
+            remote, history = self._parse_state(remote_json)
+        except Exception as e:
+            logger.warning(f"Ignoring unparseable remote state for {self.hostname}: {e}")
+            return True
+        if remote.last_change_time <= self.state.last_change_time:
+            return True
+        logger.warning(f"⚠️ {self.hostname}: newer state was written by another instance - adopting it")
+        self._adopt_state(remote, history)
+        return False
 
-            state_json = json.dumps(state_dict, indent=2)
+    def _adopt_state(self, state: FailoverState, history: Any):
+        """Replace our state with one persisted elsewhere (conflict, standby sync, promotion)"""
+        with self.state_lock:
+            self.history.load(history)
+            state.failover_count_24h = self.history.count(self.clock.utcnow())
+            if state == self.state:
+                return
+            self.state = state
+            self._publish()
+        if state.stabilization_start and self.is_leader():
+            self._arm_stabilization_timer()
+        else:
+            self.scheduler.cancel(f"stabilization:{self.hostname}")
+
+    def _publish(self, republish: bool = False):
+        """
+        Swap in a new immutable snapshot. Writers call this while holding
+        state_lock (copy of self.state); others republish the last published
+        state, read under publish_lock so a newer transition is never undone.
+        """
+        with self.publish_lock:
+            frozen = self.snapshot.state if republish and self.snapshot else replace(self.state)
+            version = (self.snapshot.version + 1) if self.snapshot else 1
+            body = {
+                **frozen.to_dict(),
+                "hostname": self.hostname,
+                "version": version,
+                "probes": dict(self.last_probes),
+                "propagation": self.propagation.to_dict(),
+            }
+            self.snapshot = StateSnapshot(version, frozen, json.dumps(body).encode())
 
-            # Update ConfigMap
-            cm = self.k8s_core.read_namespaced_config_map(self.configmap_name, self.namespace)
-            cm.data["state.json"] = state_json
-            self.k8s_core.patch_namespaced_config_map(self.configmap_name, self.namespace, cm)
+    def _publish_propagation(self):
+        """Propagation progress changed - republish without touching the live state"""
+        self._publish(republish=True)
 
-            logger.debug(f"Saved state to ConfigMap")
-        except Exception as e:
-            logger.error(f"Failed to save state to ConfigMap: {e}")
+    def _save_state(self):
+        """Publish a new snapshot and queue the state (with history) for write-behind persistence"""
+        self.state.failover_count_24h = self.history.count(self.clock.utcnow())
+        self._publish()
+        # Only our own key, so concurrent hostnames don't overwrite each other
+        history = self.history.dump(self.history_persist_size)
+        state_dict = {**self.state.to_dict(), "history": history}
+        if self.state_store.put(self.state_key, json.dumps(state_dict, separators=(",", ":"))):
+            return
+        # ConfigMap is full - the state and breaker window matter more than the log
+        logger.warning(f"⚠️ {self.hostname}: persisting state without history entries (ConfigMap size limit)")
+        state_dict["history"] = {**history, "entries": []}
+        self.state_store.put(self.state_key, json.dumps(state_dict, separators=(",", ":")))
+
+    @staticmethod
+    def _synthetic_probes(target: ManagedHostname) -> List[SyntheticProbe]:
+        """Probe specs from the hostname config, or public URL + VPS (+ TUNNEL_ORIGIN_URL) by default"""
+        interval = float(os.getenv("SYNTHETIC_PROBE_INTERVAL_SECONDS", "5"))
+        timeout = float(os.getenv("SYNTHETIC_PROBE_TIMEOUT_SECONDS", "3"))
+        specs = target.probes
+        if specs is None:
+            specs = [{"group": "public", "url": f"https://{target.hostname}/"}]
+            specs += [{"group": "vps", "url": f"tcp://{ip}:443"} for ip in target.vps_ips]
+            if os.getenv("TUNNEL_ORIGIN_URL"):
+                specs.append({"group": "origin", "url": os.getenv("TUNNEL_ORIGIN_URL")})
+        return [
+            SyntheticProbe(
+                name=f"{target.hostname}/{spec['group']}/{i}",
+                hostname=target.hostname,
+                group=spec["group"],
+                url=spec["url"],
+                interval_seconds=float(spec.get("interval_seconds", interval)),
+                timeout_seconds=float(spec.get("timeout_seconds", timeout)),
+            )
+            for i, spec in enumerate(specs)
+        ]
 
     def determine_desired_target(self) -> DNSTarget:
         """
         Determine desired DNS target based on actual system health.
         This is ground truth, not based on alerts.
+
+        The tunnel is wanted while enough cloudflared pods run and hold edge
+        connections, the origin behind it answers and - while DNS points at
+        the tunnel - the public URL is healthy. Signals without a verdict
+        yet are ignored.
         """
         pods_healthy = self.health_checker.check_cloudflared_pods_healthy(min_pods=2)
+        capacity = self.health_checker.tunnel_capacity()
+        if capacity is not None and capacity.healthy is False:
+            logger.debug(f"cloudflared edge capacity insufficient: {capacity.connected_pods} pods connected, "
+                         f"error ratio {capacity.error_ratio}")
+            pods_healthy = False
+        origin_healthy = self.prober.verdict(self.hostname, "origin")
+        public_healthy = self.prober.verdict(self.hostname, "public")
+        on_tunnel = self.state.current_target == DNSTarget.CLOUDFLARE_TUNNEL
 
-        if pods_healthy:
+        if pods_healthy and origin_healthy is not False and not (on_tunnel and public_healthy is False):
             # Primary is healthy, should use tunnel
             return DNSTarget.CLOUDFLARE_TUNNEL
-        else:
-            # Primary is down, should use VPS failover
-            return DNSTarget.VPS_FAILOVER
+
+        # Primary is down, should use VPS failover (which member: select_vps_target)
+        return DNSTarget.VPS_FAILOVER
+
+    def select_vps_target(self) -> Optional[str]:
+        """
+        Best failover IP from the pool: the healthy member with the lowest
+        EWMA probe latency (pool order breaks ties), else the first member
+        with no verdict yet, else None - every candidate is failing.
+        """
+        candidates = self.prober.candidates(self.hostname, "vps")
+        ranked = [(candidates.get(ip, (None, None)), i, ip) for i, ip in enumerate(self.vps_ips)]
+        healthy = [(latency if latency is not None else float("inf"), i, ip)
+                   for (verdict, latency), i, ip in ranked if verdict is True]
+        if healthy:
+            return min(healthy)[2]
+        return next((ip for (verdict, _), _, ip in ranked if verdict is None), None)
+
+    def _timed_probe(self, name: str, fn: Callable[[], DNSTarget]) -> ProbeResult:
+        """Run one probe and record how long it took"""
+        start = time.monotonic()
+        with tracer.span(f"probe.{name}") as span:
+            try:
+                value = fn()
+                span["result"] = value.value
+                return ProbeResult(name, value, time.monotonic() - start)
+            except Exception as e:
+                span["error"] = str(e)
+                return ProbeResult(name, DNSTarget.UNKNOWN, time.monotonic() - start, error=str(e))
+
+    def run_probes(self) -> Dict[str, ProbeResult]:
+        """
+        Run the DNS, Cloudflare API and pod-health probes concurrently.
+        Probes still running at the cycle deadline report UNKNOWN/timed out.
+        """
+        probes = {
+            "dns": self.dns_checker.get_actual_dns_target,
+            "cloudflare_api": lambda: self.cf_api.get_dns_target_from_api(
+                self.hostname, self.vps_ips, self.tunnel_id
+            ),
+            "desired": self.determine_desired_target,
+        }
+        start = time.monotonic()
+        with tracer.span("probes"):
+            timed_probe = tracer.wrap(self._timed_probe)
+            futures = {
+                name: self.probe_executor.submit(timed_probe, name, fn)
+                for name, fn in probes.items()
+            }
+            wait(futures.values(), timeout=self.probe_deadline)
+        elapsed = time.monotonic() - start
+
+        results = {}
+        for name, future in futures.items():
+            if future.done():
+                results[name] = future.result()
+            else:
+                logger.warning(f"⏱️ Probe '{name}' exceeded {self.probe_deadline}s cycle deadline")
+                results[name] = ProbeResult(name, DNSTarget.UNKNOWN, elapsed, timed_out=True)
+
+        # Built aside and swapped in whole: _publish may be serializing the previous one
+        last_probes = {name: result.to_dict() for name, result in results.items()}
+        last_probes["synthetic"] = self.prober.to_dict(self.hostname)
+        capacity = self.health_checker.tunnel.cached if self.health_checker.tunnel else None
+        if capacity is not None:
+            last_probes["tunnel"] = capacity.to_dict()
+        metrics.observe("dns_failover_probe_duration_seconds", results["dns"].duration_seconds, probe="dns")
+        if not results["dns"].timed_out and self.dns_checker.last_answers:
+            last_probes["dns"]["resolvers"] = [a.to_dict() for a in self.dns_checker.last_answers]
+        self.last_probes = last_probes
+        return results
 
     def reconcile(self):
         """
         Reconciliation loop - verifies actual DNS state matches desired state.
         This runs periodically and self-heals from drift.
         """
+        with metrics.timer("dns_failover_reconcile_duration_seconds"), tracer.span("reconcile", hostname=self.hostname):
+            self._reconcile()
+
+    def _reconcile(self):
+        try:
+            # Steps 1-3: DNS resolution, Cloudflare API and desired target run
+            # in parallel, outside the state lock
+            probes = self.run_probes()
+        except Exception as e:
+            logger.error(f"Error running reconcile probes: {e}", exc_info=True)
+            return
+
+        actual_target = probes["dns"].value
+        api_target = probes["cloudflare_api"].value
+        desired_target = probes["desired"].value
+        tracer.annotate(actual=actual_target.value, api=api_target.value, desired=desired_target.value)
+
+        if not self.is_leader():
+            # Warm standby: probes and caches stay current, decisions are the leader's
+            self._publish(republish=True)
+            return
+
         with self.state_lock:
             try:
-                # Step 1: Check actual DNS state (ground truth via DNS resolution)
-                actual_target = self.dns_checker.get_actual_dns_target()
+                if logger.isEnabledFor(logging.DEBUG):
+                    logger.debug(f"Reconcile: actual_dns={actual_target.value}, "
+                                 f"api={api_target.value}, desired={desired_target.value}, "
+                                 f"state={self.state.current_target.value}")
 
-                # Step 2: Also verify via Cloudflare API for accuracy
-                api_target = self.cf_api.get_dns_target_from_api(
-                    self.hostname, self.vps_ip, self.tunnel_id
-                )
+                # Step 4: Check for drift between API and our state
+                with tracer.span("drift_check") as span:
+                    if api_target != DNSTarget.UNKNOWN and api_target != self.state.current_target:
+                        span["drift"] = True
+                        metrics.inc("dns_failover_drift_detections_total")
+                        logger.warning(f"⚠️ State drift detected! API shows {api_target.value} "
+                                       f"but state says {self.state.current_target.value}")
+                        # Update our state to match reality
+                        self.history.record("drift", self.clock.utcnow(), self.state.current_target, api_target,
+                                            "Cloudflare API record differed from controller state")
+                        self.state.current_target = api_target
+                        self._save_state()
+                    if api_target == DNSTarget.VPS_FAILOVER:
+                        record = self.cf_api.get_dns_record(self.hostname)
+                        if record and record.get("content") != self.state.vps_ip:
+                            self.state.vps_ip = record.get("content")
+                            self._save_state()
 
-                # Step 3: Determine desired target based on actual health
-                desired_target = self.determine_desired_target()
+                # Health is unknown (probe timed out or failed) - don't act on it
+                if desired_target == DNSTarget.UNKNOWN:
+                    logger.warning("Desired target unknown this cycle - skipping decision")
+                    return
 
-                logger.debug(f"Reconcile: actual_dns={actual_target.value}, "
-                           f"api={api_target.value}, desired={desired_target.value}, "
-                           f"state={self.state.current_target.value}")
+                with tracer.span("evaluate") as span:
+                    # Tunnel and the whole VPS pool down: hold DNS where it is
+                    vps_target = self.select_vps_target() if desired_target == DNSTarget.VPS_FAILOVER else None
+                    span["vps_target"] = vps_target
+                    if desired_target == DNSTarget.VPS_FAILOVER and vps_target is None:
+                        self._enter_dual_failure()
+                        return
+                    if self.state.system_state == SystemState.DUAL_FAILURE:
+                        self._leave_dual_failure(desired_target)
 
-                # Step 4: Check for drift between API and our state
-                if api_target != DNSTarget.UNKNOWN and api_target != self.state.current_target:
-                    logger.warning(f"⚠️ State drift detected! API shows {api_target.value} "
-                                 f"but state says {self.state.current_target.value}")
-                    # Update our state to match reality
-                    self.state.current_target = api_target
-                    self._save_state()
-
-                # Step 5: If desired != actual and we're not stabilizing, initiate change
-                if desired_target != self.state.current_target:
-                    if self.state.stabilization_start:
-                        # Already stabilizing, check if period has passed
-                        self._check_stabilization_and_execute()
-                    else:
-                        # Start stabilization
-                        if desired_target == DNSTarget.VPS_FAILOVER:
-                            logger.warning(f"🔥 Detected tunnel failure - initiating failover")
-                            self._start_failover_stabilization()
+                    # On failover but the active VPS went bad: move to the best healthy member
+                    if (desired_target == DNSTarget.VPS_FAILOVER == self.state.current_target
+                            and vps_target != self.state.vps_ip
+                            and self._vps_verdict(self.state.vps_ip) is False):
+                        self._switch_vps(vps_target)
+
+                with tracer.span("stabilization", state=self.state.system_state.value):
+                    # Step 5: If desired != actual and we're not stabilizing, initiate change
+                    if desired_target != self.state.current_target:
+                        if self.state.stabilization_start:
+                            # Already stabilizing, check if period has passed
+                            self._check_stabilization_and_execute()
                         else:
-                            logger.info(f"✅ Detected tunnel recovery - initiating failback")
-                            self._start_failback_stabilization()
+                            # Start stabilization
+                            if desired_target == DNSTarget.VPS_FAILOVER:
+                                logger.warning(f"🔥 Detected tunnel failure - initiating failover")
+                                self._start_failover_stabilization()
+                            else:
+                                logger.info(f"✅ Detected tunnel recovery - initiating failback")
+                                self._start_failback_stabilization()
 
-                # Step 6: If we're stabilizing, check if period has passed
-                elif self.state.stabilization_start:
-                    self._check_stabilization_and_execute()
+                    # Step 6: Desired is back to the current target mid-stabilization - the switch is off
+                    elif self.state.stabilization_start:
+                        self._cancel_stabilization()
 
             except Exception as e:
                 logger.error(f"Error in reconciliation: {e}", exc_info=True)
+            finally:
+                # Publish this cycle's probe results even when nothing transitioned
+                self._publish()
+
+    def _vps_verdict(self, ip: Optional[str]) -> Optional[bool]:
+        return self.prober.candidates(self.hostname, "vps").get(ip, (None, None))[0]
+
+    def _enter_dual_failure(self):
+        """Nothing healthy to fail over to - record it once and leave DNS alone"""
+        if self.state.system_state == SystemState.DUAL_FAILURE:
+            return
+        logger.error(f"💀 {self.hostname}: tunnel down and no healthy VPS in pool {self.vps_ips} - "
+                     f"holding DNS on {self.state.current_target.value}")
+        self.history.record("dual_failure", self.clock.utcnow(), self.state.current_target,
+                            self.state.current_target, "tunnel and every VPS candidate unhealthy")
+        # stabilization_start is kept: a VPS coming back resumes the same failover countdown
+        self.state.system_state = SystemState.DUAL_FAILURE
+        self.scheduler.cancel(f"stabilization:{self.hostname}")
+        self._save_state()
+        metrics.inc("dns_failover_dual_failures_total")
+
+    def _leave_dual_failure(self, desired_target: DNSTarget):
+        """A target is usable again - restore the state the dual failure interrupted"""
+        logger.info(f"✅ {self.hostname}: leaving dual failure (desired={desired_target.value})")
+        if desired_target == self.state.current_target:
+            self.state.stabilization_start = None
+            self.state.system_state = (SystemState.PRIMARY_HEALTHY
+                                       if desired_target == DNSTarget.CLOUDFLARE_TUNNEL else SystemState.ON_FAILOVER)
+        elif self.state.current_target == DNSTarget.VPS_FAILOVER:
+            # Tunnel back while on the VPS: failback stabilization starts from scratch
+            self.state.stabilization_start = None
+            self.state.system_state = SystemState.ON_FAILOVER
+        else:
+            self.state.system_state = SystemState.PRIMARY_DEGRADED
+            self._arm_stabilization_timer()
+        self._save_state()
+
+    def _switch_vps(self, vps_ip: str):
+        """Repoint the failover record at another pool member (no stabilization - the active one is failing)"""
+        previous = self.state.vps_ip
+        logger.warning(f"🔀 {self.hostname}: VPS {previous} unhealthy - switching to {vps_ip}")
+        if not self.is_leader():
+            return
+        if self.dry_run:
+            logger.info(f"DRY RUN: Would switch DNS to VPS {vps_ip}")
+        elif not self.cf_api.update_to_vps(self.hostname, vps_ip):
+            logger.error(f"Failed to update DNS to VPS {vps_ip}")
+            return
+        now = self.clock.utcnow()
+        self.history.record("vps_switch", now, DNSTarget.VPS_FAILOVER, DNSTarget.VPS_FAILOVER,
+                            f"{previous} unhealthy, moved to {vps_ip}")
+        self.state.vps_ip = vps_ip
+        self.state.last_change_time = now.isoformat()
+        self._save_state()
+        self.prober.reset(self.hostname, "public")
+        metrics.inc("dns_failover_vps_switches_total")
+        if not self.dry_run:
+            self.propagation.watch(DNSTarget.VPS_FAILOVER)
 
     def _start_failover_stabilization(self):
         """Start stabilization period for failover"""
-        if self.state.failover_count_24h >= self.max_failovers_24h:
-            logger.error(f"⛔ Circuit breaker! {self.state.failover_count_24h} failovers in 24h")
+        now = self.clock.utcnow()
+        recent = self.history.count(now)
+        if recent >= self.max_failovers_24h:
+            metrics.inc("dns_failover_circuit_breaker_trips_total")
+            oldest = self.history.oldest_in_window()
+            if oldest is None:
+                # MAX_FAILOVERS_24H=0: nothing in the window, the breaker never closes
+                logger.error(f"⛔ Circuit breaker! MAX_FAILOVERS_24H={self.max_failovers_24h} - "
+                             f"automatic failover is disabled")
+                return
+            # Closes again once the oldest failover leaves the window
+            closes_in = oldest + self.history.window_seconds - TransitionHistory._epoch(now)
+            logger.error(f"⛔ Circuit breaker! {recent} failovers in the last "
+                         f"{self.history.window_seconds / 3600:g}h - closes in {closes_in / 60:.0f}min")
             return
 
-        self.state.stabilization_start = datetime.utcnow().isoformat()
+        self.state.stabilization_start = self.clock.utcnow().isoformat()
         self.state.system_state = SystemState.PRIMARY_DEGRADED
         self._save_state()
+        self._arm_stabilization_timer()
         logger.info(f"⏱️ Starting {self.stabilization_failover_minutes}min failover stabilization")
 
     def _start_failback_stabilization(self):
         """Start stabilization period for failback"""
-        self.state.stabilization_start = datetime.utcnow().isoformat()
+        self.state.stabilization_start = self.clock.utcnow().isoformat()
         self.state.system_state = SystemState.RECOVERING
         self._save_state()
+        self._arm_stabilization_timer()
         logger.info(f"⏱️ Starting {self.stabilization_failback_minutes}min failback stabilization")
 
+    def _cancel_stabilization(self):
+        """The condition that started stabilization cleared before the period ran out"""
+        action = "failover" if self.state.system_state == SystemState.PRIMARY_DEGRADED else "failback"
+        logger.info(f"↩️ {self.hostname}: {action} no longer wanted - cancelling stabilization")
+        self.state.stabilization_start = None
+        self.state.system_state = (SystemState.PRIMARY_HEALTHY
+                                   if self.state.current_target == DNSTarget.CLOUDFLARE_TUNNEL
+                                   else SystemState.ON_FAILOVER)
+        self.scheduler.cancel(f"stabilization:{self.hostname}")
+        self._save_state()
+
+    def _stabilization_remaining(self, state: Optional[FailoverState] = None) -> Optional[timedelta]:
+        """Time left in the current stabilization period (None if not stabilizing)"""
+        state = state or self.state
+        if not state.stabilization_start:
+            return None
+        if state.system_state == SystemState.PRIMARY_DEGRADED:
+            required = timedelta(minutes=self.stabilization_failover_minutes)
+        elif state.system_state == SystemState.RECOVERING:
+            required = timedelta(minutes=self.stabilization_failback_minutes)
+        else:
+            return None
+        elapsed = self.clock.utcnow() - datetime.fromisoformat(state.stabilization_start)
+        return required - elapsed
+
+    def _arm_stabilization_timer(self):
+        """Fire a reconcile the moment stabilization expires"""
+        remaining = self._stabilization_remaining()
+        if remaining is None:
+            return
+        # Small slack so the deadline check sees the period as complete
+        delay = max(remaining.total_seconds(), 0) + 0.05
+        self.scheduler.schedule(f"stabilization:{self.hostname}", delay, self._on_stabilization_deadline)
+
+    def _on_stabilization_deadline(self):
+        logger.info(f"⏱️ Stabilization deadline reached for {self.hostname} - reconciling")
+        self.request_reconcile("stabilization deadline")
+
+    def request_reconcile(self, reason: str = "") -> bool:
+        """Queue a reconcile of this hostname (merged with any already pending)"""
+        return self.queue.submit(self.hostname, self.reconcile, reason)
+
+    def next_reconcile_interval(self) -> int:
+        """Fast cadence while degraded or stabilizing, slow while healthy"""
+        if self.state.system_state == SystemState.PRIMARY_HEALTHY and not self.state.stabilization_start:
+            return self.reconcile_interval
+        return self.fast_reconcile_interval
+
     def _check_stabilization_and_execute(self):
         """Check if stabilization period complete and execute DNS change"""
         if not self.state.stabilization_start:
             return
 
-        stabilization_start = datetime.fromisoformat(self.state.stabilization_start)
-        elapsed = datetime.utcnow() - stabilization_start
-
         # Determine required stabilization time
         if self.state.system_state == SystemState.PRIMARY_DEGRADED:
-            required = timedelta(minutes=self.stabilization_failover_minutes)
             action = "failover"
         elif self.state.system_state == SystemState.RECOVERING:
-            required = timedelta(minutes=self.stabilization_failback_minutes)
             action = "failback"
         else:
             return
 
-        if elapsed < required:
-            remaining = (required - elapsed).total_seconds() / 60
-            logger.debug(f"⏱️ Stabilizing for {action}... {remaining:.1f}min remaining")
+        remaining_delta = self._stabilization_remaining()
+        if remaining_delta > timedelta(0):
+            remaining = remaining_delta.total_seconds() / 60
+            if logger.isEnabledFor(logging.DEBUG):
+                logger.debug(f"⏱️ Stabilizing for {action}... {remaining:.1f}min remaining")
             return
 
         # Stabilization complete - execute change
-        if action == "failover":
-            self._execute_failover()
-        else:
-            self._execute_failback()
+        with tracer.span("execute", action=action):
+            if action == "failover":
+                self._execute_failover()
+            else:
+                self._execute_failback()
 
     def _execute_failover(self):
         """Execute failover to VPS"""
         logger.warning(f"🚨 Executing failover to VPS")
 
+        if not self.is_leader():
+            logger.warning("Not leader - leaving failover to the current leader")
+            return
+
+        vps_ip = self.select_vps_target()
+        if vps_ip is None:
+            self._enter_dual_failure()
+            return
+
         if self.dry_run:
-            logger.info("DRY RUN: Would switch DNS to VPS")
+            logger.info(f"DRY RUN: Would switch DNS to VPS {vps_ip}")
         else:
-            success = self.cf_api.update_to_vps(self.hostname, self.vps_ip)
+            success = self.cf_api.update_to_vps(self.hostname, vps_ip)
             if not success:
                 logger.error("Failed to update DNS to VPS")
                 return
 
+        now = self.clock.utcnow()
+        self.history.record("failover", now, self.state.current_target, DNSTarget.VPS_FAILOVER,
+                            f"cloudflared unhealthy for {self.stabilization_failover_minutes}min, "
+                            f"VPS {vps_ip} selected")
         self.state.current_target = DNSTarget.VPS_FAILOVER
+        self.state.vps_ip = vps_ip
         self.state.system_state = SystemState.ON_FAILOVER
-        self.state.last_change_time = datetime.utcnow().isoformat()
-        self.state.failover_count_24h += 1
+        self.state.last_change_time = now.isoformat()
         self.state.stabilization_start = None
+        self.scheduler.cancel(f"stabilization:{self.hostname}")
         self._save_state()
+        # Public probes now measure the VPS path
+        self.prober.reset(self.hostname, "public")
 
-        logger.info("✅ Failover to VPS complete")
+        metrics.inc("dns_failover_failovers_total")
+        logger.info(f"✅ Failover to VPS {vps_ip} complete")
+        if not self.dry_run:
+            self.propagation.watch(DNSTarget.VPS_FAILOVER)
 
     def _execute_failback(self):
         """Execute failback to Cloudflare Tunnel"""
         logger.info(f"🔄 Executing failback to Cloudflare Tunnel")
 
+        if not self.is_leader():
+            logger.warning("Not leader - leaving failback to the current leader")
+            return
+
         if self.dry_run:
             logger.info("DRY RUN: Would switch DNS back to Cloudflare Tunnel")
         else:
@@ -491,100 +3638,558 @@ class FailoverController:
                 logger.error("Failed to update DNS to tunnel")
                 return
 
+        now = self.clock.utcnow()
+        self.history.record("failback", now, self.state.current_target, DNSTarget.CLOUDFLARE_TUNNEL,
+                            f"cloudflared healthy for {self.stabilization_failback_minutes}min")
         self.state.current_target = DNSTarget.CLOUDFLARE_TUNNEL
         self.state.system_state = SystemState.PRIMARY_HEALTHY
-        self.state.last_change_time = datetime.utcnow().isoformat()
+        self.state.last_change_time = now.isoformat()
         self.state.stabilization_start = None
+        self.scheduler.cancel(f"stabilization:{self.hostname}")
         self._save_state()
+        self.prober.reset(self.hostname, "public")
 
+        metrics.inc("dns_failover_failbacks_total")
         logger.info("✅ Failback to Cloudflare Tunnel complete")
+        if not self.dry_run:
+            self.propagation.watch(DNSTarget.CLOUDFLARE_TUNNEL)
 
-    def reconciliation_loop(self):
-        """Background thread that runs reconciliation periodically"""
-        logger.info(f"Starting reconciliation loop (interval={self.reconcile_interval}s)")
-        while True:
-            try:
-                self.reconcile()
-            except Exception as e:
-                logger.error(f"Reconciliation loop error: {e}", exc_info=True)
-            time.sleep(self.reconcile_interval)
+
+class FailoverManager:
+    """
+    Runs one FailoverController per managed hostname.
+    All controllers share one HTTP pool, one pod cache, one Cloudflare client
+    per zone, and a bounded worker pool for concurrent reconciles.
+    """
+
+    def __init__(self, targets: Optional[List[ManagedHostname]] = None,
+                 health_checker: Optional[HealthChecker] = None,
+                 cf_apis: Optional[Dict[str, CloudflareAPI]] = None,
+                 clock: Optional[Clock] = None,
+                 elector: Optional[LeaderElector] = None,
+                 startup: Optional["Startup"] = None):
+        self.targets = targets or load_managed_hostnames()
+        self.clock = clock or Clock()
+        self.scheduler = TimerScheduler(self.clock)
+        self.queue = ReconcileQueue(
+            min_interval=float(os.getenv("RECONCILE_MIN_INTERVAL_SECONDS", "1")), clock=self.clock
+        )
+        self.alert_dedup = TTLCache(float(os.getenv("ALERT_DEDUP_TTL_SECONDS", "60")), clock=self.clock)
+        self.alert_log = LogSampler(float(os.getenv("ALERT_LOG_INTERVAL_SECONDS", "10")), clock=self.clock)
+        self.reconcile_interval = int(os.getenv("RECONCILE_INTERVAL_SECONDS", "30"))
+        self.dry_run = os.getenv("DRY_RUN", "false").lower() == "true"
+        max_workers = int(os.getenv("MAX_CONCURRENT_RECONCILES", "8"))
+
+        self.health_checker = health_checker or HealthChecker(http=build_http_client())
+        self.http = self.health_checker.http
+
+        # One Cloudflare client (record cache, batch writer) per zone, one API budget for all
+        self.cf_rate_limiter = build_cloudflare_rate_limiter()
+        self.cf_apis: Dict[str, CloudflareAPI] = dict(cf_apis or {})
+        for zone_id in {t.zone_id for t in self.targets} - set(self.cf_apis):
+            self.cf_apis[zone_id] = build_cloudflare_api(zone_id, self.http, self.cf_rate_limiter, self.clock)
+
+        # Each reconcile runs 3 probes; size the probe pool to match
+        self.reconcile_executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="reconcile")
+        self.probe_executor = ThreadPoolExecutor(max_workers=max_workers * 3 + 2, thread_name_prefix="probe")
+        # Post-switch propagation polls for every hostname share a few threads
+        self.propagation_executor = ThreadPoolExecutor(max_workers=int(os.getenv("PROPAGATION_WORKERS", "4")),
+                                                       thread_name_prefix="propagation")
+
+        # One synthetic probe pool for every hostname's public/origin/VPS checks
+        self.prober = SyntheticProber(self.scheduler, self.http,
+                                      max_workers=int(os.getenv("SYNTHETIC_PROBE_WORKERS", "16")))
+
+        # Without an elector this instance is always the leader
+        self.elector = elector or build_leader_elector(self.health_checker.k8s_core)
+
+        # One write-behind store for all hostnames; state is read once up front
+        self.state_store = StateStore(
+            self.health_checker.k8s_core, "dns-failover-state", "ingress", scheduler=self.scheduler,
+            delay=float(os.getenv("STATE_WRITE_DELAY_SECONDS", "0.5")), writable=self.is_leader,
+            max_bytes=int(os.getenv("STATE_CONFIGMAP_MAX_BYTES", str(900 * 1024))),
+        )
+        try:
+            with startup.phase("manager.state_load") if startup else nullcontext():
+                state_data = self.state_store.load()
+        except Exception as e:
+            logger.warning(f"Could not read state ConfigMap: {e}")
+            state_data = {}
+
+        self.controllers: Dict[str, FailoverController] = {}
+        for target in self.targets:
+            self.controllers[target.hostname] = FailoverController(
+                target,
+                cf_api=self.cf_apis[target.zone_id],
+                health_checker=self.health_checker,
+                probe_executor=self.probe_executor,
+                state_data=state_data,
+                scheduler=self.scheduler,
+                queue=self.queue,
+                state_store=self.state_store,
+                is_leader=self.is_leader,
+                prober=self.prober,
+                propagation_executor=self.propagation_executor,
+            )
+        self.primary = self.controllers[self.targets[0].hostname]
+        if self.elector is not None:
+            self.elector.add_listener(self._on_leadership)
+
+        # Pod phase/readiness changes reconcile every hostname at once
+        self.health_checker.pod_cache.add_listener(self._on_pod_change)
+        metrics.add_collector(self.collect_metrics)
+
+    def collect_metrics(self) -> List[Tuple[str, Dict[str, str], float]]:
+        """State gauges for /metrics, read from the published snapshots"""
+        samples = []
+        for hostname, c in self.controllers.items():
+            state = c.snapshot.state
+            for s in SystemState:
+                samples.append(("dns_failover_system_state",
+                                {"hostname": hostname, "state": s.value},
+                                1 if state.system_state == s else 0))
+            for t in DNSTarget:
+                samples.append(("dns_failover_dns_target",
+                                {"hostname": hostname, "target": t.value},
+                                1 if state.current_target == t else 0))
+            remaining = c._stabilization_remaining(state)
+            samples.append(("dns_failover_stabilization_remaining_seconds", {"hostname": hostname},
+                            max(remaining.total_seconds(), 0) if remaining else 0))
+        for name, probe in self.prober.probes.items():
+            score = self.prober.scores[name].score
+            if score is not None:
+                samples.append(("dns_failover_health_score",
+                                {"hostname": probe.hostname, "group": probe.group, "url": probe.url}, score))
+        capacity = self.health_checker.tunnel.cached if self.health_checker.tunnel else None
+        if capacity is not None:
+            samples.append(("dns_failover_tunnel_ha_connections", {}, capacity.ha_connections))
+            samples.append(("dns_failover_tunnel_connected_pods", {}, capacity.connected_pods))
+        samples.append(("dns_failover_leader", {}, 1 if self.is_leader() else 0))
+        return samples
+
+    def is_leader(self) -> bool:
+        return self.elector is None or self.elector.is_leader()
+
+    def _sync_state(self):
+        """Adopt the persisted state of every hostname (standby refresh and promotion)"""
+        try:
+            state_data = self.state_store.load()
+        except Exception as e:
+            logger.warning(f"Could not read state ConfigMap: {e}")
+            return
+        for c in self.controllers.values():
+            if c.state_key in state_data:
+                try:
+                    c._adopt_state(*c._parse_state(state_data[c.state_key]))
+                except Exception as e:
+                    logger.warning(f"Could not parse persisted state for {c.hostname}: {e}")
+
+    def _on_leadership(self, leading: bool):
+        """Elector listener: resume from the persisted state on promotion, drop writes on loss"""
+        if leading:
+            self._sync_state()
+            for c in self.controllers.values():
+                # Standbys never arm deadlines; pick up any stabilization in progress
+                c._arm_stabilization_timer()
+            self.request_reconcile_all("became leader")
+        else:
+            self.state_store.discard()
+
+    def reconcile_all(self):
+        """Reconcile every managed hostname on the bounded worker pool"""
+        start = time.monotonic()
+        if not self.is_leader():
+            # One ConfigMap read keeps the standby's state as fresh as its probes
+            self._sync_state()
+        futures = [self.reconcile_executor.submit(c.reconcile) for c in self.controllers.values()]
+        wait(futures)
+        logger.debug(f"Reconciled {len(futures)} hostnames in {time.monotonic() - start:.2f}s")
+
+    def next_reconcile_interval(self) -> int:
+        """Fast while any hostname is degraded or stabilizing, slow while all are healthy"""
+        return min((c.next_reconcile_interval() for c in self.controllers.values()),
+                   default=self.reconcile_interval)
+
+    def request_reconcile_all(self, reason: str = "") -> bool:
+        """Queue a reconcile of every hostname (absorbs pending per-hostname requests)"""
+        return self.queue.submit(ReconcileQueue.ALL, self.reconcile_all, reason)
+
+    def _reconcile_tick(self):
+        """Timer callback: queue a periodic reconcile and re-arm adaptively"""
+        self.request_reconcile_all("periodic")
+        self.scheduler.schedule("reconcile", self.next_reconcile_interval(), self._reconcile_tick)
+
+    def start(self):
+        """Start the timer thread and the periodic reconcile"""
+        logger.info(f"Starting reconciliation for {len(self.controllers)} hostnames "
+                    f"(interval={self.reconcile_interval}s, "
+                    f"fast={self.primary.fast_reconcile_interval}s)")
+        self.queue.start()
+        self.state_store.start()
+        self.scheduler.start()
+        self.scheduler.schedule("reconcile", 0, self._reconcile_tick)
+        self.prober.start()
+        if self.elector is not None:
+            self.elector.start()
+
+    def stop(self):
+        """Shutdown: write pending state, then hand the Lease to the standby"""
+        self.state_store.flush()
+        if self.elector is not None:
+            self.elector.stop()
+
+    def _on_pod_change(self):
+        """Pod cache listener - reconcile immediately instead of waiting for the next tick"""
+        logger.info("Cloudflared pod status changed - triggering reconciliation")
+        self.request_reconcile_all("pod change")
+
+    def get(self, hostname: Optional[str]) -> Optional[FailoverController]:
+        """Controller for a hostname (primary hostname when None)"""
+        if not hostname:
+            return self.primary
+        return self.controllers.get(hostname)
 
     def handle_alert(self, alert_data: Dict[str, Any]) -> Dict[str, str]:
         """
-        Handle incoming alert webhook.
-        Alerts are now treated as triggers to speed up detection,
-        but reconciliation loop verifies actual state.
+        Route an Alertmanager webhook. Alerts carrying a `hostname` label
+        that we manage reconcile only that hostname; anything else reconciles all.
+        Repeated alerts (same fingerprint and status within the dedup TTL) are
+        dropped and triggers are coalesced, so this returns in constant time.
         """
-        alerts = alert_data.get("alerts", [])
+        alerts = filter_new_alerts(alert_data.get("alerts", []), self.alert_dedup)
+        if not alerts:
+            return {"status": "ok", "action": "deduplicated"}
+
+        hostnames = {a.get("labels", {}).get("hostname") for a in alerts}
+        log_alerts(alerts, self.alert_log)
+
+        if all(h in self.controllers for h in hostnames):
+            queued = [self.controllers[h].request_reconcile("alert") for h in hostnames]
+        else:
+            queued = [self.request_reconcile_all("alert")]
+
+        return {"status": "ok", "action": "triggered_reconciliation" if any(queued) else "coalesced"}
+
+
+class Startup:
+    """
+    Startup phases and their durations. The HTTP server binds before any of
+    them run: /health answers at once (liveness), /ready only once every
+    phase has completed (readiness).
+    """
+
+    def __init__(self, started: float):
+        self.started = started
+        self.phases: "OrderedDict[str, float]" = OrderedDict()
+        self.ready = threading.Event()
+        self.error: Optional[str] = None
 
-        for alert in alerts:
-            labels = alert.get("labels", {})
-            status = alert.get("status", "")
-            alert_name = labels.get("alertname", "")
+    @contextmanager
+    def phase(self, name: str):
+        start = time.monotonic()
+        try:
+            yield
+        finally:
+            self.phases[name] = time.monotonic() - start
+            logger.info(f"⏱️ Startup phase {name}: {self.phases[name] * 1000:.0f}ms")
+
+    def mark(self, name: str, since: float):
+        """Record a phase that began before the tracker existed (module import)"""
+        self.phases[name] = time.monotonic() - since
+
+    def finish(self):
+        self.phases["total"] = time.monotonic() - self.started
+        self.ready.set()
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            "ready": self.ready.is_set(),
+            "error": self.error,
+            "phases_ms": {name: round(seconds * 1000, 1) for name, seconds in list(self.phases.items())},
+        }
+
+    def collect(self) -> List[Tuple[str, Dict[str, str], float]]:
+        samples = [("dns_failover_startup_phase_seconds", {"phase": name}, round(seconds, 4))
+                   for name, seconds in list(self.phases.items())]
+        samples.append(("dns_failover_ready", {}, 1 if self.ready.is_set() else 0))
+        return samples
+
+
+startup = Startup(_import_started)
+metrics.add_collector(startup.collect)
 
-            logger.info(f"Received alert: {alert_name} ({status}) - triggering reconciliation")
+# Built on the startup thread by start_controller(); routes answer 503 until then
+manager: Optional[FailoverManager] = None
+controller: Optional[FailoverController] = None
 
-        # Trigger immediate reconciliation instead of acting directly
-        threading.Thread(target=self.reconcile, daemon=True).start()
 
-        return {"status": "ok", "action": "triggered_reconciliation"}
+def start_controller():
+    """Build and start everything behind the HTTP server, phase by phase"""
+    global manager, controller
+    try:
+        with startup.phase("kubernetes"):
+            # kubernetes import + kube config + the one shared ApiClient
+            health_checker = HealthChecker(http=build_http_client(), k8s_core=build_kube_core())
+            # Start cloudflared pod watch now so its first list overlaps the state ConfigMap read
+            health_checker.pod_cache.start()
+        with startup.phase("manager"):
+            built = FailoverManager(health_checker=health_checker, startup=startup)
+        manager, controller = built, built.primary
+        logger.info(f"Starting DNS Failover Controller v2 for {len(manager.controllers)} hostname(s) "
+                    f"(primary {controller.hostname})")
+        logger.info(f"Dry run mode: {manager.dry_run}")
+        logger.info(f"Reconciliation interval: {manager.reconcile_interval}s")
+
+        with startup.phase("pod_cache_sync"):
+            if not health_checker.pod_cache.synced.wait(float(os.getenv("STARTUP_SYNC_TIMEOUT_SECONDS", "10"))):
+                logger.warning("Pod cache not synced yet - falling back to direct pod lists until it is")
+        with startup.phase("start"):
+            # Start timer-driven reconciliation (adaptive cadence + stabilization deadlines)
+            manager.start()
+        startup.finish()
+        logger.info(f"🚀 Ready in {startup.phases['total'] * 1000:.0f}ms")
+    except Exception as e:
+        startup.error = f"{type(e).__name__}: {e}"
+        logger.error(f"Startup failed: {e}", exc_info=True)
+
 
+def requires_manager(view):
+    """503 until the startup thread has built the manager"""
+    @functools.wraps(view)
+    def wrapper(*args, **kwargs):
+        if manager is None:
+            return jsonify({"status": "starting", "startup": startup.to_dict()}), 503
+        return view(*args, **kwargs)
+    return wrapper
 
-# Initialize controller
-controller = FailoverController()
+
+startup.mark("imports", _import_started)
 
 
 @app.route('/health', methods=['GET'])
 def health():
-    """Health check endpoint"""
+    """Liveness: answers from the moment the server binds (reads the published snapshot once built)"""
+    if startup.error:
+        return jsonify({"status": "failed", "startup": startup.to_dict()}), 500
+    if controller is None:
+        return jsonify({"status": "starting", "startup": startup.to_dict()})
+    state = controller.snapshot.state
     return jsonify({
         "status": "healthy",
-        "current_target": controller.state.current_target.value,
-        "system_state": controller.state.system_state.value
+        "ready": startup.ready.is_set(),
+        "current_target": state.current_target.value,
+        "system_state": state.system_state.value,
+        "managed_hostnames": len(manager.controllers),
+        "role": "leader" if manager.is_leader() else "standby",
     })
 
 
+@app.route('/ready', methods=['GET'])
+def ready():
+    """Readiness: 200 once every startup phase has completed, with the phase timings"""
+    return jsonify(startup.to_dict()), 200 if startup.ready.is_set() else 503
+
+
+def forward_to_leader():
+    """On a standby, relay the request to the leader's address from the Lease"""
+    address = manager.elector.leader_address if manager.elector else None
+    # Our own (stale) address would loop back here
+    if not address or address == manager.elector.address:
+        return jsonify({"status": "error", "message": "standby and no leader known"}), 503
+    try:
+        # One attempt: Alertmanager retries the webhook itself, so a slow relay only ties up a server thread
+        response = manager.http.session.post(f"{address}{request.full_path.rstrip('?')}", data=request.get_data(),
+                                             headers={"Content-Type": request.content_type or "application/json"},
+                                             timeout=float(os.getenv("LEADER_FORWARD_TIMEOUT_SECONDS", "2")))
+    except Exception as e:
+        logger.error(f"Forwarding {request.path} to leader {address} failed: {e}")
+        return jsonify({"status": "error", "message": "leader unreachable"}), 503
+    return Response(response.content, status=response.status_code, mimetype="application/json")
+
+
 @app.route('/webhook', methods=['POST'])
+@requires_manager
 def webhook():
     """Alertmanager webhook endpoint"""
+    if not manager.is_leader():
+        metrics.inc("dns_failover_webhook_triggers_total", action="forwarded")
+        return forward_to_leader()
+    body = request.get_data(cache=False)
+    if logger.isEnabledFor(logging.DEBUG):
+        logger.debug(f"Received webhook: {body[:4096].decode('utf-8', 'replace')}")
     try:
-        alert_data = request.get_json()
-        logger.info(f"Received webhook: {json.dumps(alert_data, indent=2)}")
-
-        result = controller.handle_alert(alert_data)
+        alerts = parse_alerts(body)
+    except ValueError as e:
+        metrics.inc("dns_failover_webhook_triggers_total", action="invalid")
+        return jsonify({"status": "error", "message": f"invalid webhook payload: {e}"}), 400
+    try:
+        result = manager.handle_alert({"alerts": alerts})
+        metrics.inc("dns_failover_webhook_triggers_total", action=result["action"])
         return jsonify(result), 200
 
     except Exception as e:
+        metrics.inc("dns_failover_webhook_triggers_total", action="error")
         logger.error(f"Error processing webhook: {e}", exc_info=True)
         return jsonify({"status": "error", "message": str(e)}), 500
 
 
 @app.route('/state', methods=['GET'])
+@requires_manager
 def get_state():
-    """Get current state"""
-    with controller.state_lock:
-        state_dict = asdict(controller.state)
-        # Convert enums to strings for JSON serialization
-        state_dict['current_target'] = state_dict['current_target'].value if isinstance(state_dict['current_target'], DNSTarget) else state_dict['current_target']
-        state_dict['system_state'] = state_dict['system_state'].value if isinstance(state_dict['system_state'], SystemState) else state_dict['system_state']
-        return jsonify(state_dict)
+    """Get current state (primary hostname, or ?hostname=) - pre-serialized per version"""
+    target = manager.get(request.args.get("hostname"))
+    if target is None:
+        return jsonify({"status": "error", "message": "unknown hostname"}), 404
+    return Response(target.snapshot.body, mimetype="application/json")
+
+
+@app.route('/history', methods=['GET'])
+@requires_manager
+def get_history():
+    """Transition history, newest first: ?hostname=, ?limit= (default 20), ?before=<seq cursor>"""
+    target = manager.get(request.args.get("hostname"))
+    if target is None:
+        return jsonify({"status": "error", "message": "unknown hostname"}), 404
+    try:
+        limit = min(int(request.args.get("limit", "20")), target.history.entries.maxlen)
+        before = int(request.args["before"]) if "before" in request.args else None
+    except ValueError:
+        return jsonify({"status": "error", "message": "limit and before must be integers"}), 400
+    entries, next_cursor = target.history.page(limit, before)
+    return jsonify({
+        "hostname": target.hostname,
+        "entries": entries,
+        "next": next_cursor,
+        "failovers_in_window": target.history.count(target.clock.utcnow()),
+        "window_hours": target.history.window_seconds / 3600,
+    })
+
+
+@app.route('/hostnames', methods=['GET'])
+@requires_manager
+def get_hostnames():
+    """Summary of every managed hostname"""
+    summary = {}
+    for hostname, c in manager.controllers.items():
+        snapshot = c.snapshot
+        summary[hostname] = {
+            "current_target": snapshot.state.current_target.value,
+            "system_state": snapshot.state.system_state.value,
+            "stabilization_start": snapshot.state.stabilization_start,
+            "version": snapshot.version,
+        }
+    return jsonify(summary)
+
+
+@app.route('/stats', methods=['GET'])
+@requires_manager
+def get_stats():
+    """HTTP pool/retry, Cloudflare writes, reconcile queue, state persistence and leader election statistics"""
+    return jsonify({
+        "http": manager.http.stats(),
+        "cloudflare": {
+            "rate_limiter": manager.cf_rate_limiter.stats(),
+            "zones": {zone_id: api.stats() for zone_id, api in manager.cf_apis.items()},
+        },
+        "queue": {**manager.queue.stats(), "alerts_deduplicated": manager.alert_dedup.hits},
+        "state_store": manager.state_store.stats(),
+        "leader": manager.elector.stats() if manager.elector else None,
+    })
+
+
+@app.route('/metrics', methods=['GET'])
+def get_metrics():
+    """Prometheus exposition"""
+    return Response(metrics.render(), mimetype="text/plain; version=0.0.4")
+
+
+def debug_traces():
+    """Recent spans, newest first: ?limit= (default 100), ?name=, ?trace=, ?min_ms="""
+    try:
+        limit = int(request.args.get("limit", "100"))
+        trace = int(request.args["trace"]) if "trace" in request.args else None
+        min_ms = float(request.args.get("min_ms", "0"))
+    except ValueError:
+        return jsonify({"status": "error", "message": "limit and trace must be integers, min_ms a number"}), 400
+    return jsonify({
+        "enabled": tracer.enabled,
+        "capacity": tracer.spans.maxlen,
+        "spans": tracer.recent(limit, request.args.get("name"), trace, min_ms),
+    })
+
+
+def debug_profile():
+    """Sample every thread for ?seconds= (default 5) at ?hz= (default 100); collapsed stacks as text"""
+    try:
+        seconds = float(request.args.get("seconds", "5"))
+        hz = float(request.args.get("hz", "100"))
+    except ValueError:
+        return jsonify({"status": "error", "message": "seconds and hz must be numbers"}), 400
+    if not 0 < seconds <= profiler.max_seconds or not 0 < hz <= 1000:
+        return jsonify({"status": "error",
+                        "message": f"seconds must be in (0, {profiler.max_seconds:g}], hz in (0, 1000]"}), 400
+    stacks = profiler.profile(seconds, hz)
+    if stacks is None:
+        return jsonify({"status": "error", "message": "a profile is already running"}), 409
+    return Response(stacks, mimetype="text/plain")
+
+
+# Unauthenticated and on the webhook port: only served when explicitly enabled
+if os.getenv("DEBUG_ENDPOINTS", "false").lower() == "true":
+    app.add_url_rule('/debug/traces', view_func=debug_traces, methods=['GET'])
+    app.add_url_rule('/debug/profile', view_func=debug_profile, methods=['GET'])
 
 
 @app.route('/reconcile', methods=['POST'])
+@requires_manager
 def trigger_reconcile():
-    """Manually trigger reconciliation (for testing)"""
-    threading.Thread(target=controller.reconcile, daemon=True).start()
+    """Manually trigger reconciliation (for testing); ?hostname= limits it to one"""
+    if not manager.is_leader():
+        return forward_to_leader()
+    hostname = request.args.get("hostname")
+    if hostname:
+        target = manager.get(hostname)
+        if target is None:
+            return jsonify({"status": "error", "message": "unknown hostname"}), 404
+        target.request_reconcile("manual")
+    else:
+        manager.request_reconcile_all("manual")
     return jsonify({"status": "ok", "action": "triggered"})
 
 
+def serve(host: str, port: int):
+    """
+    Production WSGI server (waitress): a fixed pool of request threads, a cap
+    on open connections and on request size. HTTP_SERVER=development falls
+    back to Flask's own server.
+    """
+    if os.getenv("HTTP_SERVER", "waitress") == "development":
+        app.run(host=host, port=port, threaded=True)
+        return
+    from waitress import serve as waitress_serve
+    threads = int(os.getenv("HTTP_THREADS", "8"))
+    logger.info(f"Serving on {host}:{port} with {threads} request threads")
+    waitress_serve(
+        app, host=host, port=port, threads=threads,
+        connection_limit=int(os.getenv("HTTP_CONNECTION_LIMIT", "100")),
+        max_request_body_size=app.config["MAX_CONTENT_LENGTH"],
+        max_request_header_size=64 * 1024,
+        channel_timeout=int(os.getenv("HTTP_IDLE_TIMEOUT_SECONDS", "30")),
+        ident="dns-failover-controller",
+    )
+
+
 if __name__ == '__main__':
-    logger.info(f"Starting DNS Failover Controller v2 for {controller.hostname}")
-    logger.info(f"Dry run mode: {controller.dry_run}")
-    logger.info(f"Reconciliation interval: {controller.reconcile_interval}s")
+    # Everything slow (kubernetes import, kube config, ConfigMap read, pod sync)
+    # happens behind the already-listening server
+    threading.Thread(target=start_controller, name="startup", daemon=True).start()
+
+    def shutdown(signum, frame):
+        logger.info("Received SIGTERM - handing over")
+        if manager is not None:
+            manager.stop()
+        sys.exit(0)
 
-    # Start reconciliation loop in background thread
-    reconcile_thread = threading.Thread(target=controller.reconciliation_loop, daemon=True)
-    reconcile_thread.start()
+    signal.signal(signal.SIGTERM, shutdown)
 
-    # Start Flask app
-    app.run(host='0.0.0.0', port=8080)
+    serve(host='0.0.0.0', port=8080)
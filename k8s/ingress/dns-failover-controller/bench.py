@@ -0,0 +1,1532 @@
+#!/usr/bin/env python3
+"""
+Offline benchmarks for the DNS failover controller.
+Runs against an in-process mock Cloudflare API and a fake Kubernetes client.
+
+Usage:
+    python bench.py reconcile [--sizes 10,100,1000] [--cf-latency-ms 20] [--workers 8]
+    python bench.py ip-index [--addresses 100000]
+    python bench.py dns
+    python bench.py leader [--rounds 3] [--lease-duration 3] [--retry-period 1]
+    python bench.py cf-writes [--hostnames 200] [--limit 40] [--window 2]
+    python bench.py simulate [--scenario pod-crash] [--hostnames 1] [--verbose]
+    python bench.py startup [--runs 5] [--api-latency-ms 5] [--app PATH] [--script]
+    python bench.py webhook [--requests 2000] [--concurrency 16] [--alerts 20] [--server waitress] [--app PATH]
+"""
+
+import argparse
+import http.server
+import json
+import logging
+import math
+import os
+import py_compile
+import random
+import socket
+import statistics
+import struct
+import subprocess
+import tempfile
+import threading
+import time
+import types
+import sys
+from collections import Counter, deque
+from concurrent.futures import Future, ThreadPoolExecutor
+from datetime import timedelta
+from urllib.parse import urlparse, parse_qs
+
+os.environ.setdefault("CLOUDFLARE_API_TOKEN", "bench")
+os.environ.setdefault("CLOUDFLARE_ZONE_ID", "bench-zone")
+
+from kubernetes import client, config  # noqa: E402
+from kubernetes.client.rest import ApiException  # noqa: E402
+import requests  # noqa: E402
+
+TUNNEL_ID = "00000000-0000-0000-0000-000000000000"
+VPS_IP = "203.0.113.10"
+
+
+class FakeCoreV1Api:
+    """Just enough of CoreV1Api for the controller: pods and the state ConfigMap"""
+
+    def __init__(self, *args, **kwargs):
+        self.running_pods = 3
+        # False: every pod is Running but failing its readiness probe (CrashLoopBackOff)
+        self.pods_ready = True
+        self.config_map = {}
+        self.resource_version = 1
+        self.patches = 0
+        self.lists = 0
+
+    def list_namespaced_pod(self, namespace, label_selector=None, **kwargs):
+        self.lists += 1
+        ready = [types.SimpleNamespace(type="Ready", status="True" if self.pods_ready else "False")]
+        items = [
+            types.SimpleNamespace(
+                metadata=types.SimpleNamespace(name=f"cloudflared-{i}", resource_version="1"),
+                status=types.SimpleNamespace(phase="Running", conditions=ready, pod_ip=f"10.0.0.{i + 1}"),
+            )
+            for i in range(self.running_pods)
+        ]
+        return types.SimpleNamespace(items=items, metadata=types.SimpleNamespace(resource_version="1"))
+
+    def read_namespaced_config_map(self, name, namespace):
+        return types.SimpleNamespace(data=dict(self.config_map),
+                                     metadata=types.SimpleNamespace(resource_version=str(self.resource_version)))
+
+    def patch_namespaced_config_map(self, name, namespace, body):
+        self.patches += 1
+        expected = body.get("metadata", {}).get("resourceVersion")
+        if expected and expected != str(self.resource_version):
+            raise ApiException(status=409, reason="Conflict")
+        self.config_map.update(body.get("data", {}))
+        self.resource_version += 1
+        return self.read_namespaced_config_map(name, namespace)
+
+
+# Controllers build their kube client through these; point them at the fakes first
+config.load_incluster_config = lambda *a, **k: None
+config.load_kube_config = lambda *a, **k: None
+client.CoreV1Api = FakeCoreV1Api
+
+import app  # noqa: E402
+
+
+class MockCloudflare:
+    """
+    Threaded mock of the zone dns_records endpoints (list, PUT, batch) with
+    fixed per-request latency. With `rate_limit=(n, window)` it answers 429
+    plus Retry-After once more than n requests arrive within `window` seconds.
+    """
+
+    def __init__(self, records, latency, rate_limit=None):
+        self.records = {r["id"]: r for r in records}
+        self.latency = latency
+        self.rate_limit = rate_limit
+        self.recent = deque()
+        self.requests = {"GET": 0, "PUT": 0, "POST": 0, "429": 0}
+        self.lock = threading.Lock()
+        mock = self
+
+        class Handler(http.server.BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+            # Buffer headers + body into one segment (avoids Nagle/delayed-ACK stalls)
+            wbufsize = 65536
+
+            def _admit(self, method):
+                """Count the request; False (after sending a 429) if it is over the limit"""
+                with mock.lock:
+                    mock.requests[method] += 1
+                    if mock.rate_limit is None:
+                        return True
+                    limit, window = mock.rate_limit
+                    now = time.monotonic()
+                    while mock.recent and mock.recent[0] <= now - window:
+                        mock.recent.popleft()
+                    if len(mock.recent) < limit:
+                        mock.recent.append(now)
+                        return True
+                    mock.requests["429"] += 1
+                    retry_after = math.ceil(mock.recent[0] + window - now)
+                body = json.dumps({"success": False, "errors": [{"code": 10000, "message": "rate limited"}]}).encode()
+                if "Content-Length" in self.headers:
+                    self.rfile.read(int(self.headers["Content-Length"]))
+                self.send_response(429)
+                self.send_header("Retry-After", str(retry_after))
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+                return False
+
+            def _reply(self, body):
+                time.sleep(mock.latency)
+                data = json.dumps(body).encode()
+                self.send_response(200)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(data)))
+                self.end_headers()
+                self.wfile.write(data)
+
+            def do_GET(self):
+                if not self._admit("GET"):
+                    return
+                query = parse_qs(urlparse(self.path).query)
+                page = int(query.get("page", ["1"])[0])
+                per_page = int(query.get("per_page", ["100"])[0])
+                records = list(mock.records.values())
+                total_pages = max(1, -(-len(records) // per_page))
+                self._reply({
+                    "success": True,
+                    "result": records[(page - 1) * per_page:page * per_page],
+                    "result_info": {"page": page, "total_pages": total_pages},
+                })
+
+            def do_PUT(self):
+                if not self._admit("PUT"):
+                    return
+                body = json.loads(self.rfile.read(int(self.headers["Content-Length"])))
+                record = mock.records[self.path.rsplit("/", 1)[1]]
+                record.update(type=body["type"], content=body["content"], proxied=body["proxied"])
+                self._reply({"success": True, "result": dict(record)})
+
+            def do_POST(self):
+                if not self._admit("POST"):
+                    return
+                body = json.loads(self.rfile.read(int(self.headers["Content-Length"])))
+                # POST /zones/<zone>/dns_records/batch: all-or-nothing
+                if any(put["id"] not in mock.records for put in body.get("puts", [])):
+                    self._reply({"success": False, "errors": [{"code": 81044, "message": "record not found"}]})
+                    return
+                updated = []
+                for put in body.get("puts", []):
+                    record = mock.records[put["id"]]
+                    record.update(type=put["type"], content=put["content"], proxied=put["proxied"])
+                    updated.append(dict(record))
+                self._reply({"success": True, "result": {"puts": updated}})
+
+            def log_message(self, *args):
+                pass
+
+        self.server = http.server.ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+        self.url = f"http://127.0.0.1:{self.server.server_port}"
+
+    def reset_counts(self):
+        with self.lock:
+            self.requests = {"GET": 0, "PUT": 0, "POST": 0, "429": 0}
+
+
+class FakeLeaseServer:
+    """
+    Minimal coordination.k8s.io API server: get/create/replace one Lease with
+    resourceVersion checks, plus chunked watch streams. The real kubernetes
+    client talks to it over HTTP, so elections run the production code path.
+    """
+
+    def __init__(self):
+        self.lease = None
+        self.resource_version = 0
+        self.changed = threading.Condition()
+        self.closing = False
+        fake = self
+
+        class Handler(http.server.BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+
+            def setup(self):
+                super().setup()
+                # Watch events are small writes; don't let Nagle hold them back
+                self.connection.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+
+            def _reply(self, status, body):
+                data = json.dumps(body).encode()
+                self.send_response(status)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(data)))
+                self.end_headers()
+                self.wfile.write(data)
+
+            def _status(self, code, reason):
+                self._reply(code, {"kind": "Status", "apiVersion": "v1", "status": "Failure",
+                                   "reason": reason, "code": code})
+
+            def _body(self):
+                return json.loads(self.rfile.read(int(self.headers["Content-Length"])))
+
+            def _store(self, lease):
+                fake.resource_version += 1
+                lease.setdefault("metadata", {})["resourceVersion"] = str(fake.resource_version)
+                lease["apiVersion"], lease["kind"] = "coordination.k8s.io/v1", "Lease"
+                fake.lease = lease
+                fake.changed.notify_all()
+                return lease
+
+            def do_GET(self):
+                url = urlparse(self.path)
+                query = parse_qs(url.query)
+                if query.get("watch", ["false"])[0].lower() == "true":
+                    return self._watch(float(query.get("timeoutSeconds", ["300"])[0]))
+                with fake.changed:
+                    lease = fake.lease
+                if lease is None or not url.path.endswith("/" + lease["metadata"]["name"]):
+                    return self._status(404, "NotFound")
+                self._reply(200, lease)
+
+            def do_POST(self):
+                with fake.changed:
+                    if fake.lease is not None:
+                        return self._status(409, "AlreadyExists")
+                    lease = self._store(self._body())
+                self._reply(201, lease)
+
+            def do_PUT(self):
+                body = self._body()
+                with fake.changed:
+                    if fake.lease is None:
+                        return self._status(404, "NotFound")
+                    if body["metadata"].get("resourceVersion") != fake.lease["metadata"]["resourceVersion"]:
+                        return self._status(409, "Conflict")
+                    lease = self._store(body)
+                self._reply(200, lease)
+
+            def _watch(self, timeout):
+                self.send_response(200)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Transfer-Encoding", "chunked")
+                self.end_headers()
+                deadline = time.monotonic() + timeout
+                sent = None
+                event_type = "ADDED"
+                while True:
+                    with fake.changed:
+                        while (fake.lease is None or fake.lease["metadata"]["resourceVersion"] == sent) \
+                                and not fake.closing and time.monotonic() < deadline:
+                            fake.changed.wait(deadline - time.monotonic())
+                        if fake.closing or time.monotonic() >= deadline:
+                            break
+                        lease = fake.lease
+                    sent = lease["metadata"]["resourceVersion"]
+                    line = json.dumps({"type": event_type, "object": lease}).encode() + b"\n"
+                    try:
+                        self.wfile.write(b"%x\r\n%s\r\n" % (len(line), line))
+                    except (BrokenPipeError, ConnectionResetError):
+                        return  # a stopped replica hung up
+                    event_type = "MODIFIED"
+                try:
+                    self.wfile.write(b"0\r\n\r\n")
+                except (BrokenPipeError, ConnectionResetError):
+                    pass
+
+            def log_message(self, *args):
+                pass
+
+        self.server = http.server.ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+        self.server.daemon_threads = True
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+        self.url = f"http://127.0.0.1:{self.server.server_port}"
+
+    def shutdown(self):
+        with self.changed:
+            self.closing = True
+            self.changed.notify_all()
+        self.server.shutdown()
+
+
+class FakeCoreServer:
+    """
+    Minimal core/v1 API server for cold-start runs: lists ready cloudflared
+    pods, holds pod watches open, and serves the state ConfigMap. Every
+    request pays a fixed latency, like a real API server round trip.
+    """
+
+    def __init__(self, latency, pods=3):
+        self.closing = threading.Event()
+        self.requests = Counter()
+        fake = self
+        ready = [{"type": "Ready", "status": "True"}]
+        pod_list = {
+            "kind": "PodList", "apiVersion": "v1", "metadata": {"resourceVersion": "1"},
+            "items": [{"metadata": {"name": f"cloudflared-{i}", "resourceVersion": "1"},
+                       "status": {"phase": "Running", "conditions": ready, "podIP": f"10.0.0.{i + 1}"}}
+                      for i in range(pods)],
+        }
+
+        class Handler(http.server.BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+
+            def _reply(self, status, body):
+                data = json.dumps(body).encode()
+                self.send_response(status)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(data)))
+                self.end_headers()
+                self.wfile.write(data)
+
+            def _config_map(self):
+                name = urlparse(self.path).path.rsplit("/", 1)[-1]
+                return {"kind": "ConfigMap", "apiVersion": "v1",
+                        "metadata": {"name": name, "resourceVersion": "1"}, "data": {}}
+
+            def do_GET(self):
+                url = urlparse(self.path)
+                query = parse_qs(url.query)
+                watching = query.get("watch", ["false"])[0].lower() == "true"
+                fake.requests["watch" if watching else "pods" if url.path.endswith("/pods") else "configmap"] += 1
+                time.sleep(latency)
+                if watching:
+                    return self._watch(float(query.get("timeoutSeconds", ["300"])[0]))
+                if url.path.endswith("/pods"):
+                    return self._reply(200, pod_list)
+                self._reply(200, self._config_map())
+
+            def do_PATCH(self):
+                self.rfile.read(int(self.headers.get("Content-Length", 0)))
+                fake.requests["patch"] += 1
+                time.sleep(latency)
+                self._reply(200, self._config_map())
+
+            def _watch(self, timeout):
+                self.send_response(200)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Transfer-Encoding", "chunked")
+                self.end_headers()
+                fake.closing.wait(timeout)
+                try:
+                    self.wfile.write(b"0\r\n\r\n")
+                except (BrokenPipeError, ConnectionResetError):
+                    pass
+
+            def log_message(self, *args):
+                pass
+
+        self.server = http.server.ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+        self.server.daemon_threads = True
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+        self.url = f"http://127.0.0.1:{self.server.server_port}"
+
+    def shutdown(self):
+        self.closing.set()
+        self.server.shutdown()
+
+
+class StubDNSServer:
+    """
+    Local DNS server on one UDP+TCP port for exercising DNSClient. Answers
+    from `records` ({name: [(type, value, ttl)]}), following CNAMEs with
+    compressed owner names. `behaviour` picks the failure to act out:
+    "answer", "servfail", "drop" (never replies), "truncate" (TC=1 and no
+    answers over UDP, the full answer over TCP) or "stray" (a reply with the
+    wrong query id first).
+    """
+
+    TYPES = {"A": 1, "AAAA": 28, "CNAME": 5}
+
+    def __init__(self, records, behaviour="answer"):
+        self.records = records
+        self.behaviour = behaviour
+        self.queries = Counter()
+        for _ in range(20):
+            self.udp = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+            self.udp.bind(("127.0.0.1", 0))
+            self.port = self.udp.getsockname()[1]
+            self.tcp = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+            try:
+                self.tcp.bind(("127.0.0.1", self.port))
+                break
+            except OSError:
+                self.udp.close()
+                self.tcp.close()
+        self.tcp.listen(16)
+        self.address = f"127.0.0.1:{self.port}"
+        threading.Thread(target=self._serve_udp, daemon=True).start()
+        threading.Thread(target=self._serve_tcp, daemon=True).start()
+
+    @staticmethod
+    def _name(name):
+        return b"".join(bytes([len(label)]) + label.encode() for label in name.split(".")) + b"\x00"
+
+    def answer(self, query, tcp):
+        """Response bytes for one query, or None to stay silent"""
+        query_id = struct.unpack("!H", query[:2])[0]
+        offset, labels = 12, []
+        while query[offset]:
+            labels.append(query[offset + 1:offset + 1 + query[offset]].decode())
+            offset += 1 + query[offset]
+        qtype = struct.unpack("!H", query[offset + 1:offset + 3])[0]
+        question = query[12:offset + 5]
+        self.queries["tcp" if tcp else "udp"] += 1
+        if self.behaviour == "drop":
+            return None
+
+        rcode, truncated, body, count = 0, False, b"", 0
+        if self.behaviour == "servfail":
+            rcode = 2
+        elif self.behaviour == "truncate" and not tcp:
+            truncated = True
+        else:
+            name, owner = ".".join(labels), b"\xc0\x0c"  # pointer to the question name
+            while True:
+                rrset = self.records.get(name)
+                if rrset is None:
+                    rcode = 0 if count else 3  # NXDOMAIN
+                    break
+                cname = next(((value, ttl) for rtype, value, ttl in rrset if rtype == "CNAME"), None)
+                if cname:
+                    rdata = self._name(cname[0])
+                    record = owner + struct.pack("!HHIH", 5, 1, cname[1], len(rdata))
+                    target_offset = 12 + len(question) + len(body) + len(record)
+                    body += record + rdata
+                    count += 1
+                    # The next owner name points into this CNAME's rdata
+                    name, owner = cname[0], struct.pack("!H", 0xC000 | target_offset)
+                    continue
+                for rtype, value, ttl in rrset:
+                    if self.TYPES[rtype] == qtype:
+                        family = socket.AF_INET if rtype == "A" else socket.AF_INET6
+                        rdata = socket.inet_pton(family, value)
+                        body += owner + struct.pack("!HHIH", qtype, 1, ttl, len(rdata)) + rdata
+                        count += 1
+                break
+        flags = 0x8000 | 0x0100 | 0x0080 | (0x0200 if truncated else 0) | rcode  # QR RD RA [TC]
+        return struct.pack("!HHHHHH", query_id, flags, 1, count, 0, 0) + question + body
+
+    def _serve_udp(self):
+        while True:
+            try:
+                query, peer = self.udp.recvfrom(512)
+            except OSError:
+                return
+            response = self.answer(query, tcp=False)
+            if response is None:
+                continue
+            if self.behaviour == "stray":
+                self.udp.sendto(struct.pack("!H", struct.unpack("!H", response[:2])[0] ^ 0xFFFF) + response[2:], peer)
+            self.udp.sendto(response, peer)
+
+    def _serve_tcp(self):
+        while True:
+            try:
+                conn, _ = self.tcp.accept()
+            except OSError:
+                return
+            with conn:
+                length = struct.unpack("!H", conn.recv(2))[0]
+                query = b""
+                while len(query) < length:
+                    query += conn.recv(length - len(query))
+                response = self.answer(query, tcp=True)
+                if response is not None:
+                    conn.sendall(struct.pack("!H", len(response)) + response)
+
+    def shutdown(self):
+        self.udp.close()
+        self.tcp.close()
+
+
+class StaticDNSChecker:
+    """Skips real resolution so the benchmark measures the controller, not the network"""
+
+    last_answers = []
+
+    def get_actual_dns_target(self):
+        return app.DNSTarget.CLOUDFLARE_TUNNEL
+
+
+def run(size, latency, workers):
+    os.environ["MAX_CONCURRENT_RECONCILES"] = str(workers)
+    targets = [
+        app.ManagedHostname(
+            hostname=f"h{i}.bench.test", tunnel_id=TUNNEL_ID, vps_ip=VPS_IP, zone_id="bench-zone",
+            stabilization_failover_minutes=0, stabilization_failback_minutes=0,
+            state_key=f"h{i}.bench.test.json",
+        )
+        for i in range(size)
+    ]
+    records = [
+        {"id": f"rec{i}", "name": t.hostname, "type": "CNAME",
+         "content": f"{TUNNEL_ID}.cfargotunnel.com", "proxied": True}
+        for i, t in enumerate(targets)
+    ]
+    cloudflare = MockCloudflare(records, latency)
+
+    k8s = FakeCoreV1Api()
+    health_checker = app.HealthChecker(http=app.build_http_client(), k8s_core=k8s)
+    health_checker.pod_cache.relist()
+    cf_api = app.CloudflareAPI("bench", "bench-zone", http=health_checker.http)
+    cf_api.base_url = cloudflare.url
+
+    manager = app.FailoverManager(targets, health_checker=health_checker, cf_apis={"bench-zone": cf_api})
+    for c in manager.controllers.values():
+        c.dns_checker = StaticDNSChecker()
+        # Propagation tracking would poll real resolvers after every switch
+        c.propagation.watch = lambda expected: None
+    # Drive every cycle explicitly instead of from pod-change notifications
+    health_checker.pod_cache.listeners.clear()
+
+    results = {}
+
+    # Steady state: everything healthy, nothing to do
+    # Initial state writes are not part of either phase
+    manager.state_store.flush()
+
+    cloudflare.reset_counts()
+    k8s.patches = 0
+    start = time.perf_counter()
+    manager.reconcile_all()
+    manager.state_store.flush()
+    results["steady"] = (time.perf_counter() - start, {**cloudflare.requests, "PATCH": k8s.patches})
+
+    # Mass failover: pods go away, stabilization (0 min) then switch every record
+    k8s.running_pods = 0
+    health_checker.pod_cache.relist()
+    manager.reconcile_all()
+    manager.state_store.flush()
+    cloudflare.reset_counts()
+    k8s.patches = 0
+    start = time.perf_counter()
+    manager.reconcile_all()
+    # Write-behind: every transition of the cycle lands in one ConfigMap patch
+    manager.state_store.flush()
+    results["failover"] = (time.perf_counter() - start, {**cloudflare.requests, "PATCH": k8s.patches})
+
+    switched = sum(1 for c in manager.controllers.values()
+                   if c.state.current_target == app.DNSTarget.VPS_FAILOVER)
+    cloudflare.server.shutdown()
+    manager.reconcile_executor.shutdown(wait=False)
+    manager.probe_executor.shutdown(wait=False)
+    return results, switched
+
+
+# Classifier replaced by IPRangeIndex, kept here as the baseline
+LEGACY_PREFIXES = [
+    "104.16.", "104.17.", "104.18.", "104.19.", "104.20.", "104.21.",
+    "104.22.", "104.23.", "104.24.", "104.25.", "104.26.", "104.27.",
+    "172.64.", "172.65.", "172.66.", "172.67.", "172.68.", "172.69.",
+    "173.245.", "188.114.", "190.93.", "197.234.", "198.41."
+]
+
+
+def legacy_contains(ip):
+    for prefix in LEGACY_PREFIXES:
+        if ip.startswith(prefix):
+            return True
+    return False
+
+
+def bench_ip_index(args):
+    rng = random.Random(42)
+    index = app.get_cloudflare_ranges()
+    addresses = []
+    for _ in range(args.addresses):
+        if rng.random() < 0.2:
+            addresses.append(str(app.ipaddress.IPv6Address(rng.getrandbits(128))))
+        else:
+            addresses.append(str(app.ipaddress.IPv4Address(rng.getrandbits(32))))
+    # Make sure some addresses actually hit Cloudflare ranges
+    addresses[::10] = [f"104.{16 + i % 16}.{i % 256}.1" for i in range(len(addresses[::10]))]
+
+    start = time.perf_counter()
+    legacy = [legacy_contains(ip) for ip in addresses]
+    legacy_elapsed = time.perf_counter() - start
+
+    start = time.perf_counter()
+    indexed = index.classify_many(addresses)
+    index_elapsed = time.perf_counter() - start
+
+    disagreements = sum(1 for a, b in zip(legacy, indexed) if a != b)
+    n = len(addresses)
+    print(f"{'classifier':>14} {'addresses':>10} {'ns/lookup':>10} {'matches':>8}")
+    print(f"{'prefix scan':>14} {n:>10} {legacy_elapsed / n * 1e9:>10.0f} {sum(legacy):>8}")
+    print(f"{'interval index':>14} {n:>10} {index_elapsed / n * 1e9:>10.0f} {sum(indexed):>8}")
+    print(f"disagreements: {disagreements} (prefix scan over-matches whole /16s and misses IPv6 and 103.x/108.x/131.x/141.x/162.x)")
+
+
+def bench_reconcile(args):
+    app.logger.setLevel("ERROR")
+    print(f"{'hostnames':>9} {'phase':>9} {'seconds':>8} {'hosts/s':>9} {'GETs':>6} {'PUTs':>6} "
+          f"{'batches':>7} {'CM patches':>10}")
+    for size in (int(n) for n in args.sizes.split(",")):
+        results, switched = run(size, args.cf_latency_ms / 1000, args.workers)
+        for phase, (elapsed, counts) in results.items():
+            print(f"{size:>9} {phase:>9} {elapsed:>8.3f} {size / elapsed:>9.0f} "
+                  f"{counts['GET']:>6} {counts['PUT']:>6} {counts['POST']:>7} {counts['PATCH']:>10}")
+        if switched != size:
+            print(f"  WARNING: only {switched}/{size} hostnames failed over")
+
+
+def bench_leader(args):
+    """
+    Lease handoffs between replicas. Exits 1 if the old leader still leads at
+    takeover, a released Lease takes over a second to change hands, or a
+    crashed leader is replaced later than lease duration + one retry period.
+    """
+    app.logger.setLevel("ERROR")
+    lease_server = FakeLeaseServer()
+
+    def replica(name):
+        configuration = client.Configuration()
+        configuration.host = lease_server.url
+        coordination = client.CoordinationV1Api(client.ApiClient(configuration))
+        elector = app.LeaderElector(coordination, "bench", "ingress", name, address=f"http://{name}:8080",
+                                    lease_duration=args.lease_duration, retry_period=args.retry_period)
+        elector.start()
+        return elector
+
+    def takeover(old, new, crash):
+        """Seconds from stopping the leader until the standby leads; also checks for overlap"""
+        start = time.perf_counter()
+        old.stop(release=not crash)
+        while not new.is_leader():
+            if time.perf_counter() - start > args.lease_duration * 3:
+                raise RuntimeError(f"{new.identity} never took over")
+            time.sleep(0.0005)
+        return time.perf_counter() - start, old.is_leader()
+
+    leader = replica("replica-0")
+    while not leader.is_leader():
+        time.sleep(0.01)
+
+    results = {"release": [], "crash": []}
+    overlaps = 0
+    for i in range(args.rounds):
+        for mode in ("release", "crash"):
+            standby = replica(f"replica-{i}-{mode}")
+            # Let the standby observe the lease and open its watch
+            time.sleep(0.3)
+            elapsed, overlap = takeover(leader, standby, crash=mode == "crash")
+            results[mode].append(elapsed)
+            overlaps += overlap
+            leader = standby
+    leader.stop()
+    lease_server.shutdown()
+
+    print(f"lease_duration={args.lease_duration}s retry_period={args.retry_period}s "
+          f"renew_deadline={args.lease_duration * 2 / 3:.1f}s rounds={args.rounds}")
+    budgets = {"release": 1.0, "crash": args.lease_duration + args.retry_period}
+    print(f"{'handoff':>8} {'min ms':>9} {'median ms':>10} {'max ms':>9} {'budget ms':>10}  result")
+    failed = bool(overlaps)
+    for mode, samples in results.items():
+        ms = [x * 1000 for x in samples]
+        ok = max(samples) <= budgets[mode]
+        failed |= not ok
+        print(f"{mode:>8} {min(ms):>9.1f} {statistics.median(ms):>10.1f} {max(ms):>9.1f} "
+              f"{budgets[mode] * 1000:>10.0f}  {'ok' if ok else 'FAIL: over budget'}")
+    print(f"rounds where the old leader still considered itself leader at takeover: {overlaps}"
+          f"{'  FAIL' if overlaps else ''}")
+    if failed:
+        sys.exit(1)
+
+
+def bench_state(args):
+    """
+    Two instances writing one hostname's key in the state ConfigMap. Each
+    StateStore has no scheduler, so values are only written by an explicit
+    flush. Every transition is saved under state_lock, as in reconcile.
+    Saves and flushes run on a watchdog thread. Exits 1 if a check fails or
+    a step deadlocks.
+    """
+    app.logger.setLevel("CRITICAL")
+    os.environ["SYNTHETIC_PROBES"] = "false"
+    clock = app.ManualClock()
+    k8s = FakeCoreV1Api()
+    health_checker = app.HealthChecker(http=app.build_http_client(), k8s_core=k8s)
+    target = app.ManagedHostname(hostname="h0.bench.test", tunnel_id=TUNNEL_ID, vps_ip=VPS_IP,
+                                 zone_id="bench-zone", stabilization_failover_minutes=0,
+                                 stabilization_failback_minutes=0, state_key="h0.bench.test.json")
+
+    def instance():
+        return app.FailoverController(target, cf_api=app.CloudflareAPI("bench", "bench-zone"),
+                                      health_checker=health_checker, clock=clock,
+                                      state_store=app.StateStore(k8s, "dns-failover-state", "ingress"))
+
+    def guarded(fn):
+        done = threading.Event()
+        threading.Thread(target=lambda: (fn(), done.set()), daemon=True).start()
+        if not done.wait(5):
+            print(f"FAIL: {fn.__name__} deadlocked")
+            sys.exit(1)
+
+    def transition(c, **changes):
+        def save():
+            with c.state_lock:
+                for name, value in changes.items():
+                    setattr(c.state, name, value)
+                c._save_state()
+        guarded(save)
+
+    def flush(c):
+        guarded(c.state_store.flush)
+
+    def stored():
+        return json.loads(k8s.config_map[target.state_key])
+
+    a, b = instance(), instance()
+    clock.advance(60)
+    vps, tunnel = app.DNSTarget.VPS_FAILOVER, app.DNSTarget.CLOUDFLARE_TUNNEL
+    checks = []
+
+    # b fails over; a, still on the resourceVersion both read, saves an older state and must adopt b's
+    transition(b, current_target=vps, system_state=app.SystemState.ON_FAILOVER,
+               last_change_time=clock.utcnow().isoformat())
+    flush(b)
+    transition(a, last_alert_time=(clock.utcnow() - timedelta(seconds=30)).isoformat())
+    flush(a)
+    checks.append(("older write adopts the remote state",
+                   (a.state.current_target, a.snapshot.state.current_target, stored()["current_target"]),
+                   (vps, vps, vps.value)))
+
+    # b writes again without a transition; a then fails back with a newer change, which must win the 409
+    clock.advance(60)
+    transition(b, last_alert_time=clock.utcnow().isoformat())
+    flush(b)
+    clock.advance(1)
+    transition(a, current_target=tunnel, system_state=app.SystemState.PRIMARY_HEALTHY,
+               last_change_time=clock.utcnow().isoformat())
+    flush(a)
+    checks.append(("newer write is kept and rewritten",
+                   (a.state.current_target, stored()["current_target"]), (tunnel, tunnel.value)))
+    checks.append(("conflicts / adopted", (a.state_store.counts["conflicts"], a.state_store.counts["adopted"]),
+                   (2, 1)))
+
+    print(f"{'check':>36}  result")
+    failed = 0
+    for name, got, expected in checks:
+        ok = got == expected
+        failed += not ok
+        print(f"{name:>36}  {'ok' if ok else f'FAIL: got {got}, expected {expected}'}")
+    print(f"ConfigMap patches: {k8s.patches}, resourceVersion {k8s.resource_version}")
+    if failed:
+        sys.exit(1)
+
+
+def legacy_put(cf_api, hostname, data):
+    """Unqueued, unthrottled PUT per record (the client before the batch writer), kept as the baseline"""
+    record = cf_api.get_dns_record(hostname)
+    url = f"{cf_api.base_url}/zones/{cf_api.zone_id}/dns_records/{record['id']}"
+    try:
+        response = cf_api.http.put(url, headers=cf_api.headers, json=data, timeout=10)
+        response.raise_for_status()
+        return response.json().get("success", False)
+    except Exception:
+        return False
+
+
+def bench_cf_writes(args):
+    """
+    Mass switch against a rate-limited mock: half the records fail over, half
+    fail back. Modes with the token bucket must see no 429s and no failed
+    writes, with failovers done no later than failbacks; exits 1 otherwise.
+    """
+    app.logger.setLevel("CRITICAL")
+    logging.getLogger("urllib3").setLevel("ERROR")
+    hostnames = [f"h{i}.bench.test" for i in range(args.hostnames)]
+    # Burst plus refill over one window must stay within the server's limit
+    burst = args.limit // 4
+    rate = (args.limit - burst) / args.window
+    modes = [
+        ("legacy PUTs", None, False),
+        ("queued PUTs", False, False),
+        ("PUT + bucket", False, True),
+        ("batch + bucket", True, True),
+    ]
+    print(f"{args.hostnames} records, mock limit {args.limit} req/{args.window:g}s, "
+          f"client bucket {rate:g}/s burst {burst}, {args.workers} callers")
+    print(f"{'mode':>16} {'seconds':>8} {'requests':>9} {'429s':>5} {'failed':>7} "
+          f"{'failover max s':>15} {'failback max s':>15}  result")
+    failures = 0
+    for mode, batch, bucket in modes:
+        records = [
+            {"id": f"rec{i}", "name": name, "type": "CNAME" if i % 2 else "A",
+             "content": f"{TUNNEL_ID}.cfargotunnel.com" if i % 2 else VPS_IP, "proxied": bool(i % 2)}
+            for i, name in enumerate(hostnames)
+        ]
+        cloudflare = MockCloudflare(records, args.cf_latency_ms / 1000, rate_limit=(args.limit, args.window))
+        limiter = app.TokenBucket(rate, burst) if bucket else None
+        cf_api = app.CloudflareAPI("bench", "bench-zone", http=app.build_http_client(),
+                                   rate_limiter=limiter, batch_writes=bool(batch))
+        cf_api.base_url = cloudflare.url
+        cf_api.record_cache.refresh()
+        cloudflare.reset_counts()
+
+        def switch(i):
+            if batch is None:
+                vps = {"type": "A", "name": hostnames[i].split(".")[0], "content": VPS_IP, "proxied": False}
+                tunnel = {"type": "CNAME", "name": hostnames[i].split(".")[0],
+                          "content": f"{TUNNEL_ID}.cfargotunnel.com", "proxied": True}
+                ok = legacy_put(cf_api, hostnames[i], vps if i % 2 else tunnel)
+            elif i % 2:
+                ok = cf_api.update_to_vps(hostnames[i], VPS_IP)
+            else:
+                ok = cf_api.update_to_tunnel(hostnames[i], TUNNEL_ID)
+            return i % 2, ok, time.perf_counter() - start
+
+        start = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=args.workers) as pool:
+            outcomes = list(pool.map(switch, range(args.hostnames)))
+        elapsed = time.perf_counter() - start
+        cloudflare.server.shutdown()
+
+        failed = sum(1 for _, ok, _ in outcomes if not ok)
+        done = {kind: max(t for k, ok, t in outcomes if k == kind and ok) if any(
+            k == kind and ok for k, ok, _ in outcomes) else float("nan") for kind in (0, 1)}
+        requests_sent = cloudflare.requests["PUT"] + cloudflare.requests["POST"]
+        problems = []
+        if bucket:
+            if cloudflare.requests["429"]:
+                problems.append(f"{cloudflare.requests['429']} 429s")
+            if failed:
+                problems.append(f"{failed} failed")
+            # A batch answers all its callers at once; allow for thread wake-up order
+            if not done[1] <= done[0] + 0.05:
+                problems.append("failovers finished after failbacks")
+        failures += bool(problems)
+        result = "FAIL: " + "; ".join(problems) if problems else "ok" if bucket else "-"
+        print(f"{mode:>16} {elapsed:>8.2f} {requests_sent:>9} {cloudflare.requests['429']:>5} {failed:>7} "
+              f"{done[1]:>15.2f} {done[0]:>15.2f}  {result}")
+    if failures:
+        sys.exit(1)
+
+
+class InlineExecutor:
+    """Runs submitted work on the caller's thread: the simulation has no concurrency to reorder"""
+
+    def submit(self, fn, *args, **kwargs):
+        future = Future()
+        try:
+            future.set_result(fn(*args, **kwargs))
+        except Exception as e:
+            future.set_exception(e)
+        return future
+
+    def shutdown(self, wait=True):
+        pass
+
+
+class SimResponse:
+    def __init__(self, body, status_code=200):
+        self.body = body
+        self.status_code = status_code
+
+    def json(self):
+        return self.body
+
+    def raise_for_status(self):
+        if self.status_code >= 400:
+            raise requests.HTTPError(f"{self.status_code}")
+
+
+class SimWorld:
+    """
+    Everything outside the controller, on one virtual clock: cloudflared pods
+    (via FakeCoreV1Api), the tunnel's edge path, VPS reachability, the
+    Cloudflare zone and what public resolvers return.
+
+    Plugged in as CloudflareAPI.http, each Cloudflare request costs
+    `api_latency` virtual seconds. A request slower than its timeout raises
+    requests.Timeout once the timeout has passed. The cost is added to the
+    clock after each step, as if the reconcile had blocked for that long.
+    """
+
+    def __init__(self, clock, k8s, targets):
+        self.clock = clock
+        self.k8s = k8s
+        self.targets = {t.hostname: t for t in targets}
+        self.edge_up = True
+        self.vps_up = {}
+        self.api_latency = 0.0
+        self.staleness = 0.0
+        # Requests/errors per second through the tunnel, and the counters they add up to
+        self.traffic = (0.0, 0.0)
+        self.tunnel_counters = [0.0, 0.0]
+        self.counted_at = 0.0
+        self.debt = 0.0
+        self.calls = Counter()
+        self.records = {
+            f"rec{i}": {"id": f"rec{i}", "name": t.hostname, "type": "CNAME",
+                        "content": f"{t.tunnel_id}.cfargotunnel.com", "proxied": True}
+            for i, t in enumerate(targets)
+        }
+        # hostname -> [(virtual time, type, content)], oldest first
+        self.history = {r["name"]: [(float("-inf"), r["type"], r["content"])] for r in self.records.values()}
+        self.writes = []
+
+    def now(self):
+        return self.clock.monotonic() + self.debt
+
+    # Cloudflare API (HTTPClient interface)
+
+    def _cost(self, timeout):
+        if self.api_latency > (timeout or float("inf")):
+            self.debt += timeout
+            raise requests.Timeout(f"Cloudflare API did not answer within {timeout}s")
+        self.debt += self.api_latency
+
+    def _write(self, record, data):
+        record.update(type=data["type"], content=data["content"], proxied=data["proxied"])
+        self.history[record["name"]].append((self.now(), data["type"], data["content"]))
+        self.writes.append((self.now(), record["name"], data["type"]))
+
+    def get(self, url, headers=None, params=None, timeout=None):
+        self.calls["GET"] += 1
+        self._cost(timeout)
+        return SimResponse({"success": True, "result": [dict(r) for r in self.records.values()],
+                            "result_info": {"page": 1, "total_pages": 1}})
+
+    def put(self, url, headers=None, json=None, timeout=None):
+        self.calls["PUT"] += 1
+        self._cost(timeout)
+        record = self.records[url.rsplit("/", 1)[1]]
+        self._write(record, json)
+        return SimResponse({"success": True, "result": dict(record)})
+
+    def post(self, url, headers=None, json=None, timeout=None):
+        self.calls["POST"] += 1
+        self._cost(timeout)
+        updated = []
+        for put in json["puts"]:
+            self._write(self.records[put["id"]], put)
+            updated.append(dict(self.records[put["id"]]))
+        return SimResponse({"success": True, "result": {"puts": updated}})
+
+    # What clients see
+
+    def served(self, hostname):
+        """(type, content) public resolvers return now - the record as it was `staleness` ago"""
+        seen_at = self.clock.monotonic() - self.staleness
+        return [(kind, content) for t, kind, content in self.history[hostname] if t <= seen_at][-1]
+
+    def classify(self, hostname, served):
+        kind, content = served
+        if kind == "A" and content in self.targets[hostname].vps_ips:
+            return app.DNSTarget.VPS_FAILOVER
+        if kind == "CNAME":
+            return app.DNSTarget.CLOUDFLARE_TUNNEL
+        return app.DNSTarget.UNKNOWN
+
+    def serving(self):
+        """Whether any cloudflared pod is actually serving"""
+        return self.k8s.running_pods > 0 and self.k8s.pods_ready
+
+    def metrics(self, ip):
+        """TunnelScraper._scrape_pod stand-in: the first pod carries all the traffic"""
+        now = self.clock.monotonic()
+        for i, rate in enumerate(self.traffic):
+            self.tunnel_counters[i] += rate * (now - self.counted_at)
+        self.counted_at = now
+        first = ip == "10.0.0.1"
+        return {"ha_connections": 4.0 if self.edge_up and self.serving() else 0.0,
+                "requests": self.tunnel_counters[0] if first else 0.0,
+                "errors": self.tunnel_counters[1] if first else 0.0, "rtt_ms": 20.0}
+
+    def check(self, probe):
+        """SyntheticProber.check stand-in"""
+        if probe.group == "vps":
+            ok = self.vps_up.get(urlparse(probe.url).hostname, True)
+        elif probe.group == "public":
+            kind, content = self.served(probe.hostname)
+            ok = self.vps_up.get(content, True) if kind == "A" else self.edge_up and self.serving()
+        else:
+            ok = self.serving()
+        return ok, None if ok else "HTTP 502"
+
+
+class SimDNSChecker:
+    """DNSChecker stand-in: what the (possibly stale) public resolvers return"""
+
+    last_answers = []
+
+    def __init__(self, world, hostname):
+        self.world = world
+        self.hostname = hostname
+
+    def get_actual_dns_target(self):
+        return self.world.classify(self.hostname, self.world.served(self.hostname))
+
+
+def flap(start, end, period, down):
+    """Edge path down for `down` seconds out of every `period`"""
+    events = []
+    for t in range(start, end, period):
+        events += [(t, "edge", False), (t + down, "edge", True)]
+    return events
+
+
+# name -> scripted outage. `fault`/`recover` are the instants time-to-detect,
+# time-to-switch and time-to-failback are measured from; the budgets are the
+# regression gates (seconds, None = not expected to happen).
+SCENARIOS = {
+    "pod-crash": {
+        "about": "every cloudflared pod crashes for 20 min",
+        "events": [(60, "pods", 0), (1260, "pods", 3)],
+        "fault": 60, "recover": 1260, "duration": 2400,
+        "switches": 2, "detect": 5, "switch": 100, "failback": 610,
+    },
+    "pod-crashloop": {
+        "about": "every cloudflared pod stays Running but not Ready (CrashLoopBackOff) for 20 min",
+        "events": [(60, "ready", False), (1260, "ready", True)],
+        "fault": 60, "recover": 1260, "duration": 2400,
+        "switches": 2, "detect": 5, "switch": 100, "failback": 610,
+    },
+    "quiet-errors": {
+        "about": "pods and edge up; one request per scrape interval, every one failing, for 10 min",
+        "events": [(60, "traffic", (0.2, 0.2)), (660, "traffic", (0.0, 0.0))],
+        "fault": 60, "recover": None, "duration": 1200, "scrape": True,
+        "switches": 0, "detect": None, "switch": None, "failback": None,
+    },
+    "tunnel-flap": {
+        "about": "pods stay up, the edge path drops 20s of every 120s for 30 min",
+        "events": flap(60, 1860, 120, 20),
+        "fault": 60, "recover": None, "duration": 2400,
+        "switches": 0, "detect": 30, "switch": None, "failback": None,
+    },
+    "api-slowness": {
+        "about": "pods crash while the Cloudflare API takes 15s per call (timeout 10s) for 5 min",
+        "events": [(50, "api_latency", 15.0), (60, "pods", 0), (350, "api_latency", 0.2), (1260, "pods", 3)],
+        "fault": 60, "recover": 1260, "duration": 2400,
+        "switches": 2, "detect": 15, "switch": 310, "failback": 610,
+    },
+    "resolver-staleness": {
+        "about": "pods crash; public resolvers keep serving the old record for 5 min (TTL)",
+        "events": [(0, "staleness", 300.0), (60, "pods", 0), (1260, "pods", 3)],
+        "fault": 60, "recover": 1260, "duration": 2700,
+        "switches": 2, "detect": 5, "switch": 100, "failback": 610,
+    },
+    "dual-failure": {
+        "about": "pods crash while the VPS is unreachable too",
+        "events": [(0, "vps", False), (60, "pods", 0), (600, "pods", 3)],
+        "fault": 60, "recover": 600, "duration": 1200,
+        "switches": 0, "detect": 5, "switch": None, "failback": None,
+    },
+}
+
+
+def simulate(name, scenario, hostnames=1, step=1.0):
+    """Replay one scenario through a FailoverManager on a ManualClock; returns the report row"""
+    os.environ["CLOUDFLARED_METRICS_SCRAPE"] = "false"
+    clock = app.ManualClock()
+    targets = [
+        app.ManagedHostname(
+            hostname=f"h{i}.sim.test", tunnel_id=TUNNEL_ID, vps_ip=VPS_IP, zone_id="sim-zone",
+            stabilization_failover_minutes=1.5, stabilization_failback_minutes=10,
+            state_key=f"h{i}.sim.test.json",
+        )
+        for i in range(hostnames)
+    ]
+    k8s = FakeCoreV1Api()
+    world = SimWorld(clock, k8s, targets)
+    health_checker = app.HealthChecker(http=app.build_http_client(), k8s_core=k8s)
+    health_checker.pod_cache.relist()
+    if scenario.get("scrape"):
+        # cloudflared metrics from the world, scraped inline on the virtual clock
+        health_checker.tunnel = app.TunnelScraper(health_checker.pod_cache, health_checker.http, clock=clock)
+        health_checker.tunnel.executor = InlineExecutor()
+        health_checker.tunnel._scrape_pod = world.metrics
+    cf_api = app.CloudflareAPI("sim", "sim-zone", http=world, clock=clock)
+    manager = app.FailoverManager(targets, health_checker=health_checker, cf_apis={"sim-zone": cf_api},
+                                  clock=clock)
+
+    # No threads on the decision path: probes, reconciles and synthetic checks run inline
+    cycles = Counter()
+    manager.reconcile_executor = InlineExecutor()
+    manager.prober.executor = InlineExecutor()
+    manager.prober.check = world.check
+    for c in manager.controllers.values():
+        c.probe_executor = InlineExecutor()
+        c.dns_checker = SimDNSChecker(world, c.hostname)
+        c.propagation.watch = lambda expected: None
+
+        def counted(reconcile=c.reconcile, hostname=c.hostname):
+            cycles[hostname] += 1
+            reconcile()
+        c.reconcile = counted
+    manager.scheduler.schedule("reconcile", 0, manager._reconcile_tick)
+    manager.prober.start()
+
+    events = sorted(scenario["events"], key=lambda e: e[0])
+    first = next(iter(manager.controllers.values()))
+    detected = visible = None
+    k8s_before = (k8s.lists, k8s.patches)
+    while clock.monotonic() <= scenario["duration"]:
+        while events and events[0][0] <= clock.monotonic():
+            _, kind, value = events.pop(0)
+            if kind == "pods":
+                k8s.running_pods = value
+                health_checker.pod_cache.relist()
+            elif kind == "ready":
+                k8s.pods_ready = value
+                health_checker.pod_cache.relist()
+            elif kind == "edge":
+                world.edge_up = value
+            elif kind == "vps":
+                world.vps_up[VPS_IP] = value
+            elif kind == "api_latency":
+                world.api_latency = value
+            elif kind == "staleness":
+                world.staleness = value
+            elif kind == "traffic":
+                world.metrics("10.0.0.1")  # bank the old rate up to now
+                world.traffic = value
+        # Settle: timers may queue reconciles, reconciles may arm timers
+        while manager.scheduler.run_due() + manager.queue.run_pending():
+            pass
+        if world.debt:
+            clock.advance(world.debt)
+            world.debt = 0.0
+        now = clock.monotonic()
+        if detected is None and now >= scenario["fault"] and (
+                first.state.stabilization_start or first.state.system_state != app.SystemState.PRIMARY_HEALTHY):
+            detected = now
+        if visible is None and world.writes and \
+                first.last_probes.get("dns", {}).get("value") == app.DNSTarget.VPS_FAILOVER.value:
+            visible = now
+        clock.advance(step)
+    manager.state_store.flush()
+
+    fault, recover = scenario["fault"], scenario["recover"]
+    to_vps = [t for t, _, kind in world.writes if kind == "A" and t >= fault]
+    to_tunnel = [t for t, _, kind in world.writes if kind == "CNAME" and recover is not None and t >= recover]
+    total_cycles = sum(cycles.values())
+    switches = len(world.writes) // hostnames
+    row = {
+        "scenario": name,
+        "detect": detected - fault if detected is not None else None,
+        "switch": max(to_vps) - fault if len(to_vps) >= hostnames else None,
+        "visible": visible - fault if visible is not None else None,
+        "failback": max(to_tunnel) - recover if len(to_tunnel) >= hostnames else None,
+        "cf_per_cycle": sum(world.calls.values()) / max(total_cycles, 1),
+        "k8s_per_cycle": (k8s.lists + k8s.patches - sum(k8s_before)) / max(total_cycles, 1),
+        "cycles": total_cycles,
+        "switches": switches,
+        "flaps": max(switches - scenario["switches"], 0),
+        "final": first.state.system_state.value,
+    }
+    failures = []
+    if switches != scenario["switches"]:
+        failures.append(f"{switches} switches, expected {scenario['switches']}")
+    for metric in ("detect", "switch", "failback"):
+        budget, value = scenario[metric], row[metric]
+        if budget is None:
+            continue
+        if value is None or value > budget:
+            failures.append(f"{metric} {value if value is None else round(value, 1)}s > {budget}s budget")
+    row["failures"] = failures
+    manager.prober.started = False
+    return row
+
+
+def bench_simulate(args):
+    app.logger.setLevel("DEBUG" if args.verbose else "CRITICAL")
+    names = [args.scenario] if args.scenario else list(SCENARIOS)
+
+    def fmt(value, width):
+        return f"{'-':>{width}}" if value is None else f"{value:>{width}.0f}"
+
+    print(f"{'scenario':>19} {'detect s':>8} {'switch s':>8} {'visible s':>9} {'failback s':>10} "
+          f"{'CF/cycle':>8} {'k8s/cycle':>9} {'cycles':>6} {'switches':>8} {'flaps':>5}  result")
+    failed = 0
+    for name in names:
+        row = simulate(name, SCENARIOS[name], hostnames=args.hostnames)
+        failed += bool(row["failures"])
+        print(f"{name:>19} {fmt(row['detect'], 8)} {fmt(row['switch'], 8)} {fmt(row['visible'], 9)} "
+              f"{fmt(row['failback'], 10)} {row['cf_per_cycle']:>8.2f} {row['k8s_per_cycle']:>9.2f} "
+              f"{row['cycles']:>6} {row['switches']:>8} {row['flaps']:>5}  "
+              f"{'ok' if not row['failures'] else 'FAIL: ' + '; '.join(row['failures'])}")
+    if failed:
+        sys.exit(1)
+
+
+def app_env(core, **overrides):
+    """Environment for an app.py child process: kubeconfig pointing at the fake API server"""
+    kubeconfig = os.path.join(tempfile.mkdtemp(prefix="dns-failover-bench-"), "kubeconfig")
+    with open(kubeconfig, "w") as f:
+        json.dump({
+            "apiVersion": "v1", "kind": "Config", "current-context": "bench",
+            "clusters": [{"name": "bench", "cluster": {"server": core.url}}],
+            "users": [{"name": "bench", "user": {"token": "bench"}}],
+            "contexts": [{"name": "bench", "context": {"cluster": "bench", "user": "bench"}}],
+        }, f)
+    env = {**os.environ, "KUBECONFIG": kubeconfig, "HOSTNAME": "bench.invalid",
+           "CLOUDFLARE_API_TOKEN": "bench", "CLOUDFLARE_ZONE_ID": "bench", "DRY_RUN": "true", **overrides}
+    env.pop("KUBERNETES_SERVICE_HOST", None)
+    return env
+
+
+def launch(app_path, env, script, timeout=30.0):
+    """Start app.py; returns the process, seconds until /health answers and until ready, and the phase report"""
+    base = "http://127.0.0.1:8080"
+    command = [sys.executable, app_path] if script else [sys.executable, "-m", "app"]
+    if not script:
+        # The image byte-compiles app.py at build time; `python -m app` then skips compiling it
+        py_compile.compile(app_path)
+    start = time.perf_counter()
+    proc = subprocess.Popen(command, env=env, cwd=os.path.dirname(app_path),
+                            stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    live = ready = None
+    phases = {}
+    try:
+        while ready is None:
+            if proc.poll() is not None:
+                raise RuntimeError(f"{app_path} exited with {proc.returncode}")
+            if time.perf_counter() - start > timeout:
+                raise RuntimeError(f"{app_path} not ready after {timeout}s")
+            try:
+                if live is None:
+                    if requests.get(f"{base}/health", timeout=1).status_code == 200:
+                        live = time.perf_counter() - start
+                    continue
+                response = requests.get(f"{base}/ready", timeout=1)
+                if response.status_code == 404:
+                    # No readiness endpoint: /health only answered once everything was up
+                    ready = live
+                elif response.status_code == 200:
+                    ready = time.perf_counter() - start
+                    phases = response.json()["phases_ms"]
+            except requests.ConnectionError:
+                pass
+            time.sleep(0.02)
+    except BaseException:
+        stop(proc)
+        raise
+    return proc, live, ready, phases
+
+
+def stop(proc):
+    proc.terminate()
+    proc.wait(timeout=10)
+
+
+def describe(app_path, script):
+    return f"{'python ' + app_path if script else 'python -m app'} ({app_path})"
+
+
+def bench_startup(args):
+    core = FakeCoreServer(args.api_latency_ms / 1000)
+    env = app_env(core)
+    app_path = os.path.abspath(args.app or app.__file__)
+    lives, readies = [], []
+    phases = {}
+    for _ in range(args.runs):
+        proc, live, ready, phases = launch(app_path, env, args.script)
+        stop(proc)
+        lives.append(live * 1000)
+        readies.append(ready * 1000)
+    core.shutdown()
+
+    print(f"{describe(app_path, args.script)} runs={args.runs} api_latency={args.api_latency_ms}ms")
+    print(f"{'':>12} {'min ms':>9} {'median ms':>10} {'max ms':>9}")
+    for label, samples in (("/health 200", lives), ("ready", readies)):
+        print(f"{label:>12} {min(samples):>9.0f} {statistics.median(samples):>10.0f} {max(samples):>9.0f}")
+    if phases:
+        print("last run phases: " + ", ".join(f"{name}={ms:.0f}ms" for name, ms in phases.items()))
+    print(f"API requests over all runs: {dict(core.requests)}")
+
+
+SINGLE_HOST_SCRIPT = """
+import json, app
+c = app.FailoverController()
+print(json.dumps({"hostname": c.hostname, "target": c.state.current_target.value,
+                  "pods_healthy": c.health_checker.check_cloudflared_pods_healthy()}))
+"""
+
+
+def bench_single_host(args):
+    """FailoverController() with no arguments (single-host mode) in a child process; exits 1 if it fails"""
+    core = FakeCoreServer(0.001)
+    start = time.perf_counter()
+    result = subprocess.run([sys.executable, "-c", SINGLE_HOST_SCRIPT], env=app_env(core),
+                            cwd=os.path.dirname(os.path.abspath(app.__file__)),
+                            capture_output=True, text=True, timeout=60)
+    elapsed = time.perf_counter() - start
+    core.shutdown()
+    expected = {"hostname": "bench.invalid", "target": app.DNSTarget.CLOUDFLARE_TUNNEL.value, "pods_healthy": True}
+    try:
+        got = json.loads(result.stdout.strip().splitlines()[-1])
+    except (IndexError, ValueError):
+        got = None
+    if result.returncode != 0 or got != expected:
+        print(f"FAIL after {elapsed:.1f}s: exit {result.returncode}, got {got}, expected {expected}")
+        print(result.stderr[-2000:])
+        sys.exit(1)
+    print(f"FailoverController() built in {elapsed:.1f}s: {got}  ok")
+
+
+def alertmanager_payload(seq, alerts):
+    """Alertmanager webhook body with `alerts` firing alerts, fingerprints unique to this request"""
+    common = {"alertname": "CloudflaredPodsDown", "namespace": "ingress", "severity": "critical",
+              "hostname": "bench.invalid"}
+    return json.dumps({
+        "version": "4", "groupKey": f"{{}}:{{alertname=\"{common['alertname']}\"}}", "truncatedAlerts": 0,
+        "status": "firing", "receiver": "dns-failover", "externalURL": "http://alertmanager.monitoring:9093",
+        "groupLabels": {"alertname": common["alertname"]}, "commonLabels": common,
+        "commonAnnotations": {"summary": "cloudflared pods are not ready"},
+        "alerts": [{
+            "status": "firing",
+            "labels": {**common, "pod": f"cloudflared-{i}", "instance": f"10.0.{i // 250}.{i % 250}:2000"},
+            "annotations": {"summary": "cloudflared pod is not ready",
+                            "description": f"Pod ingress/cloudflared-{i} has not been ready for more than 1 minute."},
+            "startsAt": "2024-01-01T00:00:00Z", "endsAt": "0001-01-01T00:00:00Z",
+            "generatorURL": "http://prometheus.monitoring:9090/graph?g0.expr=kube_pod_status_ready",
+            "fingerprint": f"{seq:08x}{i:08x}",
+        } for i in range(alerts)],
+    }).encode()
+
+
+def bench_webhook(args):
+    core = FakeCoreServer(0.001)
+    env = app_env(core, HTTP_SERVER=args.server)
+    app_path = os.path.abspath(args.app or app.__file__)
+    proc, _, _, _ = launch(app_path, env, args.script)
+    url = "http://127.0.0.1:8080/webhook"
+    bodies = [alertmanager_payload(seq, args.alerts) for seq in range(args.requests)]
+    local = threading.local()
+
+    def post(body):
+        session = getattr(local, "session", None)
+        if session is None:
+            session = local.session = requests.Session()
+        start = time.perf_counter()
+        response = session.post(url, data=body, headers={"Content-Type": "application/json"}, timeout=30)
+        return time.perf_counter() - start, response.status_code
+
+    try:
+        with ThreadPoolExecutor(max_workers=args.concurrency) as pool:
+            list(pool.map(post, bodies[:args.concurrency]))  # warm up connections
+            start = time.perf_counter()
+            results = list(pool.map(post, bodies))
+            elapsed = time.perf_counter() - start
+        oversized = requests.post(url, data=b" " * (2 * 1024 * 1024), timeout=30).status_code
+    finally:
+        stop(proc)
+        core.shutdown()
+
+    latencies = sorted(latency * 1000 for latency, _ in results)
+    print(f"{describe(app_path, args.script)} HTTP_SERVER={args.server}")
+    print(f"requests={args.requests} concurrency={args.concurrency} alerts/request={args.alerts} "
+          f"body={len(bodies[0]) / 1024:.1f}KiB")
+    print(f"{'req/s':>8} {'p50 ms':>8} {'p99 ms':>8} {'max ms':>8}  status")
+    print(f"{len(results) / elapsed:>8.0f} {latencies[len(latencies) // 2]:>8.1f} "
+          f"{latencies[int(len(latencies) * 0.99)]:>8.1f} {latencies[-1]:>8.1f}  "
+          f"{dict(Counter(status for _, status in results))}")
+    print(f"2 MiB body -> {oversized}")
+
+
+def bench_dns(args):
+    """DNSClient and quorum voting against local stub servers; exits 1 if any check fails"""
+    app.logger.setLevel("ERROR")
+    zone = {
+        "dual.test": [("A", "198.51.100.7", 300), ("AAAA", "2001:db8::7", 60)],
+        "www.test": [("CNAME", "edge.test", 300)],
+        "edge.test": [("CNAME", "origin.edge.test", 120)],
+        "origin.edge.test": [("A", "104.16.1.1", 30), ("A", "104.16.1.2", 90)],
+        "vps.test": [("A", VPS_IP, 60)],
+    }
+    tunnel_zone = {"vps.test": [("A", "104.16.1.1", 60)]}
+    servers = {behaviour: StubDNSServer(zone, behaviour)
+               for behaviour in ("answer", "servfail", "drop", "truncate", "stray")}
+    tunnel_server = StubDNSServer(tunnel_zone)
+    client = app.DNSClient()
+    timeout = args.timeout
+
+    def resolve(behaviour, name, qtypes=("A", "AAAA")):
+        return client.resolve(("127.0.0.1", servers[behaviour].port), name, list(qtypes), timeout)
+
+    def raises(fn, error):
+        try:
+            fn()
+        except error as e:
+            return type(e).__name__
+        raise AssertionError(f"expected {error.__name__}")
+
+    def quorum(addresses):
+        resolvers = app.MultiResolver(addresses, timeout=timeout)
+        return app.DNSChecker("vps.test", [VPS_IP], resolvers=resolvers)._quorum_target()
+
+    answer, servfail, drop, tunnel = (servers["answer"].address, servers["servfail"].address,
+                                      servers["drop"].address, tunnel_server.address)
+    checks = [
+        ("A+AAAA", lambda: resolve("answer", "dual.test"),
+         (["198.51.100.7", "2001:db8::7"], 60, "udp")),
+        ("CNAME chain", lambda: resolve("answer", "www.test"), (["104.16.1.1", "104.16.1.2"], 30, "udp")),
+        ("truncated -> TCP", lambda: resolve("truncate", "dual.test"),
+         (["198.51.100.7", "2001:db8::7"], 60, "tcp")),
+        ("stray query id ignored", lambda: resolve("stray", "dual.test"),
+         (["198.51.100.7", "2001:db8::7"], 60, "udp")),
+        ("NXDOMAIN", lambda: resolve("answer", "missing.test"), ([], None, "udp")),
+        ("SERVFAIL", lambda: raises(lambda: resolve("servfail", "dual.test"), RuntimeError), "RuntimeError"),
+        ("timeout", lambda: raises(lambda: resolve("drop", "dual.test"), TimeoutError), "TimeoutError"),
+        ("quorum 2/3 vps", lambda: quorum([answer, answer, tunnel]), app.DNSTarget.VPS_FAILOVER),
+        ("quorum split", lambda: quorum([answer, tunnel, servfail]), app.DNSTarget.UNKNOWN),
+        ("quorum 2 failing", lambda: quorum([answer, servfail, drop]), app.DNSTarget.UNKNOWN),
+    ]
+
+    print(f"{'check':>24} {'ms':>7}  result")
+    failed = 0
+    for name, fn, expected in checks:
+        start = time.perf_counter()
+        try:
+            got = fn()
+            if isinstance(got, tuple):
+                got = (sorted(got[0]), got[1], got[2])
+            ok = got == expected
+            detail = "ok" if ok else f"FAIL: got {got}, expected {expected}"
+        except Exception as e:
+            ok, detail = False, f"FAIL: {type(e).__name__}: {e}"
+        failed += not ok
+        print(f"{name:>24} {(time.perf_counter() - start) * 1000:>7.1f}  {detail}")
+    print(f"queries: { {b: dict(s.queries) for b, s in servers.items()} }")
+    for server in [*servers.values(), tunnel_server]:
+        server.shutdown()
+    if failed:
+        sys.exit(1)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    commands = parser.add_subparsers(dest="command")
+
+    reconcile = commands.add_parser("reconcile", help="multi-hostname reconcile throughput")
+    reconcile.add_argument("--sizes", default="10,100,1000")
+    reconcile.add_argument("--cf-latency-ms", type=float, default=20)
+    reconcile.add_argument("--workers", type=int, default=8)
+    reconcile.set_defaults(func=bench_reconcile)
+
+    ip_index = commands.add_parser("ip-index", help="Cloudflare range classification")
+    ip_index.add_argument("--addresses", type=int, default=100000)
+    ip_index.set_defaults(func=bench_ip_index)
+
+    dns = commands.add_parser("dns", help="DNS client and quorum checks against local stub servers")
+    dns.add_argument("--timeout", type=float, default=0.3)
+    dns.set_defaults(func=bench_dns)
+
+    leader = commands.add_parser("leader", help="Lease handoff time against a fake API server")
+    leader.add_argument("--rounds", type=int, default=3)
+    leader.add_argument("--lease-duration", type=int, default=3)
+    leader.add_argument("--retry-period", type=float, default=1)
+    leader.set_defaults(func=bench_leader)
+
+    state = commands.add_parser("state", help="state ConfigMap 409 conflicts between two instances")
+    state.set_defaults(func=bench_state)
+
+    cf_writes = commands.add_parser("cf-writes", help="mass record switch under a Cloudflare rate limit")
+    cf_writes.add_argument("--hostnames", type=int, default=200)
+    cf_writes.add_argument("--limit", type=int, default=40)
+    cf_writes.add_argument("--window", type=float, default=2)
+    cf_writes.add_argument("--cf-latency-ms", type=float, default=20)
+    cf_writes.add_argument("--workers", type=int, default=16)
+    cf_writes.set_defaults(func=bench_cf_writes)
+
+    simulate_cmd = commands.add_parser("simulate", help="scripted outages on a virtual clock, with regression budgets")
+    simulate_cmd.add_argument("--scenario", choices=sorted(SCENARIOS))
+    simulate_cmd.add_argument("--hostnames", type=int, default=1)
+    simulate_cmd.add_argument("--verbose", action="store_true")
+    simulate_cmd.set_defaults(func=bench_simulate)
+
+    startup_cmd = commands.add_parser("startup", help="cold start of app.py against a fake API server")
+    startup_cmd.add_argument("--runs", type=int, default=5)
+    startup_cmd.add_argument("--api-latency-ms", type=float, default=5)
+    startup_cmd.add_argument("--app", help="app.py to measure (default: this one)")
+    startup_cmd.add_argument("--script", action="store_true", help="run as `python app.py` (the old image CMD)")
+    startup_cmd.set_defaults(func=bench_startup)
+
+    single = commands.add_parser("single-host", help="FailoverController() with no arguments against a fake API server")
+    single.set_defaults(func=bench_single_host)
+
+    webhook = commands.add_parser("webhook", help="Alertmanager webhook load test against app.py")
+    webhook.add_argument("--requests", type=int, default=2000)
+    webhook.add_argument("--concurrency", type=int, default=16)
+    webhook.add_argument("--alerts", type=int, default=20, help="alerts per webhook")
+    webhook.add_argument("--server", choices=("waitress", "development"), default="waitress")
+    webhook.add_argument("--app", help="app.py to measure (default: this one)")
+    webhook.add_argument("--script", action="store_true", help="run as `python app.py`")
+    webhook.set_defaults(func=bench_webhook)
+
+    args = parser.parse_args()
+    if not args.command:
+        parser.print_help()
+        return
+    args.func(args)
+
+
+if __name__ == "__main__":
+    main()